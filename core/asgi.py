@@ -19,3 +19,8 @@ application = ProtocolTypeRouter(
         "websocket": URLRouter(routing.websocket_urlpatterns),
     }
 )
+
+# Only in the server processes, after the application set Django up
+from race.scheduler import racing_start_later  # noqa: E402
+
+racing_start_later()
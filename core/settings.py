@@ -90,6 +90,7 @@ MIDDLEWARE = [
     "django.contrib.auth.middleware.AuthenticationMiddleware",
     "django.contrib.messages.middleware.MessageMiddleware",
     "django.middleware.clickjacking.XFrameOptionsMiddleware",
+    "race.middleware.GenerationScopeMiddleware",
 ]
 
 ROOT_URLCONF = "core.urls"
@@ -263,6 +264,16 @@ CHANNEL_LAYERS = {
         },
     },
 }
+
+# Shared by the server processes: the current round, the round event
+# sequences, the station message ids and the generations of the race
+# state caches of each process (see race/generations.py)
+CACHES = {
+    "default": {
+        "BACKEND": "django.core.cache.backends.redis.RedisCache",
+        "LOCATION": "redis://redis:6379/1",
+    },
+}
 # __CELERY__
 
 # __OAUTH_GITHUB__
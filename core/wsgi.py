@@ -14,3 +14,8 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "core.settings")
 
 application = get_wsgi_application()
+
+# Only in the server processes, after the application set Django up
+from race.scheduler import racing_start_later  # noqa: E402
+
+racing_start_later()
@@ -0,0 +1,78 @@
+# race/benchdb.py
+"""
+Throwaway database for the benchmark commands.
+
+The benchmarks create rounds, teams, penalties and stations. In the
+database of a running server, its deadline scheduler and penalty dispatcher
+would act on them. They run on a test database instead, created for them
+and dropped afterwards as the testserver command does, with a cache and a
+channel layer local to the process, so nothing reaches the server.
+"""
+
+import datetime as dt
+import os
+import shutil
+import tempfile
+from contextlib import contextmanager
+from django.db import connection
+from django.test import override_settings
+
+LOCAL_SETTINGS = {
+    "CACHES": {
+        "default": {
+            "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+            "LOCATION": "bench",
+        }
+    },
+    "CHANNEL_LAYERS": {"default": {"BACKEND": "channels.layers.InMemoryChannelLayer"}},
+}
+
+
+@contextmanager
+def bench_database(verbosity=0):
+    """Run the block on a new, empty, database."""
+    old_name = connection.settings_dict["NAME"]
+    test_settings = connection.settings_dict["TEST"]
+    old_test_name = test_settings.get("NAME")
+    directory = None
+    if connection.vendor == "sqlite":
+        # A file, the threads of the benchmarks write to it concurrently and
+        # the shared memory database locks whole tables
+        directory = tempfile.mkdtemp(prefix="bench-")
+        test_settings["NAME"] = os.path.join(directory, "bench.sqlite3")
+    try:
+        with override_settings(**LOCAL_SETTINGS):
+            connection.close()
+            connection.creation.create_test_db(
+                verbosity=verbosity, autoclobber=True, serialize=False
+            )
+            try:
+                yield
+            finally:
+                connection.creation.destroy_test_db(old_name, verbosity)
+    finally:
+        test_settings["NAME"] = old_test_name
+        if directory is not None:
+            shutil.rmtree(directory, ignore_errors=True)
+
+
+def bench_championship(name):
+    """A championship running today, for the bench rounds."""
+    from .models import Championship
+
+    today = dt.date.today()
+    return Championship.objects.create(name=name, start=today, end=today)
+
+
+def bench_teams(cround, count):
+    """Register count teams for the round, returns their round_team"""
+    from .models import Team, championship_team, round_team
+
+    teams = []
+    for n in range(count):
+        team = Team.objects.create(name=f"Bench team {n + 1}")
+        entry = championship_team.objects.create(
+            championship=cround.championship, team=team, number=n + 1
+        )
+        teams.append(round_team.objects.create(round=cround, team=entry))
+    return teams
@@ -0,0 +1,149 @@
+# race/broadcast.py
+"""
+Coalescing websocket broadcaster for the change lanes.
+
+A driver change saves the same ChangeLane several times within a few
+milliseconds (driver_endsession, then next_driver), and every save used
+to render three templates and do three group_send. Saves are now only
+recorded, per round and lane, when their transaction commits; a short
+timer then sends the latest state of each lane that moved, one message
+per group. Fragments are rendered once per lane state version, taken
+from the live race state (see race/racestate.py). What is still pending
+when the process exits, e.g. at the end of a management command, is sent
+then.
+"""
+
+import atexit
+import logging
+import threading
+from collections import Counter
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from django.db import connection, transaction
+from django.template.loader import render_to_string
+from .racestate import race_snapshot
+
+_log = logging.getLogger(__name__)
+
+# Seconds during which lane updates are coalesced
+WINDOW = 0.05
+# Group messages a ChangeLane save used to cost: lane, race control, driver change
+SENDS_PER_UPDATE = 3
+MAX_RENDERED = 256
+
+
+class LaneBroadcaster:
+    def __init__(self, window=WINDOW):
+        self.window = window
+        self.stats = Counter()
+        self._pending = {}
+        self._rendered = {}
+        self._timer = None
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+
+    def lane_changed(self, change_lane):
+        """Record a saved ChangeLane, it is sent once the transaction commits."""
+        round_id, lane = change_lane.round_id, change_lane.lane
+        transaction.on_commit(lambda: self.schedule(round_id, lane))
+
+    def schedule(self, round_id, lane):
+        with self._lock:
+            self.stats["updates"] += 1
+            self._pending.setdefault(round_id, set()).add(lane)
+            if self._timer is None:
+                self._timer = threading.Timer(self.window, self.flush)
+                self._timer.daemon = True
+                self._timer.start()
+
+    def close(self):
+        """Send the pending updates now, without waiting for the timer."""
+        with self._lock:
+            timer = self._timer
+        if timer is not None:
+            timer.cancel()
+        self.flush()
+
+    def render(self, template, key, context):
+        html = self._rendered.get((template, key))
+        if html is not None:
+            self.stats["render_hits"] += 1
+            return html
+        html = render_to_string(template, context)
+        if len(self._rendered) >= MAX_RENDERED:
+            self._rendered.clear()
+        self._rendered[(template, key)] = html
+        self.stats["renders"] += 1
+        return html
+
+    def send(self, group, message):
+        async_to_sync(self.channel_layer.group_send)(group, message)
+        self.stats["sends"] += 1
+
+    def flush(self):
+        with self._lock:
+            pending, self._pending = self._pending, {}
+            self._timer = None
+        if not pending:
+            return
+        with self._flush_lock:
+            self.channel_layer = get_channel_layer()
+            try:
+                for round_id, lanes in pending.items():
+                    self.flush_round(round_id, lanes)
+                self.stats["flushes"] += 1
+            except Exception:
+                _log.exception("Could not broadcast the change lanes")
+            finally:
+                # Runs in the timer thread, do not leak its connection
+                connection.close()
+
+    def flush_round(self, round_id, lanes):
+        snapshot = race_snapshot(round_id)
+        for number in sorted(lanes):
+            alane = snapshot.lane(number)
+            if alane is None:
+                # Deleted since
+                continue
+            key = (round_id, alane.id, alane.version)
+            context = {"change_lane": alane}
+            self.send(
+                f"lane_{number}",
+                {
+                    "type": "lane.state",
+                    "state": alane.as_state(),
+                    "lane_html": self.render(
+                        "layout/changelane_detail.html", key, context
+                    ),
+                    "rclane_html": self.render(
+                        "layout/changelane_small_detail.html", key, context
+                    ),
+                },
+            )
+
+        open_lanes = snapshot.open_lanes
+        key = (round_id,) + tuple((alane.id, alane.version) for alane in open_lanes)
+        self.send(
+            "changedriver",
+            {
+                "type": "changedriver.update",
+                "driverc_html": self.render(
+                    "layout/changedriver_detail.html",
+                    key,
+                    {"change_lanes": open_lanes},
+                ),
+            },
+        )
+
+    def get_stats(self):
+        stats = dict(self.stats)
+        for name in ("updates", "flushes", "sends", "renders", "render_hits"):
+            stats.setdefault(name, 0)
+        stats["sends_saved"] = stats["updates"] * SENDS_PER_UPDATE - stats["sends"]
+        stats["window_ms"] = round(self.window * 1000)
+        return stats
+
+
+lane_broadcaster = LaneBroadcaster()
+# The timer thread does not keep the process alive
+atexit.register(lane_broadcaster.close)
@@ -3,11 +3,25 @@ import json
 import datetime as dt
 import hmac
 import hashlib
+from urllib.parse import parse_qs
 from django.conf import settings
 from channels.generic.websocket import AsyncWebsocketConsumer
 from .models import ChangeLane, round_team, team_member, championship_team, Round
 from django.template.loader import render_to_string
 from channels.db import database_sync_to_async
+from .currentround import current_round, acurrent_round
+from .racestate import race_snapshot
+from .roundevents import round_snapshot
+from .penaltydispatch import (
+    penalty_dispatcher,
+    register_station,
+    unregister_station,
+    station_targets,
+    manual_penalty_target,
+)
+from .replay import CounterWindow, station_messages
+from .frames import FRAME_PROTOCOL, decode_frame, encode_frame
+from .lateness import record_countdown
 from django.db.models import Count, Q
 
 # Import your models
@@ -107,13 +121,8 @@ class EmptyTeamsConsumer(AsyncWebsocketConsumer):
         )
 
     # Database operations
-    @database_sync_to_async
-    def get_current_round(self):
-        end_date = dt.date.today()
-        start_date = end_date - dt.timedelta(days=1)
-        return Round.objects.filter(
-            Q(start__date__range=[start_date, end_date]) & Q(ended__isnull=True)
-        ).first()
+    async def get_current_round(self):
+        return await acurrent_round()
 
     @database_sync_to_async
     def get_empty_teams(self, round_id):
@@ -162,23 +171,60 @@ class ChangeLaneConsumer(AsyncWebsocketConsumer):
     async def connect(self):
         self.lane_number = self.scope["url_route"]["kwargs"]["pitlane_number"]
         self.lane_group_name = f"lane_{self.lane_number}"
+        # Displays that render the lane themselves connect with ?format=state
+        # and only get the JSON lane state, starting with the current one.
+        query = parse_qs(self.scope.get("query_string", b"").decode())
+        self.state_only = query.get("format") == ["state"]
 
         await self.channel_layer.group_add(self.lane_group_name, self.channel_name)
         await self.accept()
+        if self.state_only:
+            await self.send_lane_state(await self.get_lane_state(), current=True)
 
     async def disconnect(self, close_code):
         await self.channel_layer.group_discard(self.lane_group_name, self.channel_name)
 
-    async def lane_update(self, event):
-        lane_html = event["lane_html"]
+    async def receive(self, text_data):
+        try:
+            data = json.loads(text_data)
+        except json.JSONDecodeError:
+            return
+        # A display that missed a version asks for the current state
+        if data.get("type") == "resync":
+            await self.send_lane_state(await self.get_lane_state(), current=True)
+
+    async def send_lane_state(self, state, current=False):
+        # current: the state as of now rather than a change, clients take it
+        # whatever its version
+        if state is not None:
+            await self.send(
+                text_data=json.dumps(
+                    {"type": "lane.state", "lane": state, "current": current}
+                )
+            )
+
+    @database_sync_to_async
+    def get_lane_state(self):
+        cround = current_round()
+        if not cround:
+            return None
+        alane = race_snapshot(cround.id).lane(self.lane_number)
+        return alane.as_state() if alane else None
+
+    async def lane_state(self, event):
+        if self.state_only:
+            await self.send_lane_state(event["state"])
+            return
+        # One group message carries both fragments, clients still get two
         await self.send(
-            text_data=json.dumps({"type": "lane.update", "lane_html": lane_html})
+            text_data=json.dumps(
+                {"type": "lane.update", "lane_html": event["lane_html"]}
+            )
         )
-
-    async def rclane_update(self, event):
-        lane_html = event["lane_html"]
         await self.send(
-            text_data=json.dumps({"type": "rclane.update", "lane_html": lane_html})
+            text_data=json.dumps(
+                {"type": "rclane.update", "lane_html": event["rclane_html"]}
+            )
         )
 
 
@@ -210,6 +256,7 @@ class RoundConsumer(AsyncWebsocketConsumer):
 
         await self.accept()
         print(f"Round Consumer connection to {self.round_group_name} accepted.")
+        await self.send_snapshot()
 
     async def disconnect(self, close_code):
         # Leave room group
@@ -217,8 +264,22 @@ class RoundConsumer(AsyncWebsocketConsumer):
 
     # Receive message from WebSocket
     async def receive(self, text_data):
-        # We can handle client-to-server messages here if needed
-        pass
+        try:
+            data = json.loads(text_data)
+        except json.JSONDecodeError:
+            return
+        # A client that saw a gap in the sequence numbers asks for the state
+        if data.get("type") == "resync":
+            await self.send_snapshot()
+
+    async def send_snapshot(self):
+        snapshot = await self.get_snapshot()
+        if snapshot is not None:
+            await self.send(text_data=json.dumps(snapshot))
+
+    @database_sync_to_async
+    def get_snapshot(self):
+        return round_snapshot(self.round_id)
 
     # Receive message from room group
     async def round_update(self, event):
@@ -232,6 +293,7 @@ class RoundConsumer(AsyncWebsocketConsumer):
                     "started": event["started"],
                     "ready": event["ready"],
                     "ended": event["ended"],
+                    "seq": event.get("seq"),
                 }
             )
         )
@@ -248,6 +310,8 @@ class RoundConsumer(AsyncWebsocketConsumer):
                     "driver_id": event["driver id"],
                     "driver_status": event["driver status"],
                     "completed_sessions": event["completed sessions"],
+                    "driver_sessions": event.get("driver sessions"),
+                    "seq": event.get("seq"),
                 }
             )
         )
@@ -263,6 +327,7 @@ class RoundConsumer(AsyncWebsocketConsumer):
                     "started": event["started"],
                     "ready": event["ready"],
                     "ended": event["ended"],
+                    "seq": event.get("seq"),
                 }
             )
         )
@@ -287,6 +352,13 @@ class StopAndGoConsumer(AsyncWebsocketConsumer):
         message_data["hmac_signature"] = signature
         return message_data
 
+    async def send_signed(self, message):
+        """Send a message to the station, framed if it asked for frames"""
+        if self.framed:
+            await self.send(bytes_data=encode_frame(message, self.hmac_secret))
+        else:
+            await self.send(text_data=json.dumps(self.sign_message(message)))
+
     def verify_hmac(self, message_data, provided_signature):
         """Verify HMAC signature for incoming message"""
         message_str = json.dumps(message_data, sort_keys=False, separators=(",", ":"))
@@ -299,32 +371,56 @@ class StopAndGoConsumer(AsyncWebsocketConsumer):
 
     async def connect(self):
         self.stopandgo_group_name = "stopandgo"
+        self.counters = CounterWindow()
+        # Set when the connection is a station that registered
+        self.station_id = None
+        # Stations asking for it get binary frames, see race/frames.py
+        self.framed = FRAME_PROTOCOL in self.scope.get("subprotocols", [])
 
         # Join room group
         await self.channel_layer.group_add(self.stopandgo_group_name, self.channel_name)
-        await self.accept()
+        await self.accept(FRAME_PROTOCOL if self.framed else None)
         print("Stop and Go station connected")
 
+    def counter_window(self, data):
+        # Per station once it says which one it is, a reconnection does not
+        # start its window over. Stations without an id, per connection.
+        station = self.station_id or data.get("station")
+        if station is None:
+            return self.counters
+        return CounterWindow(str(station))
+
     async def disconnect(self, close_code):
         # Leave room group
         await self.channel_layer.group_discard(
             self.stopandgo_group_name, self.channel_name
         )
+        if self.station_id is not None:
+            await database_sync_to_async(unregister_station)(
+                self.station_id, self.channel_name
+            )
         print("Stop and Go station disconnected")
 
-    async def receive(self, text_data):
+    async def receive(self, text_data=None, bytes_data=None):
         try:
-            data = json.loads(text_data)
+            if bytes_data is not None:
+                # Signed over its bytes, nothing to serialise again
+                data = decode_frame(bytes_data, self.hmac_secret)
+                if data is None:
+                    print("Invalid frame - rejecting message")
+                    return
+            else:
+                data = json.loads(text_data)
 
-            # Verify HMAC signature for all incoming messages
-            provided_signature = data.pop("hmac_signature", None)
-            if not provided_signature:
-                print("Received message without HMAC signature")
-                return
+                # Verify HMAC signature for all incoming messages
+                provided_signature = data.pop("hmac_signature", None)
+                if not provided_signature:
+                    print("Received message without HMAC signature")
+                    return
 
-            if not self.verify_hmac(data, provided_signature):
-                print("HMAC verification failed - rejecting message")
-                return
+                if not self.verify_hmac(data, provided_signature):
+                    print("HMAC verification failed - rejecting message")
+                    return
 
             # Handle both race control commands and station responses
             message_type = data.get("type")
@@ -333,31 +429,61 @@ class StopAndGoConsumer(AsyncWebsocketConsumer):
                 # Handle station responses
                 response_type = data.get("response")
 
+                # Retries reuse the message id, a replay reuses an old counter
+                counter = data.get("counter")
+                if counter is not None and not self.counter_window(data).accept(
+                    counter
+                ):
+                    print(f"Rejected replayed station message {counter}")
+                    return
+                message_id = data.get("message_id")
+
                 if response_type == "penalty_served":
                     team_number = data.get("team")
                     if team_number:
-                        print(f"Penalty served by team {team_number}")
-
-                        # Send signed acknowledgment back to station
+                        # Only remembered once served: if serving fails, the
+                        # station is not acknowledged and sends it again
+                        if message_id is None or not station_messages.seen(message_id):
+                            print(f"Penalty served by team {team_number}")
+
+                            # Mark penalty as served in database and handle queue
+                            if not await self.handle_penalty_served_from_station(
+                                team_number, data.get("penalty_id"), data.get("drift")
+                            ):
+                                return
+                            if message_id is not None:
+                                station_messages.mark(message_id)
+
+                            # Broadcast penalty served to race control
+                            await self.channel_layer.group_send(
+                                self.stopandgo_group_name,
+                                {
+                                    "type": "penalty_served",
+                                    "team": team_number,
+                                },
+                            )
+
+                        # Send signed acknowledgment back to station, again if
+                        # this is a retry: the previous one was lost
                         message = {
                             "type": "penalty_acknowledged",
                             "team": team_number,
+                            "message_id": message_id,
                             "timestamp": dt.datetime.now().isoformat(),
                         }
-                        signed_message = self.sign_message(message)
-                        await self.send(text_data=json.dumps(signed_message))
+                        await self.send_signed(message)
 
-                        # Mark penalty as served in database and handle queue
-                        await self.handle_penalty_served_from_station(team_number)
+                elif message_id is not None and not station_messages.check(message_id):
+                    return
 
-                        # Broadcast penalty served to race control
-                        await self.channel_layer.group_send(
-                            self.stopandgo_group_name,
-                            {
-                                "type": "penalty_served",
-                                "team": team_number,
-                            },
+                elif response_type == "register":
+                    station = data.get("station")
+                    if station:
+                        self.station_id = str(station)
+                        await database_sync_to_async(register_station)(
+                            self.station_id, self.channel_name
                         )
+                        print(f"Stop and Go station {self.station_id} registered")
 
                 elif response_type == "fence_status":
                     # Forward fence status to race control
@@ -366,6 +492,21 @@ class StopAndGoConsumer(AsyncWebsocketConsumer):
                         {"type": "fence_status", "enabled": data.get("enabled", True)},
                     )
 
+                elif response_type == "fence_breach":
+                    # Forward to race control, with when it happened: it may
+                    # come late, sent again by a station that was offline
+                    team_number = data.get("team")
+                    if team_number:
+                        print(f"Fence breached by team {team_number}")
+                        await self.channel_layer.group_send(
+                            self.stopandgo_group_name,
+                            {
+                                "type": "fence_breach",
+                                "team": team_number,
+                                "timestamp": data.get("timestamp"),
+                            },
+                        )
+
                 elif response_type == "penalty_completed":
                     team_number = data.get("team")
                     if team_number:
@@ -385,56 +526,80 @@ class StopAndGoConsumer(AsyncWebsocketConsumer):
                         "team": team_number,
                         "timestamp": dt.datetime.now().isoformat(),
                     }
-                    signed_message = self.sign_message(message)
-                    await self.send(text_data=json.dumps(signed_message))
+                    await self.send_signed(message)
             else:
                 # Handle race control commands
                 if message_type == "penalty_required":
-                    # Forward race command to station
+                    # Forward race command to a free station
                     team = data.get("team")
                     duration = data.get("duration")
                     if team and duration:
-                        await self.channel_layer.group_send(
-                            self.stopandgo_group_name,
+                        targets = await database_sync_to_async(manual_penalty_target)(
+                            int(duration), data.get("station")
+                        )
+                        await self.send_to_stations(
                             {
                                 "type": "penalty_required",
                                 "team": team,
                                 "duration": duration,
                             },
+                            targets,
                         )
                 elif message_type == "get_fence_status":
                     # Query fence status
-                    await self.channel_layer.group_send(
-                        self.stopandgo_group_name, {"type": "get_fence_status"}
+                    targets = await database_sync_to_async(station_targets)(
+                        data.get("station")
                     )
+                    await self.send_to_stations({"type": "get_fence_status"}, targets)
                 elif message_type == "set_fence":
                     # Set fence status
                     enabled = data.get("enabled")
                     if enabled is not None:
-                        await self.channel_layer.group_send(
-                            self.stopandgo_group_name,
-                            {"type": "set_fence", "enabled": enabled},
+                        targets = await database_sync_to_async(station_targets)(
+                            data.get("station")
+                        )
+                        await self.send_to_stations(
+                            {"type": "set_fence", "enabled": enabled}, targets
                         )
                 elif message_type == "force_complete_penalty":
-                    # Force complete penalty
-                    await self.channel_layer.group_send(
-                        self.stopandgo_group_name, {"type": "force_complete_penalty"}
+                    # Force complete penalty, only where that team is served
+                    targets = await database_sync_to_async(station_targets)(
+                        data.get("station"), data.get("team"), every=False
+                    )
+                    await self.send_to_stations(
+                        {"type": "force_complete_penalty"}, targets
                     )
 
         except json.JSONDecodeError:
             print("Invalid JSON received from stop and go connection")
 
+    async def send_to_stations(self, message, targets):
+        """
+        Send a race control command to the registered stations it is for,
+        see station_targets. To the whole group when none registered.
+        """
+        if targets is None:
+            await self.channel_layer.group_send(self.stopandgo_group_name, message)
+            return
+        if not targets:
+            print(f"No stop and go station for {message['type']}")
+        for station, channel_name in targets:
+            await self.channel_layer.send(channel_name, dict(message, station=station))
+
     async def penalty_required(self, event):
+        # A registered station only takes the penalties assigned to it
+        if self.station_id is not None and event.get("station") != self.station_id:
+            return
         # Send signed penalty required command to station
         message = {
             "type": "command",
             "command": "penalty_required",
             "team": event["team"],
             "duration": event["duration"],
+            "penalty_id": event.get("penalty_id"),
             "timestamp": dt.datetime.now().isoformat(),
         }
-        signed_message = self.sign_message(message)
-        await self.send(text_data=json.dumps(signed_message))
+        await self.send_signed(message)
 
     async def set_fence(self, event):
         # Send signed fence enable/disable command to station
@@ -444,8 +609,7 @@ class StopAndGoConsumer(AsyncWebsocketConsumer):
             "enabled": event["enabled"],
             "timestamp": dt.datetime.now().isoformat(),
         }
-        signed_message = self.sign_message(message)
-        await self.send(text_data=json.dumps(signed_message))
+        await self.send_signed(message)
 
     async def get_fence_status(self, event):
         # Send signed query for fence status from station
@@ -454,8 +618,7 @@ class StopAndGoConsumer(AsyncWebsocketConsumer):
             "command": "get_fence_status",
             "timestamp": dt.datetime.now().isoformat(),
         }
-        signed_message = self.sign_message(message)
-        await self.send(text_data=json.dumps(signed_message))
+        await self.send_signed(message)
 
     async def force_complete_penalty(self, event):
         # Send signed force complete penalty command to station
@@ -464,8 +627,7 @@ class StopAndGoConsumer(AsyncWebsocketConsumer):
             "command": "force_complete",
             "timestamp": dt.datetime.now().isoformat(),
         }
-        signed_message = self.sign_message(message)
-        await self.send(text_data=json.dumps(signed_message))
+        await self.send_signed(message)
 
     async def penalty_served(self, event):
         # Broadcast penalty served notification to race control interfaces
@@ -479,6 +641,18 @@ class StopAndGoConsumer(AsyncWebsocketConsumer):
             text_data=json.dumps({"type": "fence_status", "enabled": event["enabled"]})
         )
 
+    async def fence_breach(self, event):
+        # Broadcast fence breach to race control interfaces
+        await self.send(
+            text_data=json.dumps(
+                {
+                    "type": "fence_breach",
+                    "team": event["team"],
+                    "timestamp": event["timestamp"],
+                }
+            )
+        )
+
     async def penalty_completed(self, event):
         # Broadcast penalty completion notification to race control interfaces
         await self.send(
@@ -494,130 +668,58 @@ class StopAndGoConsumer(AsyncWebsocketConsumer):
                     "serving_team": event["serving_team"],
                     "queue_count": event["queue_count"],
                     "round_id": event["round_id"],
+                    "stations": event.get("stations", []),
                 }
             )
         )
 
-    async def handle_penalty_served_from_station(self, team_number):
-        """Handle when station reports a penalty as served"""
-        from channels.db import database_sync_to_async
-        from .models import PenaltyQueue, RoundPenalty, Round
-        import datetime as dt
+    async def handle_penalty_served_from_station(
+        self, team_number, penalty_id=None, drift=None
+    ):
+        """
+        Handle when station reports a penalty as served. drift is how much
+        longer than its duration the station countdown lasted, in seconds.
+        True once the penalty is served, or was already, False if it could
+        not be.
+        """
+        from .models import PenaltyQueue
 
         try:
             # Find current round
             current_round = await self.get_current_round()
             if not current_round:
-                return
-
-            # Find the next penalty in queue for this team that hasn't been served yet
-            # Use the queue order to get the first one for this team
-            active_penalty = await database_sync_to_async(
-                lambda: PenaltyQueue.objects.filter(
-                    round_penalty__round=current_round,
-                    round_penalty__offender__team__number=team_number,
-                    round_penalty__served__isnull=True,
-                )
-                .order_by("timestamp")
-                .first()
-            )()
+                print(f"No current round to serve the penalty of team {team_number}")
+                return False
 
-            if active_penalty:
+            # The penalty the station was sent, or the first queued for the
+            # team, served and removed from the queue in one transaction
+            round_penalty = await database_sync_to_async(PenaltyQueue.serve)(
+                current_round.id, team_number=team_number, penalty_id=penalty_id
+            )
+
+            if round_penalty:
                 print(
-                    f"Processing station-reported penalty served for team {team_number}"
+                    f"Processed station-reported penalty served for team {team_number}"
                 )
-
-                # Mark penalty as served
-                await database_sync_to_async(
-                    lambda: setattr(
-                        active_penalty.round_penalty, "served", dt.datetime.now()
+                if drift is not None:
+                    await database_sync_to_async(record_countdown)(
+                        current_round.id, round_penalty, drift
                     )
-                )()
-                await database_sync_to_async(
-                    lambda: active_penalty.round_penalty.save()
-                )()
-
-                # Remove from queue
-                await database_sync_to_async(lambda: active_penalty.delete())()
-
-                # Trigger next penalty after 10 seconds
-                await self.trigger_next_penalty_after_delay(current_round.id)
+                # Trigger next penalty after 10 seconds, without waiting here
+                penalty_dispatcher.schedule(current_round.id)
             else:
                 print(
                     f"Ignoring station penalty_served for team {team_number} - penalty already processed or not found"
                 )
+            return True
 
         except Exception as e:
             print(f"Error handling penalty served from station: {e}")
+            return False
 
-    @database_sync_to_async
-    def get_current_round(self):
+    async def get_current_round(self):
         """Get the current active round"""
-        from .models import Round
-        import datetime as dt
-        from django.db.models import Q
-
-        end_date = dt.date.today()
-        start_date = end_date - dt.timedelta(days=1)
-        return Round.objects.filter(
-            Q(start__date__range=[start_date, end_date]) & Q(ended__isnull=True)
-        ).first()
-
-    async def trigger_next_penalty_after_delay(self, round_id):
-        """Trigger next penalty in queue after 10 second delay"""
-        import asyncio
-
-        # Wait 10 seconds for station to clear
-        await asyncio.sleep(10)
-
-        # Get next penalty in queue with all related data
-        penalty_data = await self.get_next_penalty_data(round_id)
-
-        if penalty_data:
-            # Signal the stop and go station for next penalty
-            await self.channel_layer.group_send(
-                self.stopandgo_group_name,
-                {
-                    "type": "penalty_required",
-                    "team": penalty_data["team_number"],
-                    "duration": penalty_data["duration"],
-                    "penalty_id": penalty_data["penalty_id"],
-                },
-            )
-            print(f"Triggered next penalty for team {penalty_data['team_number']}")
-
-    @database_sync_to_async
-    def get_next_penalty_data(self, round_id):
-        """Get next penalty data with all relationships resolved"""
-        from .models import PenaltyQueue
-
-        next_penalty = PenaltyQueue.get_next_penalty(round_id)
-
-        if next_penalty:
-            return {
-                "team_number": next_penalty.round_penalty.offender.team.number,
-                "duration": next_penalty.round_penalty.value,
-                "penalty_id": next_penalty.round_penalty.id,
-            }
-        return None
-
-    async def handle_penalty_state_change(self, round_id):
-        """Handle penalty state changes from race control (cancel/delay)"""
-        # Trigger next penalty after 10 second delay
-        await self.trigger_next_penalty_after_delay(round_id)
-
-    # Add handlers for penalty state changes from race control
-    async def penalty_cancelled(self, event):
-        """Handle penalty cancellation from race control"""
-        round_id = event.get("round_id")
-        if round_id:
-            await self.handle_penalty_state_change(round_id)
-
-    async def penalty_delayed(self, event):
-        """Handle penalty delay from race control"""
-        round_id = event.get("round_id")
-        if round_id:
-            await self.handle_penalty_state_change(round_id)
+        return await acurrent_round()
 
     async def reset_station(self, event):
         """Send reset command to stop and go station"""
@@ -626,8 +728,7 @@ class StopAndGoConsumer(AsyncWebsocketConsumer):
             "command": "reset",
             "timestamp": dt.datetime.now().isoformat(),
         }
-        signed_message = self.sign_message(message)
-        await self.send(text_data=json.dumps(signed_message))
+        await self.send_signed(message)
 
 
 # Signal handler for race end requests - placed outside classes
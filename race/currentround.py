@@ -0,0 +1,104 @@
+# race/currentround.py
+"""
+Resolver for the round being raced today.
+
+Views, consumers, the context processor and the race tasks all need "the
+current round" on every request, websocket connection and scheduler tick.
+The answer only changes when a Round is saved or deleted, or when the day
+changes, so it is kept in a process-local entry keyed by date, backed by
+the shared cache (Redis, see CACHES in core/settings.py) so other
+processes can skip the date range query too. Round post_save/post_delete
+invalidate both (see race/signals.py): they bump a version in the shared
+cache, which every process checks before using its local entry.
+"""
+import copy
+import datetime as dt
+import threading
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Q
+from channels.db import database_sync_to_async
+
+CACHE_TIMEOUT = 3 * 60 * 60
+VERSION_KEY = "current_round_version"
+
+_local = {}
+_lock = threading.Lock()
+
+
+def _cache_key(day):
+    return f"current_round_{day.isoformat()}"
+
+
+def _lookup(day):
+    from .models import Round
+
+    start_date = day - dt.timedelta(days=1)
+    return Round.objects.filter(
+        Q(start__date__range=[start_date, day]) & Q(ended__isnull=True)
+    ).first()
+
+
+def _cached(day, version):
+    entry = _local.get(day)
+    if entry is not None and entry[0] == version:
+        return entry
+    return None
+
+
+def _resolve(day, version):
+    from .models import Round
+
+    pk = cache.get(_cache_key(day))
+    if pk is None:
+        cround = _lookup(day)
+        cache.set(_cache_key(day), cround.pk if cround else 0, CACHE_TIMEOUT)
+    elif pk:
+        cround = Round.objects.filter(pk=pk).first()
+    else:
+        cround = None
+    entry = (version, cround)
+    with _lock:
+        _local.clear()
+        _local[day] = entry
+    return entry
+
+
+def _instance(entry):
+    # Callers get their own copy, they may change it before saving
+    return copy.copy(entry[1]) if entry[1] is not None else None
+
+
+def current_round():
+    """Return the current Round, or None if there is no race today."""
+    day = dt.date.today()
+    version = cache.get(VERSION_KEY, 0)
+    entry = _cached(day, version) or _resolve(day, version)
+    return _instance(entry)
+
+
+async def acurrent_round():
+    """Async version of current_round, no database access when it is cached."""
+    day = dt.date.today()
+    version = await cache.aget(VERSION_KEY, 0)
+    entry = _cached(day, version)
+    if entry is None:
+        entry = await database_sync_to_async(_resolve)(day, version)
+    return _instance(entry)
+
+
+def _invalidate():
+    with _lock:
+        _local.clear()
+    try:
+        cache.incr(VERSION_KEY)
+    except ValueError:
+        cache.set(VERSION_KEY, 1, None)
+    cache.delete(_cache_key(dt.date.today()))
+
+
+def invalidate_current_round():
+    _invalidate()
+    # Another process may resolve the round before the change is committed,
+    # and keep the old one under the new version
+    transaction.on_commit(_invalidate)
@@ -0,0 +1,359 @@
+# race/deadlines.py
+"""
+Deadline scheduler for the race events.
+
+Pit lanes open pitlane_open_after into the race, close pitlane_close_before
+its end and the race ends after duration, all in race time, that is wall
+clock time minus the pauses. Instead of polling the round every minute, a
+long lived event loop running in its own thread computes the wall clock
+time of each event from the pause index and arms one timer per event.
+
+Every running round (ready, started and not ended) is tracked on its own,
+with its own timers and lock, so two tracks or two classes racing on the
+same day both get their pit lanes handled. Whenever a Round or a
+round_pause changes (see race/signals.py) the timers of that round are
+re-armed from scratch; while a race is paused none is armed. A timer
+re-checks the race time when it fires and only acts when the deadline is
+really reached. The events run are recorded as RaceEventTiming rows, which
+are also what tells a newly elected process (see race/leader.py) that the
+previous leader already ran an event.
+"""
+
+import asyncio
+import datetime as dt
+import logging
+import threading
+from django.db import connection, transaction
+from .lateness import record_timing
+from .pauseindex import PauseIndex
+
+_log = logging.getLogger(__name__)
+
+PIT_OPEN = "pit_open"
+PIT_CLOSE = "pit_close"
+RACE_END = "race_end"
+
+# Seconds a deadline may be missed by (e.g. the server restarted) and still fire
+GRACE = 65
+# Seconds early a timer may fire and still count as on time
+TOLERANCE = 0.005
+
+
+def round_deadlines(cround, now=None, index=None):
+    """
+    Wall clock time of the race events of a running round, as a dict keyed
+    by event. Empty when the round is not running or paused.
+    """
+    if not cround or not cround.ready or not cround.started or cround.ended:
+        return {}
+    index = index or cround.pause_index
+    if index.is_paused:
+        return {}
+    now = now or dt.datetime.now()
+    elapsed = index.elapsed(cround.started, now=now)
+    return {
+        PIT_OPEN: now + (cround.pitlane_open_after - elapsed),
+        PIT_CLOSE: now + (cround.duration - cround.pitlane_close_before - elapsed),
+        RACE_END: now + (cround.duration - elapsed),
+    }
+
+
+def _running_deadlines(round_id=None):
+    """
+    Deadlines of the running rounds, or of the given one, as a dict keyed
+    by round id of (name, is paused, deadlines, events already run).
+    """
+    from .models import Round, round_pause, RaceEventTiming
+
+    try:
+        rounds = Round.objects.filter(
+            ready=True, started__isnull=False, ended__isnull=True
+        ).select_related("championship")
+        if round_id is not None:
+            rounds = rounds.filter(pk=round_id)
+        rounds = list(rounds)
+        # Fresh from the database rather than the cached pause indexes: the
+        # pauses may have been changed by another server process
+        pauses = {}
+        for rid, start, end in round_pause.objects.filter(round__in=rounds).values_list(
+            "round_id", "start", "end"
+        ):
+            pauses.setdefault(rid, []).append((start, end))
+        # Run by this process or by the one that was elected before it
+        timings = {}
+        for rid, event, fired, lateness in RaceEventTiming.objects.filter(
+            round__in=rounds, event__in=(PIT_OPEN, PIT_CLOSE, RACE_END)
+        ).values_list("round_id", "event", "fired", "lateness"):
+            timings.setdefault(rid, []).append((event, fired, lateness))
+        now = dt.datetime.now()
+        running = {}
+        for cround in rounds:
+            index = PauseIndex(pauses.get(cround.pk, ()))
+            done = {
+                event: (fired, lateness)
+                for event, fired, lateness in timings.get(cround.pk, ())
+                # Not from before the round was reset
+                if fired >= cround.started
+            }
+            running[cround.pk] = (
+                str(cround),
+                index.is_paused,
+                round_deadlines(cround, now, index),
+                done,
+            )
+        return running, now
+    finally:
+        # Runs in an executor thread, do not leak its connection
+        connection.close()
+
+
+def _in_thread(func, *args):
+    try:
+        return func(*args)
+    finally:
+        connection.close()
+
+
+def _race_ended_at(round_id):
+    from .models import Round
+
+    return Round.objects.filter(pk=round_id).values_list("ended", flat=True).first()
+
+
+class RoundTimers:
+    """Timers and scheduling state of one running round."""
+
+    def __init__(self, round_id):
+        self.round_id = round_id
+        self.name = ""
+        self.paused = False
+        self.deadlines = {}
+        self.timers = {}
+        # Events already run, so a re-arm does not repeat them
+        self.fired = {}
+        self.generation = 0
+        self.lock = asyncio.Lock()
+
+    def cancel(self):
+        for handle in self.timers.values():
+            handle.cancel()
+        self.timers = {}
+
+    def status(self, now=None):
+        now = now or dt.datetime.now()
+        events = []
+        for event in (PIT_OPEN, PIT_CLOSE, RACE_END):
+            when = self.deadlines.get(event)
+            fired = self.fired.get(event)
+            events.append(
+                {
+                    "event": event,
+                    "at": when.isoformat() if when else None,
+                    "in_seconds": round((when - now).total_seconds(), 3)
+                    if when
+                    else None,
+                    "armed": event in self.timers,
+                    "fired_at": fired[0].isoformat() if fired else None,
+                    "late_seconds": round(fired[1], 3) if fired else None,
+                }
+            )
+        return {
+            "round": self.round_id,
+            "name": self.name,
+            "paused": self.paused,
+            "events": events,
+        }
+
+
+class DeadlineScheduler:
+    def __init__(self):
+        self.loop = None
+        self.thread = None
+        self.rounds = {}
+        self._ready = threading.Event()
+
+    def start(self):
+        if self.thread is not None:
+            return
+        self.thread = threading.Thread(
+            target=self._run, name="race-deadlines", daemon=True
+        )
+        self.thread.start()
+        self._ready.wait()
+        self.rearm()
+
+    def _run(self):
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        self._ready.set()
+        try:
+            self.loop.run_forever()
+        finally:
+            self.loop.close()
+
+    def stop(self):
+        """Cancel every timer and stop the loop, start() may be called again."""
+        loop, thread = self.loop, self.thread
+        if thread is None:
+            return
+        asyncio.run_coroutine_threadsafe(self._stop(), loop).result(timeout=5)
+        loop.call_soon_threadsafe(loop.stop)
+        thread.join(timeout=5)
+        self.loop = None
+        self.thread = None
+        self._ready.clear()
+
+    async def _stop(self):
+        for timers in self.rounds.values():
+            timers.cancel()
+        self.rounds = {}
+
+    def rearm(self, round_id=None):
+        """
+        Recompute the deadlines of a round, or of every running round when
+        round_id is None. Thread safe, may be called from anywhere.
+        """
+        if self.loop is None:
+            return
+        asyncio.run_coroutine_threadsafe(self._rearm(round_id), self.loop)
+
+    def rearm_on_commit(self, round_id=None):
+        transaction.on_commit(lambda: self.rearm(round_id))
+
+    def _round(self, round_id):
+        timers = self.rounds.get(round_id)
+        if timers is None:
+            timers = self.rounds[round_id] = RoundTimers(round_id)
+        return timers
+
+    async def _rearm(self, round_id=None):
+        # Generations of the rounds concerned when this re-arm started
+        targets = list(self.rounds) if round_id is None else [round_id]
+        started = {rid: self._round(rid).generation + 1 for rid in targets}
+        for rid, generation in started.items():
+            self.rounds[rid].generation = generation
+        try:
+            running, now = await self.loop.run_in_executor(
+                None, _running_deadlines, round_id
+            )
+        except Exception:
+            _log.exception("Could not compute the race deadlines")
+            return
+
+        for rid in set(started) | set(running):
+            timers = self._round(rid)
+            if rid in started and timers.generation != started[rid]:
+                # A later re-arm of this round is running, its view is newer
+                continue
+            if rid not in running:
+                # Ended, not ready any more or deleted
+                timers.cancel()
+                del self.rounds[rid]
+                continue
+            timers.name, timers.paused, deadlines, done = running[rid]
+            for event, fired in done.items():
+                timers.fired.setdefault(event, fired)
+            self._arm(timers, deadlines, now)
+
+    def _arm(self, timers, deadlines, now):
+        timers.cancel()
+        timers.deadlines = deadlines
+        for event, when in deadlines.items():
+            if event in timers.fired:
+                continue
+            delay = (when - now).total_seconds()
+            if delay < -GRACE and event != RACE_END:
+                # Long gone, the race director took over since
+                continue
+            timers.timers[event] = self.loop.call_at(
+                self.loop.time() + max(delay, 0), self._fire, timers, event
+            )
+            _log.debug("Round %s: %s armed in %.3fs", timers.round_id, event, delay)
+
+    def _fire(self, timers, event):
+        timers.timers.pop(event, None)
+        self.loop.create_task(self._check_and_run(timers, event))
+
+    async def _check_and_run(self, timers, event):
+        # One event at a time per round, rounds do not wait for each other
+        async with timers.lock:
+            if self.rounds.get(timers.round_id) is not timers:
+                return
+            # The timer was armed from the pauses known then, check again
+            try:
+                running, now = await self.loop.run_in_executor(
+                    None, _running_deadlines, timers.round_id
+                )
+            except Exception:
+                _log.exception("Could not compute the race deadlines")
+                return
+            if timers.round_id not in running:
+                return
+            _, _, deadlines, done = running[timers.round_id]
+            if event in done:
+                # Run by the previous leader, after this timer was armed
+                timers.fired.setdefault(event, done[event])
+            when = deadlines.get(event)
+            if when is None or event in timers.fired:
+                return
+            early = (when - now).total_seconds()
+            if early > TOLERANCE:
+                timers.timers[event] = self.loop.call_at(
+                    self.loop.time() + early, self._fire, timers, event
+                )
+                return
+            timers.fired[event] = (now, -early)
+            _log.info("Round %s: %s, %.3fs late", timers.round_id, event, -early)
+            if event != RACE_END:
+                # Recorded first: should leadership move while the lanes
+                # are changed, the next leader must not run it again after
+                # the race director changed them by hand
+                await self.loop.run_in_executor(
+                    None, _in_thread, record_timing, timers.round_id, event, when, now
+                )
+            try:
+                await self.run_event(timers.round_id, event)
+            except Exception:
+                _log.exception("Round %s: %s failed", timers.round_id, event)
+                return
+            if event == RACE_END:
+                # How far after its duration the race really ended. Once
+                # ended, the round is not running for the next leader.
+                fired = (
+                    await self.loop.run_in_executor(
+                        None, _in_thread, _race_ended_at, timers.round_id
+                    )
+                    or now
+                )
+                await self.loop.run_in_executor(
+                    None, _in_thread, record_timing, timers.round_id, event, when, fired
+                )
+
+    async def run_event(self, round_id, event):
+        from .tasks import open_pit_lanes, close_pit_lanes, request_race_end
+
+        if event == PIT_OPEN:
+            await self.loop.run_in_executor(None, _in_thread, open_pit_lanes, round_id)
+        elif event == PIT_CLOSE:
+            await self.loop.run_in_executor(None, _in_thread, close_pit_lanes, round_id)
+        elif event == RACE_END:
+            await request_race_end(round_id, sender=DeadlineScheduler)
+
+    async def _status(self):
+        now = dt.datetime.now()
+        return [
+            timers.status(now)
+            for _, timers in sorted(self.rounds.items(), key=lambda item: item[0])
+        ]
+
+    def get_status(self):
+        """Scheduling state of every tracked round. Thread safe."""
+        if self.loop is None:
+            return {"running": False, "rounds": []}
+        rounds = asyncio.run_coroutine_threadsafe(self._status(), self.loop).result(
+            timeout=5
+        )
+        return {"running": True, "rounds": rounds}
+
+
+deadline_scheduler = DeadlineScheduler()
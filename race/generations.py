@@ -0,0 +1,84 @@
+# race/generations.py
+"""
+Generation counters shared by the server processes.
+
+The pause indexes and the live race states are kept in each process, and
+follow the signals of the saves made in that process. A save made in
+another process (another ASGI worker, a management command) is only seen
+through these counters: whoever changes a round bumps its generation in
+the default cache, which is shared (Redis, see CACHES in core/settings.py),
+and every process checks the generation its copy was loaded at before
+using it.
+
+Within a generation_scope, e.g. a request (see race/middleware.py), each
+generation is read from the cache once: a page computing the time spent
+of every driver would otherwise make a round trip for each. A change made
+by another process during the scope is seen by the next one.
+"""
+
+import contextvars
+import time
+from contextlib import contextmanager
+from django.core.cache import cache
+
+# Generations read in the current scope, None outside of one
+_scope = contextvars.ContextVar("generation_scope", default=None)
+
+
+@contextmanager
+def generation_scope():
+    """Read each generation once within the block. Nested blocks share it."""
+    if _scope.get() is not None:
+        yield
+        return
+    token = _scope.set({})
+    try:
+        yield
+    finally:
+        _scope.reset(token)
+
+
+def generation(key):
+    seen = _scope.get()
+    if seen is None:
+        return cache.get(key, 0)
+    if key not in seen:
+        seen[key] = cache.get(key, 0)
+    return seen[key]
+
+
+def generations(*keys):
+    """Generations of several keys in one cache round trip, as a tuple."""
+    seen = _scope.get()
+    if seen is None:
+        found = cache.get_many(keys)
+        return tuple(found.get(key, 0) for key in keys)
+    missing = [key for key in keys if key not in seen]
+    if missing:
+        found = cache.get_many(missing)
+        for key in missing:
+            seen[key] = found.get(key, 0)
+    return tuple(seen[key] for key in keys)
+
+
+def _seed():
+    # A generation lost with the cache (evicted, clearcache) starts again
+    # above any value it had, as long as it moved less than 1000 times a
+    # second: the lane state versions must not go back
+    return int(time.time() * 1000)
+
+
+def bump(key):
+    """Increment a generation and return the new value."""
+    cache.add(key, _seed(), None)
+    try:
+        value = cache.incr(key)
+    except ValueError:
+        # Evicted between add and incr
+        value = _seed()
+        cache.set(key, value, None)
+    seen = _scope.get()
+    if seen is not None:
+        # Seen at once by the scope that made the change
+        seen[key] = value
+    return value
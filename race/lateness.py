@@ -0,0 +1,134 @@
+# race/lateness.py
+"""
+Lateness of the timed race events.
+
+Every time the deadline scheduler (see race/deadlines.py) runs a pit lane
+opening or closing or a race end, and every time the penalty dispatcher
+triggers the next penalty, the intended and actual times are stored as a
+RaceEventTiming. So is the end of each stop and go countdown, as reported
+by the station. They are summed up here into per event histograms, for
+the metrics endpoint and the deadlinemetrics command.
+"""
+
+import datetime as dt
+import logging
+
+_log = logging.getLogger(__name__)
+
+# Upper bounds of the histogram buckets, in milliseconds
+BUCKETS_MS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 5000, 60000)
+
+
+class LatenessHistogram:
+    def __init__(self, buckets=BUCKETS_MS):
+        self.buckets = tuple(buckets)
+        # One more bucket for anything above the last bound
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = None
+
+    def add(self, lateness):
+        """Add a lateness, in seconds. Early events count as on time."""
+        ms = max(lateness, 0) * 1000
+        for n, bound in enumerate(self.buckets):
+            if ms <= bound:
+                break
+        else:
+            n = len(self.buckets)
+        self.counts[n] += 1
+        self.count += 1
+        self.total += ms
+        self.max = ms if self.max is None else max(self.max, ms)
+
+    def percentile(self, q):
+        """
+        Upper bound, in milliseconds, of the bucket holding the q-th
+        percentile. None when empty, the maximum for the last bucket.
+        """
+        if not self.count:
+            return None
+        rank = q / 100 * self.count
+        seen = 0
+        for n, count in enumerate(self.counts):
+            seen += count
+            if count and seen >= rank:
+                return self.buckets[n] if n < len(self.buckets) else self.max
+        return self.max
+
+    @property
+    def mean(self):
+        return self.total / self.count if self.count else None
+
+    def as_dict(self):
+        labels = [f"<={bound}ms" for bound in self.buckets]
+        labels.append(f">{self.buckets[-1]}ms")
+        return {
+            "count": self.count,
+            "mean_ms": round(self.mean, 3) if self.count else None,
+            "max_ms": round(self.max, 3) if self.count else None,
+            "p50_ms": self.percentile(50),
+            "p95_ms": self.percentile(95),
+            "p99_ms": self.percentile(99),
+            "buckets": dict(zip(labels, self.counts)),
+        }
+
+
+def record_timing(round_id, event, intended, fired):
+    """Store when an event was due and when it ran. Never raises."""
+    from .models import RaceEventTiming
+
+    try:
+        return RaceEventTiming.objects.create(
+            round_id=round_id,
+            event=event,
+            intended=intended,
+            fired=fired,
+            lateness=(fired - intended).total_seconds(),
+        )
+    except Exception:
+        _log.exception("Could not record the timing of %s", event)
+        return None
+
+
+def record_countdown(round_id, round_penalty, drift):
+    """
+    Store how much longer than its duration a stop and go countdown lasted,
+    as the station measured it: it ended drift seconds after it was due.
+    """
+    try:
+        drift = float(drift)
+    except (TypeError, ValueError):
+        _log.warning("Invalid countdown drift %r", drift)
+        return None
+    _log.info(
+        "Stop and go of team %s lasted %.3fs longer than %ss",
+        round_penalty.offender.team.number,
+        drift,
+        round_penalty.value,
+    )
+    fired = round_penalty.served
+    intended = fired - dt.timedelta(seconds=drift)
+    return record_timing(round_id, "penalty_countdown", intended, fired)
+
+
+def lateness_histograms(round_id=None, since=None):
+    """Histograms of the recorded timings, as a dict keyed by event."""
+    from .models import RaceEventTiming
+
+    timings = RaceEventTiming.objects.all()
+    if round_id is not None:
+        timings = timings.filter(round_id=round_id)
+    if since is not None:
+        timings = timings.filter(fired__gte=since)
+    histograms = {}
+    for event, lateness in timings.values_list("event", "lateness"):
+        histograms.setdefault(event, LatenessHistogram()).add(lateness)
+    return histograms
+
+
+def lateness_metrics(round_id=None, since=None):
+    return {
+        event: histogram.as_dict()
+        for event, histogram in sorted(lateness_histograms(round_id, since).items())
+    }
@@ -0,0 +1,147 @@
+# race/leader.py
+"""
+Lease based leader election between the server processes.
+
+The race automation (pit lanes, race end, job store housekeeping) must run
+in exactly one process, whatever the number of ASGI workers. Each process
+runs a LeaderElection thread that tries to take or renew a SchedulerLease
+row every HEARTBEAT seconds. Renewing or taking it is a conditional UPDATE
+(held by us, or expired), so two processes can never both succeed. The
+holder renews the lease well before it expires; if it dies, another
+process takes over at most TTL seconds later. The callbacks start and stop
+the automation when leadership is gained or lost.
+
+What the processes cache is shared or checked through Redis (see
+race/generations.py), and the race events already run are read back from
+the database by the next leader (see race/deadlines.py).
+"""
+
+import atexit
+import datetime as dt
+import logging
+import os
+import socket
+import threading
+import uuid
+from django.db import connection, IntegrityError, DatabaseError
+
+_log = logging.getLogger(__name__)
+
+TTL = 15
+HEARTBEAT = 5
+
+
+def process_id():
+    return f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+
+class LeaderElection:
+    def __init__(
+        self,
+        name,
+        on_elected=None,
+        on_lost=None,
+        on_heartbeat=None,
+        ttl=TTL,
+        heartbeat=HEARTBEAT,
+    ):
+        self.name = name
+        self.holder = process_id()
+        self.on_elected = on_elected
+        self.on_lost = on_lost
+        self.on_heartbeat = on_heartbeat
+        self.ttl = dt.timedelta(seconds=ttl)
+        self.heartbeat = heartbeat
+        self.is_leader = False
+        self._stop = threading.Event()
+        self._thread = None
+
+    def try_acquire(self):
+        """Take or renew the lease. True if this process holds it."""
+        from .models import SchedulerLease
+
+        now = dt.datetime.now()
+        leases = SchedulerLease.objects.filter(name=self.name)
+        if leases.filter(holder=self.holder).update(expires=now + self.ttl):
+            return True
+        if leases.filter(expires__lt=now).update(
+            holder=self.holder, expires=now + self.ttl, since=now
+        ):
+            return True
+        if leases.exists():
+            return False
+        try:
+            SchedulerLease.objects.create(
+                name=self.name, holder=self.holder, expires=now + self.ttl, since=now
+            )
+            return True
+        except IntegrityError:
+            # Another process created it first
+            return False
+
+    def release(self):
+        """Give the lease up, so another process does not wait for it to expire."""
+        from .models import SchedulerLease
+
+        if not self.is_leader:
+            return
+        SchedulerLease.objects.filter(name=self.name, holder=self.holder).update(
+            expires=dt.datetime.now()
+        )
+        self._set_leader(False)
+
+    def _set_leader(self, leader):
+        if leader == self.is_leader:
+            return
+        self.is_leader = leader
+        callback = self.on_elected if leader else self.on_lost
+        _log.info(
+            "%s %s leadership of %s",
+            self.holder,
+            "took" if leader else "lost",
+            self.name,
+        )
+        if callback is not None:
+            try:
+                callback()
+            except Exception:
+                _log.exception("Leadership change of %s failed", self.name)
+
+    def step(self):
+        try:
+            leader = self.try_acquire()
+        except DatabaseError:
+            _log.exception("Could not renew the %s lease", self.name)
+            # Not renewed, another process may take over: stop acting as leader
+            leader = False
+        finally:
+            connection.close()
+        self._set_leader(leader)
+        if leader and self.on_heartbeat is not None:
+            try:
+                self.on_heartbeat()
+            except Exception:
+                _log.exception("Heartbeat of %s failed", self.name)
+
+    def _run(self):
+        while not self._stop.is_set():
+            self.step()
+            self._stop.wait(self.heartbeat)
+        try:
+            self.release()
+        finally:
+            connection.close()
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._thread = threading.Thread(
+            target=self._run, name=f"leader-{self.name}", daemon=True
+        )
+        self._thread.start()
+        atexit.register(self.stop)
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None and self._thread is not threading.current_thread():
+            self._thread.join(timeout=self.heartbeat + 1)
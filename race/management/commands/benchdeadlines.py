@@ -0,0 +1,140 @@
+import datetime as dt
+import time
+from django.core.management.base import BaseCommand, CommandError
+from race.benchdb import bench_database, bench_championship
+from race.models import Round, round_pause, ChangeLane, RaceEventTiming
+from race.deadlines import deadline_scheduler
+from race.lateness import LatenessHistogram
+
+# Connects the race end receiver, as the ASGI application does
+import race.consumers  # noqa: F401
+
+
+class Command(BaseCommand):
+    help = (
+        "Run a few compressed-time races side by side (seconds instead of "
+        "hours, with a pause) through the deadline scheduler and check that "
+        "the pit lanes and the race ends ran on time. The bench rounds are "
+        "created in a throwaway database, the deadline scheduler of a running "
+        "server does not see them."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--races", type=int, default=3, help="Parallel races")
+        parser.add_argument(
+            "--duration", type=float, default=6, help="Race duration, in seconds"
+        )
+        parser.add_argument(
+            "--open-after",
+            type=float,
+            default=1,
+            help="Pit lane opening, in seconds into the race",
+        )
+        parser.add_argument(
+            "--close-before",
+            type=float,
+            default=2,
+            help="Pit lane closing, in seconds before the end",
+        )
+        parser.add_argument(
+            "--pause",
+            type=float,
+            default=0.5,
+            help="Length of a pause in the middle of each race, in seconds",
+        )
+        parser.add_argument(
+            "--threshold",
+            type=float,
+            default=50,
+            help="Maximum acceptable lateness, in milliseconds",
+        )
+
+    def handle(self, *args, **options):
+        if options["duration"] <= options["open_after"] + options["close_before"]:
+            raise CommandError("The pit lanes would never open")
+
+        with bench_database():
+            deadline_scheduler.start()
+            try:
+                rounds = self.run_races(bench_championship("Bench deadlines"), options)
+                histograms = {}
+                for event, lateness in RaceEventTiming.objects.filter(
+                    round__in=rounds
+                ).values_list("event", "lateness"):
+                    histograms.setdefault(event, LatenessHistogram()).add(lateness)
+            finally:
+                # Its thread must not outlive the database
+                deadline_scheduler.stop()
+
+        failed = []
+        expected = len(rounds)
+        for event in ("pit_open", "pit_close", "race_end"):
+            histogram = histograms.get(event, LatenessHistogram())
+            summary = histogram.as_dict()
+            self.stdout.write(
+                f"{event:10} {summary['count']}/{expected} events, "
+                f"mean {summary['mean_ms']}ms, p95 {summary['p95_ms']}ms, "
+                f"max {summary['max_ms']}ms"
+            )
+            if histogram.count != expected:
+                failed.append(f"{event} ran {histogram.count} times out of {expected}")
+            elif histogram.max > options["threshold"]:
+                failed.append(
+                    f"{event} was {histogram.max:.1f}ms late, "
+                    f"over {options['threshold']}ms"
+                )
+        if failed:
+            raise CommandError("; ".join(failed))
+        self.stdout.write(self.style.SUCCESS("All race events ran on time"))
+
+    def run_races(self, champ, options):
+        duration = dt.timedelta(seconds=options["duration"])
+        now = dt.datetime.now()
+        rounds = []
+        for n in range(options["races"]):
+            cround = Round.objects.create(
+                name=f"Bench {n + 1}",
+                championship=champ,
+                start=now,
+                duration=duration,
+                pitlane_open_after=dt.timedelta(seconds=options["open_after"]),
+                pitlane_close_before=dt.timedelta(seconds=options["close_before"]),
+                ready=True,
+            )
+            for lane in range(2):
+                ChangeLane.objects.create(round=cround, lane=lane + 1)
+            rounds.append(cround)
+        self.stdout.write(
+            f"{len(rounds)} races of {options['duration']}s, "
+            f"pause of {options['pause']}s in the middle"
+        )
+
+        # Staggered starts, so the deadlines of the races do not coincide
+        for cround in rounds:
+            cround.started = dt.datetime.now()
+            cround.save()
+            time.sleep(0.1)
+
+        time.sleep(options["duration"] / 2)
+        if options["pause"] > 0:
+            pauses = [
+                round_pause.objects.create(round=cround, start=dt.datetime.now())
+                for cround in rounds
+            ]
+            time.sleep(options["pause"])
+            for pause in pauses:
+                pause.end = dt.datetime.now()
+                pause.save()
+
+        deadline = time.monotonic() + options["duration"] + 10
+        pending = {cround.pk for cround in rounds}
+        while pending and time.monotonic() < deadline:
+            time.sleep(0.2)
+            pending -= set(
+                Round.objects.filter(pk__in=pending, ended__isnull=False).values_list(
+                    "pk", flat=True
+                )
+            )
+        if pending:
+            self.stdout.write(self.style.WARNING(f"{len(pending)} races did not end"))
+        return rounds
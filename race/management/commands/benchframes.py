@@ -0,0 +1,85 @@
+import datetime as dt
+import json
+import time
+import uuid
+from django.core.management.base import BaseCommand
+from race.consumers import StopAndGoConsumer
+from race.frames import decode_frame, encode_frame
+
+
+class Command(BaseCommand):
+    help = (
+        "Measure the time the server takes to sign and check stop and go "
+        "station messages, as signed JSON and as binary frames, and their "
+        "size. The station has the same measure with --benchmark-messages."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--count", type=int, default=20000, help="Messages of each kind"
+        )
+
+    def handle(self, *args, **options):
+        consumer = StopAndGoConsumer()
+        key = consumer.hmac_secret
+        count = options["count"]
+        now = dt.datetime.now().isoformat()
+        messages = {
+            # From the station
+            "penalty_served": {
+                "type": "response",
+                "response": "penalty_served",
+                "message_id": uuid.uuid4().hex,
+                "counter": 42,
+                "timestamp": now,
+                "team": 17,
+                "penalty_id": 1234,
+                "drift": 0.0123,
+            },
+            # To the station
+            "penalty_required": {
+                "type": "command",
+                "command": "penalty_required",
+                "team": 17,
+                "duration": 20,
+                "penalty_id": 1234,
+                "timestamp": now,
+            },
+        }
+
+        def json_sign(message):
+            return json.dumps(consumer.sign_message(dict(message)))
+
+        def json_check(text):
+            data = json.loads(text)
+            signature = data.pop("hmac_signature")
+            if not consumer.verify_hmac(data, signature):
+                raise ValueError("Invalid signature")
+            return data
+
+        def frame_check(frame):
+            data = decode_frame(frame, key)
+            if data is None:
+                raise ValueError("Invalid frame")
+            return data
+
+        def report(label, function, argument):
+            start = time.perf_counter()
+            for _ in range(count):
+                function(argument)
+            elapsed = time.perf_counter() - start
+            self.stdout.write(
+                f"  {label}: {elapsed / count * 1_000_000:.1f}us, "
+                f"{count / elapsed:.0f} messages/s"
+            )
+
+        for label, message in messages.items():
+            text = json_sign(message)
+            frame = encode_frame(message, key)
+            self.stdout.write(
+                f"{label}: JSON {len(text)} bytes, frame {len(frame)} bytes"
+            )
+            report("JSON sign", json_sign, message)
+            report("JSON check", json_check, text)
+            report("Frame encode", lambda m: encode_frame(m, key), message)
+            report("Frame decode", frame_check, frame)
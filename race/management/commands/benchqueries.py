@@ -0,0 +1,241 @@
+import datetime as dt
+import random
+import statistics
+import time
+import uuid
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from race.models import (
+    Championship,
+    Team,
+    Person,
+    championship_team,
+    Round,
+    round_team,
+    team_member,
+    Session,
+)
+
+
+class Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = (
+        "Seed a multi-season database and time the session queue, on track and "
+        "completed session queries with and without the Session indexes. "
+        "Everything runs in a transaction that is rolled back."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--seasons", type=int, default=5)
+        parser.add_argument("--rounds", type=int, default=12, help="Per season")
+        parser.add_argument("--teams", type=int, default=30)
+        parser.add_argument("--drivers", type=int, default=4, help="Per team")
+        parser.add_argument(
+            "--sessions", type=int, default=30, help="Per team and round"
+        )
+        parser.add_argument(
+            "--repeat", type=int, default=50, help="Runs per timed query"
+        )
+        parser.add_argument(
+            "--plans", action="store_true", help="Print the query plans"
+        )
+        parser.add_argument("--seed", type=int, default=0, help="Random seed")
+
+    def handle(self, *args, **options):
+        self.options = options
+        self.rng = random.Random(options["seed"])
+        try:
+            with transaction.atomic():
+                started = time.perf_counter()
+                target = self.seed()
+                self.stdout.write(
+                    f"Seeded {Session.objects.count()} sessions in "
+                    f"{time.perf_counter() - started:.1f}s"
+                )
+                self.analyze()
+                with_indexes = self.measure(target, "with indexes")
+
+                editor = connection.schema_editor()
+                for index in Session._meta.indexes:
+                    editor.remove_index(Session, index)
+                self.analyze()
+                without_indexes = self.measure(target, "without indexes")
+                raise Rollback()
+        except Rollback:
+            pass
+
+        self.stdout.write("")
+        self.stdout.write(f"{'query':16} {'without':>10} {'with':>10} {'speedup':>8}")
+        for name, slow in without_indexes.items():
+            fast = with_indexes[name]
+            self.stdout.write(
+                f"{name:16} {slow * 1000:9.3f}ms {fast * 1000:9.3f}ms "
+                f"{slow / fast if fast else 0:7.1f}x"
+            )
+
+    def analyze(self):
+        with connection.cursor() as cursor:
+            cursor.execute("ANALYZE")
+
+    def queries(self, target):
+        cround, rteam, driver = target
+        return (
+            (
+                "queue",
+                Session.objects.filter(
+                    round=cround,
+                    register__isnull=False,
+                    start__isnull=True,
+                    end__isnull=True,
+                ).order_by("register"),
+            ),
+            (
+                "next session",
+                Session.objects.filter(
+                    round=cround,
+                    driver__team=rteam,
+                    start__isnull=True,
+                    end__isnull=True,
+                ).order_by("register", "id")[:1],
+            ),
+            (
+                "open sessions",
+                cround.session_set.filter(end__isnull=True).order_by("register", "id"),
+            ),
+            (
+                "on track",
+                driver.session_set.filter(
+                    round=cround,
+                    register__isnull=False,
+                    start__isnull=False,
+                    end__isnull=True,
+                ),
+            ),
+            (
+                "team completed",
+                Session.objects.filter(driver__team=rteam, end__isnull=False),
+            ),
+        )
+
+    def measure(self, target, label):
+        self.stdout.write(f"\n== {label}")
+        timings = {}
+        for name, queryset in self.queries(target):
+            if self.options["plans"]:
+                self.stdout.write(f"-- {name}")
+                self.stdout.write(queryset.explain())
+            runs = []
+            for _ in range(self.options["repeat"]):
+                started = time.perf_counter()
+                # Fresh clone, so nothing is served from the result cache
+                len(queryset.all())
+                runs.append(time.perf_counter() - started)
+            timings[name] = statistics.median(runs)
+            self.stdout.write(f"{name:16} {timings[name] * 1000:9.3f}ms")
+        return timings
+
+    def seed(self):
+        """
+        Create the seasons, all rounds completed except the last one, which
+        is mid race: every team has a driver on track and some waiting.
+        Returns the round, a team and a driver on track to query for.
+        """
+        options = self.options
+        tag = uuid.uuid4().hex[:8]
+        today = dt.date.today()
+        target = None
+        for season in range(options["seasons"]):
+            year = today.year - options["seasons"] + season + 1
+            champ = Championship.objects.create(
+                name=f"Bench {tag} {year}",
+                start=dt.date(year, 1, 1),
+                end=dt.date(year, 12, 31),
+            )
+            teams = Team.objects.bulk_create(
+                Team(name=f"Bench {tag} {season}-{n}") for n in range(options["teams"])
+            )
+            cteams = championship_team.objects.bulk_create(
+                championship_team(championship=champ, team=team, number=n + 1)
+                for n, team in enumerate(teams)
+            )
+            for rnum in range(options["rounds"]):
+                last = (
+                    season == options["seasons"] - 1 and rnum == options["rounds"] - 1
+                )
+                target = self.seed_round(champ, cteams, year, rnum, last) or target
+        return target
+
+    def seed_round(self, champ, cteams, year, rnum, last):
+        options = self.options
+        start = dt.datetime(year, 1, 1, 10) + dt.timedelta(days=14 * rnum)
+        cround = Round.objects.create(
+            name=f"R{rnum + 1}",
+            championship=champ,
+            start=start,
+            duration=dt.timedelta(hours=4),
+            ready=True,
+            started=start,
+            ended=None if last else start + dt.timedelta(hours=4),
+        )
+        rteams = round_team.objects.bulk_create(
+            round_team(round=cround, team=cteam) for cteam in cteams
+        )
+        people = Person.objects.bulk_create(
+            Person(
+                surname=f"S{n}",
+                firstname="F",
+                nickname=f"N{n}",
+                gender="M",
+                birthdate=dt.date(1990, 1, 1),
+                country="FR",
+                mugshot="bench.png",
+            )
+            for n in range(len(rteams) * options["drivers"])
+        )
+        members = team_member.objects.bulk_create(
+            team_member(team=rteam, member=person, weight=70)
+            for rteam, person in zip(
+                (rt for rt in rteams for _ in range(options["drivers"])), people
+            )
+        )
+        by_team = {}
+        for member in members:
+            by_team.setdefault(member.team_id, []).append(member)
+
+        sessions = []
+        stint = dt.timedelta(hours=4) / max(options["sessions"], 1)
+        for rteam in rteams:
+            drivers = by_team[rteam.pk]
+            now = start
+            completed = options["sessions"] - 2 if last else options["sessions"]
+            for n in range(completed):
+                sessions.append(
+                    Session(
+                        round=cround,
+                        driver=drivers[n % len(drivers)],
+                        register=now - dt.timedelta(minutes=5),
+                        start=now,
+                        end=now + stint,
+                    )
+                )
+                now += stint
+            if last:
+                ontrack, waiting = drivers[0], drivers[1 % len(drivers)]
+                sessions.append(
+                    Session(round=cround, driver=ontrack, register=now, start=now)
+                )
+                sessions.append(
+                    Session(
+                        round=cround,
+                        driver=waiting,
+                        register=now + dt.timedelta(seconds=self.rng.randint(1, 600)),
+                    )
+                )
+        Session.objects.bulk_create(sessions, batch_size=1000)
+        if last:
+            rteam = self.rng.choice(rteams)
+            return cround, rteam, by_team[rteam.pk][0]
+        return None
@@ -0,0 +1,304 @@
+import datetime as dt
+import asyncio
+import socket
+import statistics
+import sys
+import threading
+import time
+from pathlib import Path
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from race.benchdb import bench_database, bench_championship, bench_teams
+from race.models import ChampionshipPenalty, Penalty, Round
+from race.penaltydispatch import penalty_dispatcher
+
+STATIONS_DIR = Path(settings.BASE_DIR) / "stations"
+
+
+class Command(BaseCommand):
+    help = (
+        "Run the stop and go station code, with simulated GPIO, relay, "
+        "framebuffer and clock, against this application served locally, "
+        "and measure the penalty throughput, the penalty_served "
+        "acknowledgement latency and the reconnection of a station. The "
+        "round, its teams, the penalties and the stations are created in a "
+        "throwaway database, a running server does not see them."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--teams", type=int, default=6, help="Teams in the bench round"
+        )
+        parser.add_argument(
+            "--stations",
+            default="1,2,3",
+            help="Numbers of stations to try (default: 1,2,3)",
+        )
+        parser.add_argument(
+            "--penalties", type=int, default=6, help="Penalties queued in each run"
+        )
+        parser.add_argument(
+            "--duration",
+            type=int,
+            default=20,
+            help="Penalty duration, in station seconds (default: 20)",
+        )
+        parser.add_argument(
+            "--script",
+            default="button@2+0.3",
+            help="Station inputs for each penalty, input@at+length in station "
+            "seconds after the team is shown (default: button@2+0.3)",
+        )
+        parser.add_argument(
+            "--speed",
+            type=float,
+            default=10,
+            help="How much faster than real time the station clock runs",
+        )
+        parser.add_argument(
+            "--delay",
+            type=float,
+            default=1,
+            help="Seconds a station gets to clear before its next penalty",
+        )
+        parser.add_argument(
+            "--framebuffer-dir",
+            help="Draw each station screen in a file framebuffer in this "
+            "directory, slow at full speed (default: no drawing)",
+        )
+        parser.add_argument(
+            "--timeout", type=float, default=120, help="Maximum length of a run"
+        )
+
+    def make_round(self, teams):
+        """A started round, its teams and a Stop & Go penalty to queue"""
+        champ = bench_championship("Bench stations")
+        now = dt.datetime.now()
+        cround = Round.objects.create(
+            name="Bench",
+            championship=champ,
+            start=now,
+            duration=dt.timedelta(hours=1),
+            ready=True,
+        )
+        cround.started = now
+        cround.save()
+        penalty = ChampionshipPenalty.objects.create(
+            championship=champ,
+            penalty=Penalty.objects.create(
+                name="Bench Stop & Go", description="Stop and go"
+            ),
+            sanction="S",
+        )
+        return cround, penalty, [team.pk for team in bench_teams(cround, teams)]
+
+    def handle(self, *args, **options):
+        try:
+            import aiohttp  # noqa: F401
+        except ImportError:
+            raise CommandError("The stations need aiohttp, see stations_requirements")
+
+        if options["teams"] < 1 or options["teams"] > 99:
+            raise CommandError("From 1 to 99 teams")
+        options["counts"] = [int(count) for count in options["stations"].split(",")]
+        self.stdout.write(
+            f"{options['teams']} teams, {options['penalties']} penalties of "
+            f"{options['duration']}s per run, station clock x{options['speed']}"
+        )
+
+        sys.path.insert(0, str(STATIONS_DIR))
+        import simulation
+
+        clock = simulation.VirtualClock(options["speed"])
+        self.simulation = simulation
+        self.module = simulation.load_station_module(clock)
+        self.station_class = simulation.simulated_station_class(self.module)
+        self.failed = []
+        penalty_dispatcher.delay = options["delay"]
+
+        # Everything runs in this process, on its own database, cache and
+        # channel layer. The stations rows go with the database.
+        with bench_database():
+            cround, penalty, teams = self.make_round(options["teams"])
+            self.serve(cround, penalty, teams, options)
+
+        if self.failed:
+            raise CommandError("; ".join(self.failed))
+        self.stdout.write(self.style.SUCCESS("All penalties served"))
+
+    def serve(self, cround, penalty, teams, options):
+        """
+        Serve the application from this thread, as runserver does, and run
+        the stations in another one until they are done.
+        """
+        from channels.routing import get_default_application
+        from daphne.server import Server
+        from twisted.internet import reactor
+
+        with socket.socket() as s:
+            s.bind(("127.0.0.1", 0))
+            port = s.getsockname()[1]
+
+        def stations():
+            try:
+                asyncio.run(
+                    self.simulate(f"127.0.0.1:{port}", cround, penalty, teams, options)
+                )
+            except Exception as e:
+                self.failed.append(f"Simulation error: {e}")
+            finally:
+                reactor.callFromThread(reactor.stop)
+
+        server = Server(
+            get_default_application(),
+            endpoints=[f"tcp:port={port}:interface=127.0.0.1"],
+            signal_handlers=False,
+            verbosity=0,
+            ready_callable=lambda: threading.Thread(target=stations).start(),
+        )
+        server.run()
+
+    async def simulate(self, address, cround, penalty, teams, options):
+        import aiohttp
+
+        self.base_url = f"http://{address}"
+        self.ws_url = f"ws://{address}/ws/stopandgo/"
+        async with aiohttp.ClientSession() as session:
+            self.session = session
+            for count in options["counts"]:
+                await self.throughput(count, cround, penalty, teams, options)
+            await self.reconnect(cround, penalty, teams, options)
+
+    def make_stations(self, count, shown, options):
+        stations = []
+        for n in range(count):
+            display = None
+            if options["framebuffer_dir"]:
+                path = Path(options["framebuffer_dir"]) / f"fb-{n + 1}"
+                display = self.module.FileFramebufferDisplay(path)
+            stations.append(
+                self.station_class(
+                    self.ws_url,
+                    100 + 2 * n,
+                    101 + 2 * n,
+                    settings.STOPANDGO_HMAC_SECRET,
+                    f"bench-{n + 1}",
+                    display,
+                    script=options["script"],
+                    shown=shown,
+                )
+            )
+        return stations
+
+    async def start_stations(self, stations):
+        tasks = [asyncio.create_task(station.run()) for station in stations]
+        deadline = time.monotonic() + 10
+        while not all(station.registered for station in stations):
+            if time.monotonic() > deadline:
+                raise RuntimeError("The stations could not register")
+            await asyncio.sleep(0.05)
+        # Let the server handle the registrations
+        await asyncio.sleep(0.2)
+        return tasks
+
+    async def stop_stations(self, tasks):
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        # Let the server see them go
+        await asyncio.sleep(0.5)
+
+    async def queue_penalties(self, cround, penalty, teams, options, count):
+        """Queue count penalties, returns penalty id -> when it was queued"""
+        queued = {}
+        for n in range(count):
+            at = time.monotonic()
+            async with self.session.post(
+                f"{self.base_url}/api/queue-penalty/",
+                json={
+                    "round_id": cround.pk,
+                    "offender_id": teams[n % len(teams)],
+                    "championship_penalty_id": penalty.pk,
+                    "value": options["duration"],
+                },
+            ) as response:
+                data = await response.json()
+            if not data.get("success"):
+                raise RuntimeError(f"Could not queue a penalty: {data.get('error')}")
+            queued[data["penalty_id"]] = at
+        return queued
+
+    async def wait_served(self, cround, options):
+        """Wait for the queue to empty, True if it did before the timeout"""
+        deadline = time.monotonic() + options["timeout"]
+        while time.monotonic() < deadline:
+            async with self.session.get(
+                f"{self.base_url}/api/round/{cround.pk}/penalty-queue-status/"
+            ) as response:
+                status = await response.json()
+            if not status["queue_count"]:
+                return True
+            await asyncio.sleep(0.1)
+        return False
+
+    async def throughput(self, count, cround, penalty, teams, options):
+        shown = {}
+        stations = self.make_stations(count, shown, options)
+        tasks = await self.start_stations(stations)
+        try:
+            start = time.monotonic()
+            queued = await self.queue_penalties(
+                cround, penalty, teams, options, options["penalties"]
+            )
+            emptied = await self.wait_served(cround, options)
+            elapsed = time.monotonic() - start
+        finally:
+            await self.stop_stations(tasks)
+
+        label = f"{count} station(s)"
+        if not emptied:
+            self.failed.append(f"{label}: the queue did not empty")
+        waits = [shown[pid] - at for pid, at in queued.items() if pid in shown]
+        acks = [latency for station in stations for latency in station.ack_latencies()]
+        if not waits or not acks:
+            self.stdout.write(f"{label}: nothing served")
+            return
+        self.stdout.write(
+            f"{label}: {len(queued)} penalties in {elapsed:.1f}s, "
+            f"{len(queued) / elapsed * 60:.1f}/min, "
+            f"wait mean {statistics.mean(waits):.1f}s max {max(waits):.1f}s, "
+            f"ack mean {statistics.mean(acks) * 1000:.1f}ms "
+            f"max {max(acks) * 1000:.1f}ms"
+        )
+
+    async def reconnect(self, cround, penalty, teams, options):
+        """
+        Drop the connection of a station as soon as it shows a penalty: it
+        must connect again, be sent the penalty again and serve it.
+        """
+        shown = {}
+        (station,) = self.make_stations(1, shown, options)
+        tasks = await self.start_stations([station])
+        try:
+            await self.queue_penalties(cround, penalty, teams, options, 1)
+            deadline = time.monotonic() + options["timeout"]
+            while not shown and time.monotonic() < deadline:
+                await asyncio.sleep(0.01)
+            shown.clear()
+            dropped = time.monotonic()
+            await station.websocket.close()
+            while not shown and time.monotonic() < deadline:
+                await asyncio.sleep(0.01)
+            emptied = await self.wait_served(cround, options)
+        finally:
+            await self.stop_stations(tasks)
+
+        if len(station.registered) < 2 or not shown or not emptied:
+            self.failed.append("The penalty was not served after a reconnection")
+            self.stdout.write("Reconnection: penalty not served")
+            return
+        self.stdout.write(
+            f"Reconnection: registered again after "
+            f"{(station.registered[1] - dropped) * 1000:.0f}ms, penalty shown "
+            f"again after {(min(shown.values()) - dropped) * 1000:.0f}ms"
+        )
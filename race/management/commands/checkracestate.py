@@ -0,0 +1,79 @@
+from django.core.management.base import BaseCommand, CommandError
+from race.models import Round, Session, ChangeLane
+from race.currentround import current_round
+from race.racestate import RaceStateStore
+
+
+class Command(BaseCommand):
+    help = (
+        "Check that the live race state of a round, built by following the "
+        "session and change lane updates, matches the database."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--round",
+            type=int,
+            help="Round id (default: the current round)",
+        )
+
+    def get_round(self, round_id):
+        if round_id:
+            try:
+                return Round.objects.get(pk=round_id)
+            except Round.DoesNotExist:
+                raise CommandError(f"Round {round_id} does not exist")
+        cround = current_round()
+        if not cround:
+            raise CommandError("Could not find a current round, use --round")
+        return cround
+
+    def replay(self, cround):
+        """
+        Build a store the way the server does during a race: start empty and
+        apply every session step and lane assignment as an update.
+        """
+        store = RaceStateStore(cround.id, RaceStateStore.load_drivers(cround.id))
+        steps = []
+        for sid, driver_id, register, start, end in Session.objects.filter(
+            round=cround
+        ).values_list("id", "driver_id", "register", "start", "end"):
+            steps.append((register, sid, driver_id, register, None, None))
+            if start is not None:
+                steps.append((start, sid, driver_id, register, start, None))
+            if end is not None:
+                steps.append((end, sid, driver_id, register, start, end))
+        steps.sort(key=lambda step: step[:2])
+        self.updates = len(steps)
+        for _, *update in steps:
+            if not store.session_saved(*update):
+                raise CommandError(f"Session {update[0]} has an unknown driver")
+        for lane_id, lane, is_open, driver_id in ChangeLane.objects.filter(
+            round=cround
+        ).values_list("id", "lane", "open", "driver_id"):
+            if not store.lane_saved(lane_id, lane, is_open, driver_id):
+                raise CommandError(f"Lane {lane} has an unknown driver")
+            self.updates += 1
+        return store
+
+    def handle(self, *args, **options):
+        cround = self.get_round(options["round"])
+        self.stdout.write(f"Round: {cround}")
+
+        loaded = RaceStateStore.load(cround.id)
+        snapshot = loaded.snapshot()
+        self.stdout.write(
+            f"{len(snapshot.pending)} pending, {len(snapshot.ontrack)} on track, "
+            f"{sum(snapshot.completed.values())} completed sessions, "
+            f"{len(snapshot.lanes)} lanes"
+        )
+
+        replayed = self.replay(cround)
+        diffs = replayed.differences(loaded)
+        for diff in diffs:
+            self.stdout.write(self.style.WARNING(diff))
+        if diffs:
+            raise CommandError("The replayed race state differs from the database")
+        self.stdout.write(
+            self.style.SUCCESS(f"Race state consistent after {self.updates} updates")
+        )
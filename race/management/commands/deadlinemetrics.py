@@ -0,0 +1,39 @@
+import datetime as dt
+from django.core.management.base import BaseCommand
+from race.lateness import lateness_histograms
+
+
+class Command(BaseCommand):
+    help = (
+        "Show how late the timed race events (pit lane opening and closing, "
+        "race end, penalty triggers) ran, as histograms."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--round", type=int, help="Only this round id")
+        parser.add_argument(
+            "--hours", type=float, help="Only the events of the last hours"
+        )
+
+    def handle(self, *args, **options):
+        since = None
+        if options["hours"]:
+            since = dt.datetime.now() - dt.timedelta(hours=options["hours"])
+        histograms = lateness_histograms(options["round"], since)
+        if not histograms:
+            self.stdout.write("No race event recorded")
+            return
+
+        for event, histogram in sorted(histograms.items()):
+            summary = histogram.as_dict()
+            self.stdout.write(
+                f"{event}: {summary['count']} events, mean {summary['mean_ms']}ms, "
+                f"p50 {summary['p50_ms']}ms, p95 {summary['p95_ms']}ms, "
+                f"p99 {summary['p99_ms']}ms, max {summary['max_ms']}ms"
+            )
+            width = max(summary["buckets"].values())
+            for label, count in summary["buckets"].items():
+                if not count:
+                    continue
+                bar = "#" * max(1, round(40 * count / width))
+                self.stdout.write(f"  {label:>10} {count:6} {bar}")
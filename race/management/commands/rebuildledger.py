@@ -0,0 +1,79 @@
+import datetime as dt
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models import Q
+from race.models import (
+    Round,
+    team_member,
+    DriverLedger,
+)
+
+
+class Command(BaseCommand):
+    help = "Recompute the driver ledgers of a round from its sessions and pauses."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--round",
+            type=int,
+            help="Round id (default: the current round)",
+        )
+        parser.add_argument(
+            "--check",
+            action="store_true",
+            help="Only compare the stored ledgers with the recomputed values",
+        )
+
+    def get_round(self, round_id):
+        if round_id:
+            try:
+                return Round.objects.get(pk=round_id)
+            except Round.DoesNotExist:
+                raise CommandError(f"Round {round_id} does not exist")
+        end_date = dt.date.today()
+        start_date = end_date - dt.timedelta(days=1)
+        cround = Round.objects.filter(
+            Q(start__date__range=[start_date, end_date]) & Q(ended__isnull=True)
+        ).first()
+        if not cround:
+            raise CommandError("Could not find a current round, use --round")
+        return cround
+
+    def handle(self, *args, **options):
+        cround = self.get_round(options["round"])
+        self.stdout.write(f"Round: {cround}")
+
+        drivers = team_member.objects.filter(team__round=cround, driver=True)
+        stored = {
+            ledger.driver_id: ledger
+            for ledger in DriverLedger.objects.filter(driver__in=drivers)
+        }
+        mismatches = 0
+        for driver in drivers.select_related("member"):
+            values = DriverLedger.totals(driver.pk)
+            ledger = stored.get(driver.pk)
+            if ledger is None:
+                # Missing ledgers are computed when read, only report real drift
+                differs = values["completed_sessions"] or values["stint_start"]
+            else:
+                differs = any(getattr(ledger, k) != v for k, v in values.items())
+            if differs:
+                mismatches += 1
+                self.stdout.write(
+                    self.style.WARNING(
+                        f"{driver.member.nickname}: stored "
+                        f"{ledger.driven if ledger else None} / "
+                        f"{ledger.completed_sessions if ledger else None} sessions, "
+                        f"computed {values['driven']} / "
+                        f"{values['completed_sessions']} sessions"
+                    )
+                )
+
+        self.stdout.write(f"{mismatches} of {drivers.count()} ledgers differ")
+        if options["check"]:
+            return
+
+        with transaction.atomic():
+            for driver in drivers:
+                DriverLedger.rebuild(driver.pk)
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt {drivers.count()} ledgers"))
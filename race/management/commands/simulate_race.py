@@ -103,8 +103,10 @@ class Command(BaseCommand):
         # Phase 5: End race (if not already ended)
         if not self.round.ended:
             self.log("Phase 5: Ending race...")
-            penalty_count = self.round.end_race()
-            self.log(f"Race ended ✓ ({penalty_count} post-race penalties applied)")
+            report = self.round.end_race()
+            self.log(
+                f"Race ended ✓ ({report['penalties_created']} post-race penalties applied)"
+            )
         else:
             self.log("Phase 5: Race already ended")
 
@@ -0,0 +1,20 @@
+# race/middleware.py
+"""
+Request middleware of the race app.
+"""
+
+from .generations import generation_scope
+
+
+class GenerationScopeMiddleware:
+    """
+    Read the shared generations once per request, rather than on every
+    access to a timing property (see race/generations.py).
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        with generation_scope():
+            return self.get_response(request)
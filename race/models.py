@@ -1,5 +1,7 @@
 from django.db import models
-from django.db.models import Q, UniqueConstraint
+from django.db import transaction
+from django.db.models import Q, Count, UniqueConstraint
+from django.db.models.functions import Greatest
 from django_countries.fields import CountryField
 from django.core.validators import MinValueValidator, MaxValueValidator
 from django.core.exceptions import (
@@ -11,6 +13,7 @@ from django.contrib.auth.models import User
 from django.utils.translation import gettext_lazy as _
 from cryptography.fernet import Fernet
 from asgiref.sync import sync_to_async
+from .pauseindex import get_pause_index
 
 import asyncio
 import datetime as dt
@@ -204,25 +207,22 @@ class Round(models.Model):
     def time_paused(self):
         pass
 
+    @property
+    def pause_index(self):
+        return get_pause_index(self.pk)
+
     @property
     def is_paused(self):
         if self.started:
-            return self.round_pause_set.filter(end__isnull=True).exists()
+            return self.pause_index.is_paused
         return True
 
     @property
     def time_elapsed(self):
-        # Calculate paused time within the session duration
+        # Race time since the start, pauses excluded
         if not self.started:
             return dt.timedelta()
-        now = dt.datetime.now()
-        totalpause = dt.timedelta()
-        for pause in self.round_pause_set.all():
-            if pause.end is None:
-                now = pause.start
-            else:
-                totalpause += pause.end - pause.start
-        return now - self.started - totalpause
+        return self.pause_index.elapsed(self.started)
 
     @sync_to_async
     def async_time_elapsed(self):
@@ -296,7 +296,7 @@ class Round(models.Model):
         )
         for session in sessions:
             session.delete()
-        ChangeLane.objects.all().delete()
+        ChangeLane.objects.filter(round=self).delete()
         return self.post_race_check()
 
     def pause_race(self):
@@ -397,166 +397,154 @@ class Round(models.Model):
         Create post-race penalties based on transgressions.
         Checks for required_changes, time_limit, and time_limit_min transgressions
         and creates RoundPenalty records for Post Race Laps penalties.
-        """
-        print(f"\n=== POST RACE CHECK STARTING for {self.name} ===")
-
-        # Safety mechanism 1: Check if post-race check already completed
-        if self.post_race_check_completed:
-            print(
-                f"⚠️ POST RACE CHECK ALREADY COMPLETED - SKIPPING to prevent duplicates"
-            )
-            return 0
 
-        # Single timestamp for all penalties created in this check
-        penalty_timestamp = dt.datetime.now()
-        penalties_created = 0
+        Everything is evaluated with a few aggregate queries and the penalties
+        are written with a single bulk_create. Returns a report dictionary:
+        penalties_created, skipped and the list of transgressions found.
+        """
+        report = {
+            "round": self.pk,
+            "skipped": False,
+            "penalties_created": 0,
+            "transgressions": [],
+        }
+        _log.info(f"Post race check starting for {self.name}")
 
         # Get championship and all relevant penalties at once
-        championship = self.championship
-        penalties = {}
-
-        # Try to get all three penalties
-        try:
-            penalties["required_changes"] = ChampionshipPenalty.objects.get(
-                championship=championship,
-                penalty__name="required changes",
-                sanction="P",  # Post Race Laps
-            )
-        except ChampionshipPenalty.DoesNotExist:
-            penalties["required_changes"] = None
-
-        try:
-            penalties["time_limit"] = ChampionshipPenalty.objects.get(
-                championship=championship,
-                penalty__name="time limit",
+        penalties = {
+            cp.penalty.name: cp
+            for cp in ChampionshipPenalty.objects.filter(
+                championship_id=self.championship_id,
+                penalty__name__in=["required changes", "time limit", "time limit min"],
                 sanction="P",  # Post Race Laps
-            )
-        except ChampionshipPenalty.DoesNotExist:
-            penalties["time_limit"] = None
-
-        try:
-            penalties["time_limit_min"] = ChampionshipPenalty.objects.get(
-                championship=championship,
-                penalty__name="time limit min",
-                sanction="P",  # Post Race Laps
-            )
-        except ChampionshipPenalty.DoesNotExist:
-            penalties["time_limit_min"] = None
-
-        # If no penalties are configured, return early
-        if not any(penalties.values()):
-            return penalties_created
+            ).select_related("penalty")
+        }
+        required_changes = penalties.get("required changes")
+        time_limit = penalties.get("time limit")
+        time_limit_min = penalties.get("time limit min")
 
         # Calculate duration in hours once for per_hour penalties (as integer)
         duration_hours = self.duration.total_seconds() // 3600
 
-        # Loop through all participating teams
-        for team in self.round_team_set.all():
-            # 1. Check team-level required_changes transgression
-            if penalties["required_changes"]:
-                transgression_count = team.required_changes_transgression
-                if transgression_count > 0:
-                    # Calculate penalty laps (ensure integer)
-                    penalty_laps = (
-                        penalties["required_changes"].value * transgression_count
-                    )
+        def penalty_laps(cpenalty, count):
+            laps = cpenalty.value * count
+            # If penalty is per hour, multiply by race duration in hours
+            if cpenalty.option == "per_hour":
+                laps = laps * duration_hours
+            return laps
+
+        with transaction.atomic():
+            # Lock the round so two concurrent checks cannot both create penalties
+            completed = (
+                Round.objects.select_for_update()
+                .filter(pk=self.pk)
+                .values_list("post_race_check_completed", flat=True)
+                .first()
+            )
+            if completed or self.post_race_check_completed:
+                _log.warning(f"Post race check already completed for {self.name}")
+                report["skipped"] = True
+                return report
+
+            if not penalties:
+                return report
+
+            teams = {
+                team.pk: team
+                for team in self.round_team_set.select_related("team").annotate(
+                    completed_sessions=Count(
+                        "team_member__session",
+                        filter=Q(team_member__session__end__isnull=False),
+                        distinct=True,
+                    ),
+                    driver_count=Count(
+                        "team_member",
+                        filter=Q(team_member__driver=True),
+                        distinct=True,
+                    ),
+                )
+            }
+            drivers = list(
+                team_member.objects.filter(team__round=self, driver=True)
+                .select_related("member", "team")
+                .order_by("team_id", "id")
+            )
+            ledgers = DriverLedger.for_drivers(drivers)
+            now = dt.datetime.now()
 
-                    # If penalty is per hour, multiply by race duration in hours
-                    if penalties["required_changes"].option == "per_hour":
-                        penalty_laps = penalty_laps * duration_hours
+            found = []
+            if required_changes:
+                for team in teams.values():
+                    sess_count = team.completed_sessions
+                    if sess_count <= self.required_changes:
+                        count = 1 + self.required_changes - sess_count
+                        found.append((team, None, required_changes, count))
 
-                    # Create RoundPenalty
-                    round_penalty = RoundPenalty.objects.create(
+            # Drivers whose longest stint is over a per session limit
+            session_limited = {}
+            for driver in drivers:
+                team = teams[driver.team_id]
+                ledger = ledgers[driver.pk]
+                time_spent = ledger.time_spent(now)
+                if time_limit:
+                    ltype, lval = self.driver_time_limit(team, team.driver_count)
+                    # An open stint counts too
+                    stint = max(ledger.longest_stint, ledger.current_stint(now))
+                    if ltype == "race" and lval < time_spent:
+                        found.append((team, driver, time_limit, 1))
+                    elif ltype == "session" and stint > lval:
+                        session_limited[driver.pk] = (team, driver, lval)
+                if time_limit_min and time_spent < self.limit_time_min:
+                    found.append((team, driver, time_limit_min, 1))
+
+            if session_limited:
+                counts = {}
+                for session in Session.objects.filter(
+                    driver_id__in=session_limited.keys(), start__isnull=False
+                ):
+                    team, driver, lval = session_limited[session.driver_id]
+                    if session.duration > lval:
+                        counts[driver.pk] = counts.get(driver.pk, 0) + 1
+                for driver_id, count in counts.items():
+                    team, driver, lval = session_limited[driver_id]
+                    found.append((team, driver, time_limit, count))
+
+            # Single timestamp for all penalties created in this check
+            penalty_timestamp = dt.datetime.now()
+            new_penalties = []
+            for team, driver, cpenalty, count in found:
+                laps = penalty_laps(cpenalty, count)
+                new_penalties.append(
+                    RoundPenalty(
                         round=self,
                         offender=team,
-                        victim=None,  # Team penalties have no victim
-                        penalty=penalties["required_changes"],
-                        value=penalty_laps,
+                        victim=None,  # Driver penalties are assigned to their team
+                        penalty=cpenalty,
+                        value=laps,
                         imposed=penalty_timestamp,
                     )
-                    penalties_created += 1
-
-            # 2. Loop through all drivers in this team
-            print(f"\n--- Checking time limit violations for Team {team.number} ---")
-            for driver in team.team_member_set.filter(driver=True):
-                # Check driver-level time_limit transgression
-                if penalties["time_limit"]:
-                    # Get detailed info for logging
-                    ltype, lval = self.driver_time_limit(team)
-                    driver_time_spent = driver.time_spent
-                    transgression_count = driver.limit_time_transgression
-
-                    print(f"Driver {driver.member.nickname}:")
-                    print(
-                        f"  - Time spent: {driver_time_spent.total_seconds()/60:.1f} minutes"
-                    )
-                    print(
-                        f"  - Time limit: {lval.total_seconds()/60:.1f} minutes ({ltype})"
-                    )
-                    print(f"  - Transgression count: {transgression_count}")
-
-                    if transgression_count > 0:
-                        print(f"  - ⚠️ VIOLATION DETECTED - Creating penalty")
-                        # Calculate penalty laps (ensure integer)
-                        penalty_laps = (
-                            penalties["time_limit"].value * transgression_count
-                        )
-
-                        # If penalty is per hour, multiply by race duration in hours
-                        if penalties["time_limit"].option == "per_hour":
-                            penalty_laps = penalty_laps * duration_hours
-
-                        print(f"  - Penalty laps: {penalty_laps}")
-
-                        # Create RoundPenalty for the driver's team
-                        round_penalty = RoundPenalty.objects.create(
-                            round=self,
-                            offender=team,
-                            victim=None,  # Driver penalties are assigned to their team
-                            penalty=penalties["time_limit"],
-                            value=penalty_laps,
-                            imposed=penalty_timestamp,
-                        )
-                        penalties_created += 1
-                    else:
-                        print(f"  - ✅ No violation")
-                else:
-                    print(
-                        f"Driver {driver.member.nickname}: No time_limit penalty configured"
-                    )
+                )
+                report["transgressions"].append(
+                    {
+                        "team": team.team.number,
+                        "driver": driver.member.nickname if driver else None,
+                        "penalty": cpenalty.penalty.name,
+                        "count": count,
+                        "value": laps,
+                    }
+                )
+            RoundPenalty.objects.bulk_create(new_penalties)
+            report["penalties_created"] = len(new_penalties)
 
-                # Check driver-level time_limit_min transgression
-                if penalties["time_limit_min"]:
-                    transgression_count = driver.limit_time_min_transgression
-                    if transgression_count > 0:
-                        # Calculate penalty laps (ensure integer)
-                        penalty_laps = (
-                            penalties["time_limit_min"].value * transgression_count
-                        )
-
-                        # If penalty is per hour, multiply by race duration in hours
-                        if penalties["time_limit_min"].option == "per_hour":
-                            penalty_laps = penalty_laps * duration_hours
-
-                        # Create RoundPenalty for the driver's team
-                        round_penalty = RoundPenalty.objects.create(
-                            round=self,
-                            offender=team,
-                            victim=None,  # Driver penalties are assigned to their team
-                            penalty=penalties["time_limit_min"],
-                            value=penalty_laps,
-                            imposed=penalty_timestamp,
-                        )
-                        penalties_created += 1
-
-        # Mark post-race check as completed to prevent duplicates
-        self.post_race_check_completed = True
-        self.save()
+            # Mark post-race check as completed to prevent duplicates
+            self.post_race_check_completed = True
+            self.save(update_fields=["post_race_check_completed"])
 
-        print(
-            f"\n=== POST RACE CHECK COMPLETE - {penalties_created} penalties created ===\n"
+        _log.info(
+            f"Post race check complete for {self.name}: "
+            f"{report['penalties_created']} penalties created"
         )
-        return penalties_created
+        return report
 
     def change_queue(self):
         sessions = self.session_set.filter(
@@ -583,14 +571,22 @@ class Round(models.Model):
         )
         return session
 
+    def _lock_for_changes(self):
+        """
+        Lock this round's row. Registrations and driver changes of a round
+        take it first so that they run one at a time. Must be called inside
+        a transaction.
+        """
+        Round.objects.select_for_update().filter(pk=self.pk).values_list(
+            "pk", flat=True
+        ).first()
+
     def driver_register(self, driver):
         """
         Creates a Session for the given driver and sets the registered time to now.
+        Registering again removes the pending session, unless the driver is due
+        in the pit lane.
         """
-        retval = {
-            "message": f"This should not have happened!",
-            "status": "error",
-        }
         if self.started and not self.pit_lane_open:
             raise ValidationError("The pit lane is closed.")
 
@@ -598,138 +594,125 @@ class Round(models.Model):
             raise ValidationError(f"{driver.member.nickname} is not a driver.")
 
         now = dt.datetime.now()
-        asession = self.session_set.filter(
-            driver=driver, register__isnull=False, start__isnull=False, end__isnull=True
-        ).first()
-        if asession:
-            return {
-                "message": f"Driver {driver.member.nickname} from team {driver.team.number} is currently driving!",
-                "status": "error",
-            }
-        #
-        # Did we already register?
-        pending_sessions = self.session_set.filter(
-            register__isnull=False, start__isnull=True, end__isnull=True
-        ).order_by("register")
-
-        # Get the top self.change_lanes sessions
-        top_sessions = pending_sessions[: self.change_lanes]
+        with transaction.atomic():
+            self._lock_for_changes()
+            open_sessions = list(
+                self.session_set.select_for_update()
+                .filter(end__isnull=True)
+                .order_by("register", "id")
+            )
+            lanes = list(
+                ChangeLane.objects.select_for_update()
+                .filter(round=self)
+                .order_by("lane")
+            )
 
-        session = self.session_set.filter(
-            driver=driver, register__isnull=False, start__isnull=True, end__isnull=True
-        ).first()
-        if session:
-            if self.started and session in top_sessions:
+            if any(s.driver_id == driver.pk and s.start for s in open_sessions):
                 return {
-                    "message": f"Driver {driver.member.nickname} from team {driver.team.number} is due in pit lane. Cannot be removed.",
+                    "message": f"Driver {driver.member.nickname} from team {driver.team.number} is currently driving!",
                     "status": "error",
                 }
-            else:
+            #
+            # Did we already register?
+            pending_sessions = [s for s in open_sessions if s.start is None]
+            session = next(
+                (s for s in pending_sessions if s.driver_id == driver.pk), None
+            )
+            if session:
+                if self.started and session in pending_sessions[: self.change_lanes]:
+                    return {
+                        "message": f"Driver {driver.member.nickname} from team {driver.team.number} is due in pit lane. Cannot be removed.",
+                        "status": "error",
+                    }
                 session.delete()
+                # Do not leave the lane to someone who is no longer waiting
+                for alane in lanes:
+                    if alane.driver_id == driver.pk:
+                        alane.round = self
+                        alane.next_driver()
                 return {
                     "message": f"Driver {driver.member.nickname} from team {driver.team.number} was removed.",
                     "status": "warning",
                 }
-        else:
-            session = Session.objects.create(
-                driver=driver,
-                round=self,
-                register=now,
-            )
-            retval = {
-                "message": f"Driver {driver.member.nickname} from team {driver.team.number} registered.",
-                "status": "ok",
-            }
-        if self.started:
-            alane = (
-                ChangeLane.objects.filter(round=self, driver__isnull=True)
-                .order_by("lane")
-                .first()
-            )
-            if alane:
-                alane.driver = driver
-                alane.save()
-        return retval
+
+            Session.objects.create(driver=driver, round=self, register=now)
+            if self.started:
+                alane = next((l for l in lanes if l.driver_id is None), None)
+                if alane:
+                    alane.driver = driver
+                    alane.save()
+        return {
+            "message": f"Driver {driver.member.nickname} from team {driver.team.number} registered.",
+            "status": "ok",
+        }
 
     def driver_endsession(self, driver):
         """
         Ends the given driver's session and starts the next driver's session on the same team.
         """
-
-        retval = {
-            "message": f"This should not have happened!",
-            "status": "error",
-        }
         now = dt.datetime.now()
+        with transaction.atomic():
+            self._lock_for_changes()
 
-        # 1. End the current driver's session
-        try:
-            current_session = driver.session_set.get(
-                round=self,
-                register__isnull=False,
-                start__isnull=False,
-                end__isnull=True,
-            )
-        except ObjectDoesNotExist:
-            raise ValidationError(f"Driver {driver} has no current session.")
-        except MultipleObjectsReturned:
-            raise ValidationError(f"Driver {driver} has multiple current sessions.")
-
-        # 2. Find and start the next driver's session
-        try:
-            related_team_members = team_member.objects.filter(team=driver.team)
+            # 1. End the current driver's session
+            try:
+                current_session = driver.session_set.select_for_update().get(
+                    round=self,
+                    register__isnull=False,
+                    start__isnull=False,
+                    end__isnull=True,
+                )
+            except ObjectDoesNotExist:
+                raise ValidationError(f"Driver {driver} has no current session.")
+            except MultipleObjectsReturned:
+                raise ValidationError(f"Driver {driver} has multiple current sessions.")
 
-            # Find the oldest active session among these team members
+            # 2. Find and start the next driver's session, the oldest waiting one
             next_session = (
-                Session.objects.filter(
-                    driver__in=related_team_members,
+                Session.objects.select_for_update()
+                .filter(
+                    round=self,
+                    driver__team_id=driver.team_id,
                     start__isnull=True,
                     end__isnull=True,
                 )
-                .order_by("register")
+                .order_by("register", "id")
                 .first()
             )
-
-            if next_session:
-                current_session.end = now
-                current_session.save()
-                next_session.start = now
-                next_session.save()
-
-                retval = {
-                    "message": f"Driver {driver.member.nickname} from team {driver.team.number} ended session.",
-                    "status": "ok",
-                }
-                # Update change lane
-                alane = ChangeLane.objects.filter(
-                    round=self, driver=next_session.driver
-                ).first()
-                if alane:
-                    alane.next_driver()
-                else:
-                    print(f"Error: Could not find lane for {next_session.driver}")
-            else:
-                retval = {
+            if not next_session:
+                return {
                     "message": f"Keeo driving no one is waiting for teasm {driver.team.number}.",
                     "status": "error",
                 }
 
-        except ObjectDoesNotExist:
-            # Driver is not associated with a round_team
-            print(f"Driver {driver} is not associated with a round_team.")
-            retval["message"] = f"Driver {driver} is not associated with a round_team."
-        except MultipleObjectsReturned:
-            # Driver is associated with multiple round_teams (unexpected)
-            print(f"Driver {driver} is associated with multiple round_teams.")
-            retval[
-                "message"
-            ] = f"Driver {driver} is associated with multiple round_teams."
-        return retval
-
-    def driver_time_limit(self, rteam):
+            current_session.end = now
+            current_session.save()
+            next_session.start = now
+            next_session.save()
+
+            # Update change lane
+            alane = (
+                ChangeLane.objects.select_for_update()
+                .filter(round=self, driver_id=next_session.driver_id)
+                .first()
+            )
+            if alane:
+                alane.round = self
+                alane.next_driver()
+            else:
+                _log.warning(
+                    "Could not find lane for driver %s", next_session.driver_id
+                )
+        return {
+            "message": f"Driver {driver.member.nickname} from team {driver.team.number} ended session.",
+            "status": "ok",
+        }
+
+    def driver_time_limit(self, rteam, driver_count=None):
         """
         For a team member, calculate the max time driving.
         Returns (limit_type, limit_timedelta) where limit_timedelta is always a timedelta.
+        driver_count can be passed when the number of drivers of the team is known.
         """
         if self.limit_time == "none":
             return None, None
@@ -739,7 +722,10 @@ class Round(models.Model):
             # Convert minutes to timedelta
             return self.limit_time, dt.timedelta(minutes=self.limit_value)
         elif self.limit_method == "percent":
-            driver_count = team_member.objects.filter(team=rteam, driver=True).count()
+            if driver_count is None:
+                driver_count = team_member.objects.filter(
+                    team=rteam, driver=True
+                ).count()
             maxt = (self.duration / driver_count) * (1 + self.limit_value / 100)
             return self.limit_time, maxt  # maxt is already a timedelta
         return None, None
@@ -915,71 +901,11 @@ class team_member(models.Model):
 
     @property
     def time_spent(self):
-        sessions = self.session_set.filter(driver=self, start__isnull=False)
-        total_time = dt.timedelta(0)
-        now = dt.datetime.now()
-        for session in sessions:
-            if session.end:
-                session_time = session.end - session.start
-            else:
-                session_time = now - session.start
-            paused_time = dt.timedelta(0)
-
-            # Calculate paused time within the session duration
-            if session.end:
-                pauses = self.team.round.round_pause_set.filter(
-                    start__lte=session.end,
-                    end__gte=session.start,
-                )
-            else:
-                pauses = self.team.round.round_pause_set.filter(
-                    Q(start__lte=now), Q(end__gte=session.start) | Q(end__isnull=True)
-                )
-
-            for pause in pauses:
-                pause_start = max(pause.start, session.start)
-                pause_end = min(
-                    pause.end or now, session.end or now
-                )  # if pause.end is null, use now.
-                paused_time += pause_end - pause_start
-
-            total_time += session_time - paused_time
-        return total_time
+        return DriverLedger.for_driver(self).time_spent()
 
     @property
     def current_session(self):
-        total_time = dt.timedelta(0)
-        try:
-            sessions = self.session_set.filter(
-                driver=self, start__isnull=False, end__isnull=True
-            )
-            now = dt.datetime.now()
-            for session in sessions:
-                session_time = now - session.start
-                paused_time = dt.timedelta(0)
-
-                # Calculate paused time within the session duration
-
-                pauses = self.team.round.round_pause_set.filter(
-                    Q(start__lte=now), Q(end__gte=session.start) | Q(end__isnull=True)
-                )
-
-                for pause in pauses:
-                    pause_start = max(pause.start, session.start)
-                    pause_end = pause.end or now  # if pause.end is null, use now.
-                    paused_time += pause_end - pause_start
-
-                total_time += session_time - paused_time
-                return total_time
-        except ObjectDoesNotExist:
-            # Handle the case where no session is found
-            pass
-        except MultipleObjectsReturned:
-            _log.critical("There should be only one active session per team/driver")
-        except Exception as e:
-            _log.critical(f"Active session exception: {e}")
-        finally:
-            return total_time
+        return DriverLedger.for_driver(self).current_stint()
 
     @property
     def ontrack(self):
@@ -1029,8 +955,12 @@ class team_member(models.Model):
         cround = self.team.round
         did_transgress = 0
         ltype, lval = cround.driver_time_limit(self.team)
-        time_spent = self.time_spent
+        ledger = DriverLedger.for_driver(self)
+        time_spent = ledger.time_spent()
         if ltype == "session":
+            if max(ledger.longest_stint, ledger.current_stint()) <= lval:
+                # No stint went over the limit, no need to look at them all
+                return 0
             all_sessions = Session.objects.filter(driver=self)
             for session in all_sessions:
                 if session.duration > lval:
@@ -1064,43 +994,200 @@ class Session(models.Model):
     start = models.DateTimeField(null=True, blank=True)
     end = models.DateTimeField(null=True, blank=True)
 
+    # Stored start/end, so the driver ledger can tell what a save changed
+    _ledger_start = None
+    _ledger_end = None
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._ledger_start = instance.__dict__.get("start")
+        instance._ledger_end = instance.__dict__.get("end")
+        return instance
+
+    def refresh_from_db(self, *args, **kwargs):
+        super().refresh_from_db(*args, **kwargs)
+        self._ledger_start = self.__dict__.get("start")
+        self._ledger_end = self.__dict__.get("end")
+
     class Meta:
         verbose_name = _("Session")
         verbose_name_plural = _("Sessions")
+        indexes = [
+            # Drivers waiting for a change, in registration order
+            models.Index(
+                fields=["round", "register"],
+                condition=Q(start__isnull=True, end__isnull=True),
+                name="session_queue_idx",
+            ),
+            # Open sessions, waiting or on track, of a round or a driver
+            models.Index(
+                fields=["round", "driver", "start"],
+                condition=Q(end__isnull=True),
+                name="session_open_idx",
+            ),
+            # Completed sessions, counted per driver and team
+            models.Index(
+                fields=["driver", "round"],
+                condition=Q(end__isnull=False),
+                name="session_completed_idx",
+            ),
+        ]
 
     def __str__(self):
         return f"{self.driver.member.nickname} in {self.round}"
 
     @property
     def duration(self):
-        total_time = dt.timedelta(0)
-        now = dt.datetime.now()
-        if self.end:
-            session_time = self.end - self.start
-        else:
-            session_time = now - self.start
-        paused_time = dt.timedelta(0)
-
-        # Calculate paused time within the session duration
-        if self.end:
-            pauses = self.round.round_pause_set.filter(
-                start__lte=self.end,
-                end__gte=self.start,
-            )
-        else:
-            pauses = self.round.round_pause_set.filter(
-                Q(start__lte=now), Q(end__gte=self.start) | Q(end__isnull=True)
+        return get_pause_index(self.round_id).elapsed(self.start, self.end)
+
+
+class DriverLedger(models.Model):
+    """
+    Running totals of the completed sessions of a driver.
+
+    Updated when a session ends (or a pause changes the past), so the
+    driving time of a driver is one row plus the ongoing stint instead of
+    a walk through the whole session history.
+    """
+
+    driver = models.OneToOneField(
+        team_member, on_delete=models.CASCADE, related_name="ledger"
+    )
+    driven = models.DurationField(default=dt.timedelta)
+    completed_sessions = models.IntegerField(default=0)
+    longest_stint = models.DurationField(default=dt.timedelta)
+    stint_start = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        verbose_name = _("Driver Ledger")
+        verbose_name_plural = _("Driver Ledgers")
+
+    def __str__(self):
+        return f"Ledger of {self.driver}"
+
+    def current_stint(self, now=None):
+        if self.stint_start is None:
+            return dt.timedelta(0)
+        return get_pause_index(self.driver.team.round_id).elapsed(
+            self.stint_start, None, now
+        )
+
+    def time_spent(self, now=None):
+        return self.driven + self.current_stint(now)
+
+    @classmethod
+    def totals(cls, driver_id):
+        """Recompute the ledger values of a driver from its sessions."""
+        values = {
+            "driven": dt.timedelta(0),
+            "completed_sessions": 0,
+            "longest_stint": dt.timedelta(0),
+            "stint_start": None,
+        }
+        sessions = Session.objects.filter(driver_id=driver_id, start__isnull=False)
+        for session in sessions:
+            if session.end is None:
+                values["stint_start"] = session.start
+                continue
+            stint = session.duration
+            values["driven"] += stint
+            values["completed_sessions"] += 1
+            values["longest_stint"] = max(values["longest_stint"], stint)
+        return values
+
+    @classmethod
+    def rebuild(cls, driver_id, create=True):
+        values = cls.totals(driver_id)
+        if create:
+            ledger, _created = cls.objects.update_or_create(
+                driver_id=driver_id, defaults=values
             )
+            return ledger
+        # Deletions: do not resurrect the ledger of a driver being deleted
+        cls.objects.filter(driver_id=driver_id).update(**values)
+        return None
+
+    @classmethod
+    def rebuild_round(cls, round_id, since=None, create=True):
+        """Rebuild the ledgers of the drivers with sessions ended after 'since'."""
+        sessions = Session.objects.filter(round_id=round_id, end__isnull=False)
+        if since is not None:
+            sessions = sessions.filter(end__gte=since)
+        driver_ids = set(sessions.values_list("driver_id", flat=True))
+        for driver_id in driver_ids:
+            cls.rebuild(driver_id, create=create)
+        return len(driver_ids)
+
+    @classmethod
+    def for_driver(cls, driver):
+        """
+        The ledger of a driver. A missing one is computed but not saved:
+        only session_saved and rebuild write ledgers, a read racing with a
+        session change would store stale totals.
+        """
+        try:
+            return driver.ledger
+        except ObjectDoesNotExist:
+            driver.ledger = cls(driver=driver, **cls.totals(driver.pk))
+            return driver.ledger
 
-        for pause in pauses:
-            pause_start = max(pause.start, self.start)
-            pause_end = min(
-                pause.end or now, self.end or now
-            )  # if pause.end is null, use now.
-            paused_time += pause_end - pause_start
+    @classmethod
+    def for_drivers(cls, drivers):
+        """
+        Ledgers of many drivers at once, as a dict keyed by driver id.
+        Missing ledgers are computed from one session query, not saved.
+        """
+        ledgers = {
+            ledger.driver_id: ledger
+            for ledger in cls.objects.filter(driver__in=drivers)
+        }
+        missing = {driver.pk: driver for driver in drivers if driver.pk not in ledgers}
+        if missing:
+            new = {pk: cls(driver=driver) for pk, driver in missing.items()}
+            for session in Session.objects.filter(
+                driver_id__in=missing.keys(), start__isnull=False
+            ):
+                ledger = new[session.driver_id]
+                if session.end is None:
+                    ledger.stint_start = session.start
+                    continue
+                stint = session.duration
+                ledger.driven += stint
+                ledger.completed_sessions += 1
+                ledger.longest_stint = max(ledger.longest_stint, stint)
+            ledgers.update(new)
+        for driver in drivers:
+            ledgers[driver.pk].driver = driver
+        return ledgers
 
-        total_time += session_time - paused_time
-        return total_time
+    @classmethod
+    def session_saved(cls, session):
+        """Apply a saved session to its driver's ledger."""
+        old_start, old_end = session._ledger_start, session._ledger_end
+        session._ledger_start, session._ledger_end = session.start, session.end
+        if old_start == session.start and old_end == session.end:
+            return
+        ledger = cls.objects.filter(driver_id=session.driver_id)
+        if old_end is None and session.end and old_start == session.start:
+            # The usual case: a stint just ended
+            stint = session.duration
+            updated = ledger.update(
+                driven=models.F("driven") + stint,
+                completed_sessions=models.F("completed_sessions") + 1,
+                longest_stint=Greatest("longest_stint", models.Value(stint)),
+                stint_start=None,
+            )
+        elif old_end is None and session.end is None:
+            # Started, or start reset by a false start
+            updated = ledger.update(stint_start=session.start)
+        else:
+            updated = 0
+        if not updated:
+            cls.rebuild(session.driver_id)
+        # A ledger cached on the driver instance is stale now
+        if Session.driver.is_cached(session):
+            session.driver._state.fields_cache.pop("ledger", None)
 
 
 class ChangeLane(models.Model):
@@ -1209,6 +1296,28 @@ class RoundPenalty(models.Model):
         return f"{self.penalty.penalty.name} ({self.value}) for {self.offender}"
 
 
+class StopAndGoStation(models.Model):
+    """
+    A stop and go station, registered when it connects. Penalties are
+    assigned to the stations that are online and free.
+    """
+
+    station = models.CharField(max_length=32, unique=True)
+    channel_name = models.CharField(max_length=256, null=True, blank=True)
+    online = models.BooleanField(default=False)
+    last_seen = models.DateTimeField(null=True, blank=True)
+    # When the last penalty it handled was done with
+    freed = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        verbose_name = _("Stop & Go Station")
+        verbose_name_plural = _("Stop & Go Stations")
+        ordering = ["station"]
+
+    def __str__(self):
+        return f"Stop & Go station {self.station}"
+
+
 class PenaltyQueue(models.Model):
     """
     Queue for Stop & Go penalties to handle multiple penalties in sequence.
@@ -1220,6 +1329,14 @@ class PenaltyQueue(models.Model):
         RoundPenalty, on_delete=models.CASCADE, related_name="penalty_queue"
     )
     timestamp = models.DateTimeField(default=dt.datetime.now)
+    # The station serving it, None while waiting for one
+    station = models.ForeignKey(
+        StopAndGoStation,
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name="penalties",
+    )
 
     class Meta:
         verbose_name = _("Penalty Queue Entry")
@@ -1250,8 +1367,51 @@ class PenaltyQueue(models.Model):
         """Async version of get_next_penalty"""
         return await cls.objects.filter(round_penalty__round_id=round_id).afirst()
 
+    @classmethod
+    def serve(cls, round_id, team_number=None, penalty_id=None):
+        """
+        Mark a queued penalty served and remove it from the queue, in one
+        transaction: the given penalty, else the first one of the team, else
+        the head of the queue. Returns the served RoundPenalty, None when
+        there is no such penalty in the queue (e.g. it was already served).
+        """
+        with transaction.atomic():
+            entries = cls.objects.select_for_update().filter(
+                round_penalty__round_id=round_id, round_penalty__served__isnull=True
+            )
+            if penalty_id is not None:
+                entries = entries.filter(round_penalty_id=penalty_id)
+            elif team_number is not None:
+                entries = entries.filter(
+                    round_penalty__offender__team__number=team_number
+                )
+            entry = entries.first()
+            if entry is None:
+                return None
+            round_penalty = entry.round_penalty
+            round_penalty.served = dt.datetime.now()
+            round_penalty.save(update_fields=["served"])
+            entry.release_station()
+            entry.delete()
+            return round_penalty
+
+    def release_station(self):
+        """
+        Unassign the penalty from its station, which is free again. Returns
+        the station, None if the penalty was not assigned.
+        """
+        if self.station_id is None:
+            return None
+        station = self.station
+        StopAndGoStation.objects.filter(pk=self.station_id).update(
+            freed=dt.datetime.now()
+        )
+        self.station = None
+        return station
+
     def delay_penalty(self):
         """Move this penalty to the end of the queue"""
+        self.release_station()
         self.timestamp = dt.datetime.now()
         self.save()
 
@@ -1261,6 +1421,47 @@ class PenaltyQueue(models.Model):
         return self.delay_penalty()
 
 
+class RaceEventTiming(models.Model):
+    """
+    When a timed race event (pit lane opening and closing, race end,
+    penalty trigger, stop and go countdown end) was due and when it
+    actually ran.
+    """
+
+    round = models.ForeignKey(Round, on_delete=models.CASCADE)
+    event = models.CharField(max_length=32)
+    intended = models.DateTimeField()
+    fired = models.DateTimeField()
+    # Seconds, fired - intended
+    lateness = models.FloatField()
+
+    class Meta:
+        verbose_name = _("Race Event Timing")
+        verbose_name_plural = _("Race Event Timings")
+
+    def __str__(self):
+        return f"{self.round.name} {self.event} {self.lateness * 1000:.1f}ms late"
+
+
+class SchedulerLease(models.Model):
+    """
+    Lease on a job that must run in one process only. The holder renews it
+    before it expires; once expired any process may take it over.
+    """
+
+    name = models.CharField(max_length=64, unique=True)
+    holder = models.CharField(max_length=128)
+    expires = models.DateTimeField()
+    since = models.DateTimeField()
+
+    class Meta:
+        verbose_name = _("Scheduler Lease")
+        verbose_name_plural = _("Scheduler Leases")
+
+    def __str__(self):
+        return f"{self.name} held by {self.holder}"
+
+
 class Logo(models.Model):
     name = models.CharField(max_length=128)
     image = models.ImageField(upload_to=logo_path)
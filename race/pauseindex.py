@@ -0,0 +1,120 @@
+# race/pauseindex.py
+"""
+In-memory index of the pauses of a round.
+
+All the timing properties (round clock, driver time spent, session
+duration) need "how long was the race paused between t0 and t1". Rather
+than querying round_pause and walking every pause for every driver, the
+pauses of a round are loaded once into sorted intervals with cumulative
+paused time, so the answer is two bisects. The index is dropped whenever
+a round_pause is saved or deleted (see race/signals.py), in this process
+and, through a shared generation, in the others.
+"""
+
+import bisect
+import datetime as dt
+import threading
+from django.db import transaction
+from .generations import bump, generation
+
+
+class PauseIndex:
+    """
+    Sorted pause intervals of one round with prefix sums of paused time.
+
+    Closed pauses are stored as parallel start/end lists. At most one pause
+    is open (end is None); it is kept aside and extends up to "now" when
+    the index is queried.
+    """
+
+    def __init__(self, pauses):
+        self.starts = []
+        self.ends = []
+        self.prefix = [dt.timedelta()]
+        self.open_start = None
+        for start, end in sorted(pauses, key=lambda p: p[0]):
+            if end is None:
+                self.open_start = start
+                continue
+            self.starts.append(start)
+            self.ends.append(end)
+            self.prefix.append(self.prefix[-1] + (end - start))
+
+    @property
+    def is_paused(self):
+        return self.open_start is not None
+
+    @property
+    def count(self):
+        return len(self.starts) + (1 if self.is_paused else 0)
+
+    def paused_until(self, when, now=None):
+        """Total paused time from the first pause up to the instant 'when'."""
+        total = dt.timedelta()
+        k = bisect.bisect_right(self.starts, when)
+        if k:
+            # Every closed pause before the k-th one ended before it started
+            total = self.prefix[k - 1] + (
+                min(when, self.ends[k - 1]) - self.starts[k - 1]
+            )
+        if self.open_start is not None and when > self.open_start:
+            now = now or dt.datetime.now()
+            total += min(when, now) - self.open_start
+        return total
+
+    def paused_between(self, start, end=None, now=None):
+        """
+        Paused time within [start, end]. An open interval (end is None) runs
+        until now, like an ongoing session.
+        """
+        now = now or dt.datetime.now()
+        if end is None:
+            end = now
+        if end <= start:
+            return dt.timedelta()
+        return self.paused_until(end, now) - self.paused_until(start, now)
+
+    def elapsed(self, start, end=None, now=None):
+        """Wall clock time between start and end, minus the pauses."""
+        now = now or dt.datetime.now()
+        if end is None:
+            end = now
+        return (end - start) - self.paused_between(start, end, now)
+
+
+_indexes = {}
+_lock = threading.Lock()
+
+
+def _generation_key(round_id):
+    return f"pause_index_{round_id}"
+
+
+def get_pause_index(round_id):
+    """Return the (cached) PauseIndex of the given round."""
+    # Pauses may be changed by another process, see race/generations.py
+    current = generation(_generation_key(round_id))
+    entry = _indexes.get(round_id)
+    if entry is not None and entry[0] == current:
+        return entry[1]
+
+    from .models import round_pause
+
+    index = PauseIndex(
+        round_pause.objects.filter(round_id=round_id).values_list("start", "end")
+    )
+    with _lock:
+        # Tagged with the generation read before loading: a pause changed
+        # while we were loading makes it stale at once
+        _indexes[round_id] = (current, index)
+    return index
+
+
+def invalidate_pause_index(round_id):
+    with _lock:
+        _indexes.pop(round_id, None)
+    key = _generation_key(round_id)
+    bump(key)
+    # Other processes only see the change once committed, they may have
+    # loaded the old pauses in between
+    transaction.on_commit(lambda: bump(key))
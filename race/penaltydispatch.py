@@ -0,0 +1,397 @@
+# race/penaltydispatch.py
+"""
+Stop and go penalty queue progression.
+
+When a penalty is served, cancelled or delayed the station is reset and,
+after a short delay for it to clear, the next penalty in the queue is
+sent to it. This used to be done by every StopAndGoConsumer receiving the
+group message, each sleeping 10 seconds inside its message handler, so
+every open race control page sent its own penalty_required. The
+dispatcher owns that now: one timer per round, which the triggers arriving
+while it is pending are merged into, and a penalty is not sent again
+unless it moved in the queue since. Callers return immediately. Each
+server process has its own timers; what was sent is remembered in the
+shared cache and the station assignments in the database, so a penalty
+is not sent twice whichever process dispatches.
+
+Stations that register with an id (see StopAndGoStation) share the queue:
+the oldest unassigned penalties go to the free stations, once DELAY has
+passed since their previous penalty. Without any registered station, the
+head of the queue is sent to the whole stop and go group, for stations
+that do not register; so are the commands of race control, which
+otherwise go to the station they are for (see station_targets). A
+penalty race control sends itself goes to a free station, which is then
+left out of the queue until it is done. Each process refreshes the last_seen of the
+stations connected to it; a station not refreshed for STATION_TIMEOUT
+seconds, because its process died, is offline and its penalty goes back
+to the queue.
+"""
+
+import datetime as dt
+import logging
+import threading
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from django.core.cache import cache
+from django.db import connection, transaction
+from .lateness import record_timing
+
+_log = logging.getLogger(__name__)
+
+# Seconds the station gets to clear before the next penalty
+DELAY = 10
+# Seconds a queue entry sent to the stop and go group is remembered
+SENT_TIMEOUT = 24 * 60 * 60
+# Seconds between the last_seen updates of the stations connected to a process
+STATION_REFRESH = 30
+# Seconds without an update after which a station is taken as offline: the
+# process it was connected to died without running disconnect
+STATION_TIMEOUT = 3 * STATION_REFRESH
+
+# Stations connected to this process: station id -> channel name
+_connected = {}
+_connected_lock = threading.Lock()
+
+
+def online_stations():
+    from .models import StopAndGoStation
+
+    cutoff = dt.datetime.now() - dt.timedelta(seconds=STATION_TIMEOUT)
+    return StopAndGoStation.objects.filter(online=True, last_seen__gte=cutoff)
+
+
+def station_states():
+    """The stations and the team each one is serving, for race control."""
+    from .models import StopAndGoStation
+
+    states = []
+    online = set(online_stations().values_list("pk", flat=True))
+    for station in StopAndGoStation.objects.prefetch_related(
+        "penalties__round_penalty__offender__team"
+    ):
+        serving = [
+            entry.round_penalty.offender.team.number
+            for entry in station.penalties.all()
+        ]
+        states.append(
+            {
+                "station": station.station,
+                "online": station.pk in online,
+                "serving_team": serving[0] if serving else None,
+            }
+        )
+    return states
+
+
+def _release_penalties(record):
+    """Put the penalties assigned to a station back in the queue."""
+    for entry in record.penalties.all():
+        entry.station = None
+        entry.save(update_fields=["station"])
+
+
+def register_station(station, channel_name):
+    """A station connected: it is online, and free for a penalty."""
+    from .models import StopAndGoStation
+
+    record, _ = StopAndGoStation.objects.update_or_create(
+        station=station,
+        defaults={
+            "channel_name": channel_name,
+            "online": True,
+            "last_seen": dt.datetime.now(),
+        },
+    )
+    with _connected_lock:
+        _connected[station] = channel_name
+    # Sent to a previous connection that may not have seen disconnect run,
+    # e.g. the server restarted: send them again
+    _release_penalties(record)
+    for round_id in waiting_rounds():
+        penalty_dispatcher.schedule(round_id, 0)
+
+
+def _set_offline(record):
+    record.online = False
+    record.channel_name = None
+    record.last_seen = dt.datetime.now()
+    record.save()
+    _release_penalties(record)
+
+
+def unregister_station(station, channel_name):
+    """
+    A station disconnected: the penalty it was serving goes back to the
+    other stations.
+    """
+    from .models import StopAndGoStation
+
+    with _connected_lock:
+        if _connected.get(station) == channel_name:
+            del _connected[station]
+    try:
+        # It may already have registered again from another connection
+        record = StopAndGoStation.objects.get(
+            station=station, channel_name=channel_name
+        )
+    except StopAndGoStation.DoesNotExist:
+        return
+    _set_offline(record)
+    for round_id in waiting_rounds():
+        penalty_dispatcher.schedule(round_id, 0)
+
+
+def refresh_stations():
+    """
+    Tell the other processes the stations connected to this one are still
+    there. Run every STATION_REFRESH seconds in every process.
+    """
+    from .models import StopAndGoStation
+
+    with _connected_lock:
+        connected = list(_connected.items())
+    try:
+        now = dt.datetime.now()
+        for station, channel_name in connected:
+            StopAndGoStation.objects.filter(
+                station=station, channel_name=channel_name
+            ).update(last_seen=now)
+    finally:
+        # Runs in a scheduler thread, do not leak its connection
+        connection.close()
+
+
+def expire_stations():
+    """
+    Take the stations not refreshed for STATION_TIMEOUT seconds offline,
+    and their penalties back to the queue. Run by the elected process.
+    """
+    from .models import StopAndGoStation
+
+    cutoff = dt.datetime.now() - dt.timedelta(seconds=STATION_TIMEOUT)
+    try:
+        stale = StopAndGoStation.objects.filter(online=True).exclude(
+            last_seen__gte=cutoff
+        )
+        expired = False
+        for record in stale:
+            _log.warning("Stop and go station %s timed out", record.station)
+            _set_offline(record)
+            expired = True
+        if expired:
+            for round_id in waiting_rounds():
+                penalty_dispatcher.schedule(round_id, 0)
+    finally:
+        connection.close()
+
+
+def station_targets(station=None, team=None, every=True):
+    """
+    The registered stations a race control command goes to, as (station,
+    channel name): the given station, the one serving the penalty of the
+    team, or with every, all the online ones. None when no station is
+    registered: the command then goes to the whole stop and go group, for
+    stations that do not register.
+    """
+    online = online_stations()
+    if not online.exists():
+        return None
+    if station is not None:
+        online = online.filter(station=station)
+    elif team is not None:
+        online = online.filter(
+            penalties__round_penalty__offender__team__number=team
+        ).distinct()
+    elif not every:
+        return []
+    return list(online.values_list("station", "channel_name"))
+
+
+def manual_penalty_target(duration, station=None):
+    """
+    The station a penalty sent by race control, outside the queue, goes to:
+    the given one or a free one. The dispatcher leaves it alone until the
+    penalty is over and it has cleared. None when no station is registered.
+    """
+    from .models import PenaltyQueue
+
+    with transaction.atomic():
+        online = online_stations()
+        if not online.exists():
+            return None
+        if station is not None:
+            online = online.filter(station=station)
+        else:
+            busy = PenaltyQueue.objects.filter(station__isnull=False).values_list(
+                "station_id", flat=True
+            )
+            cleared = dt.datetime.now() - dt.timedelta(seconds=DELAY)
+            online = online.exclude(pk__in=list(busy)).exclude(freed__gt=cleared)
+        record = online.select_for_update().first()
+        if record is None:
+            return []
+        record.freed = dt.datetime.now() + dt.timedelta(seconds=duration)
+        record.save(update_fields=["freed"])
+    return [(record.station, record.channel_name)]
+
+
+def waiting_rounds():
+    from .models import PenaltyQueue
+
+    return set(
+        PenaltyQueue.objects.filter(station__isnull=True).values_list(
+            "round_penalty__round_id", flat=True
+        )
+    )
+
+
+def penalty_message(round_penalty, station=None):
+    return {
+        "type": "penalty_required",
+        "team": round_penalty.offender.team.number,
+        "duration": round_penalty.value,
+        "penalty_id": round_penalty.id,
+        "station": station,
+    }
+
+
+class PenaltyDispatcher:
+    def __init__(self, delay=DELAY):
+        self.delay = delay
+        # Per round, the pending timer and when it is due
+        self._timers = {}
+        self._lock = threading.Lock()
+
+    def schedule(self, round_id, delay=None):
+        """
+        Send the next penalty of the round once the delay has passed. A
+        trigger arriving while one is pending is merged into it, the earliest
+        wins: the dispatch re-arms for the stations still clearing.
+        """
+        # Views pass the id as posted
+        round_id = int(round_id)
+        delay = self.delay if delay is None else delay
+        intended = dt.datetime.now() + dt.timedelta(seconds=delay)
+        timer = threading.Timer(delay, self._run, args=(round_id, intended))
+        timer.daemon = True
+        with self._lock:
+            previous = self._timers.get(round_id)
+            if previous is not None:
+                if previous[1] <= intended:
+                    return
+                previous[0].cancel()
+            self._timers[round_id] = (timer, intended)
+        timer.start()
+
+    def pending(self, round_id):
+        with self._lock:
+            return round_id in self._timers
+
+    def _run(self, round_id, intended):
+        with self._lock:
+            pending = self._timers.get(round_id)
+            if pending is not None and pending[0] is threading.current_thread():
+                del self._timers[round_id]
+        try:
+            self.dispatch(round_id, intended)
+        except Exception:
+            _log.exception("Could not dispatch the next penalty of round %s", round_id)
+            # Nothing else would trigger the waiting penalties, try again
+            self.schedule(round_id)
+        finally:
+            # Runs in a timer thread, do not leak its connection
+            connection.close()
+
+    def dispatch(self, round_id, intended=None):
+        """Send the queued penalties to the stations, unless they already were."""
+        if online_stations().exists():
+            self._assign(int(round_id), intended)
+        else:
+            self._broadcast(int(round_id), intended)
+
+    def _broadcast(self, round_id, intended):
+        from .models import PenaltyQueue
+
+        entry = (
+            PenaltyQueue.objects.filter(round_penalty__round_id=round_id)
+            .select_related("round_penalty__offender__team")
+            .first()
+        )
+        if entry is None:
+            return
+        # Any process may dispatch, the first one to send the entry wins
+        key = f"penalty_sent_{entry.pk}_{entry.timestamp.isoformat()}"
+        if not cache.add(key, True, SENT_TIMEOUT):
+            return
+
+        round_penalty = entry.round_penalty
+        fired = dt.datetime.now()
+        async_to_sync(get_channel_layer().group_send)(
+            "stopandgo", penalty_message(round_penalty)
+        )
+        if intended is not None:
+            record_timing(round_id, "penalty_trigger", intended, fired)
+        _log.info(
+            "Triggered next penalty for team %s", round_penalty.offender.team.number
+        )
+
+    def _assign(self, round_id, intended):
+        from .models import PenaltyQueue
+
+        now = dt.datetime.now()
+        cleared = now - dt.timedelta(seconds=self.delay)
+        with transaction.atomic():
+            busy = PenaltyQueue.objects.filter(station__isnull=False).values_list(
+                "station_id", flat=True
+            )
+            free = list(
+                online_stations().select_for_update().exclude(pk__in=list(busy))
+            )
+            ready = [s for s in free if s.freed is None or s.freed <= cleared]
+            waiting = PenaltyQueue.objects.filter(
+                round_penalty__round_id=round_id, station__isnull=True
+            ).select_related("round_penalty__offender__team")
+            entries = list(waiting.select_for_update()[: len(ready)])
+            for station, entry in zip(ready, entries):
+                entry.station = station
+                entry.save(update_fields=["station"])
+            # Assigned ones are not waiting anymore
+            left = waiting.exists()
+
+        layer = get_channel_layer()
+        for station, entry in zip(ready, entries):
+            fired = dt.datetime.now()
+            async_to_sync(layer.send)(
+                station.channel_name,
+                penalty_message(entry.round_penalty, station.station),
+            )
+            if intended is not None:
+                record_timing(round_id, "penalty_trigger", intended, fired)
+            _log.info(
+                "Sent penalty of team %s to station %s",
+                entry.round_penalty.offender.team.number,
+                station.station,
+            )
+
+        clearing = [s.freed for s in free if s not in ready]
+        if left and clearing:
+            # Penalties are waiting for a station still clearing
+            due = min(clearing) + dt.timedelta(seconds=self.delay)
+            self.schedule(round_id, max(0, (due - now).total_seconds()))
+
+    def reset(self, station=None):
+        """
+        Clear the display of the station the penalty was assigned to.
+        Without registered stations, of every station.
+        """
+        layer = get_channel_layer()
+        if station is not None:
+            if station.channel_name:
+                async_to_sync(layer.send)(
+                    station.channel_name, {"type": "reset_station"}
+                )
+        elif not online_stations().exists():
+            async_to_sync(layer.group_send)("stopandgo", {"type": "reset_station"})
+
+
+penalty_dispatcher = PenaltyDispatcher()
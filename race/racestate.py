@@ -0,0 +1,415 @@
+# race/racestate.py
+"""
+In-memory picture of a running round.
+
+Race control, the pending drivers pages, the pit lane pages and the
+driver change screen all need the same things: the queue of registered
+drivers ordered by registration, who is waiting in which change lane,
+who is on track and how many driver changes each team completed. Rather
+than rebuilding that from the database on every hit, each round gets a
+RaceStateStore that is loaded once and then follows the Session and
+ChangeLane saves (see race/signals.py). Updates are applied when the
+transaction commits and the database stays the source of truth: any
+change the store cannot follow simply drops it and the next read reloads.
+Every change also bumps the generation of the round in the shared cache,
+so the stores of the other processes, which did not see the signal, are
+loaded again on their next read.
+"""
+
+import logging
+import threading
+from django.db import transaction
+from .generations import bump, generations
+
+_log = logging.getLogger(__name__)
+
+
+class PendingEntry:
+    """A registered driver waiting for a change, as used by the templates."""
+
+    __slots__ = ("id", "register", "driver", "team_completed_count")
+
+    def __init__(self, session_id, register, driver, team_completed_count):
+        self.id = session_id
+        self.register = register
+        self.driver = driver
+        self.team_completed_count = team_completed_count
+
+
+class LaneEntry:
+    """
+    A change lane, with the same attributes the lane templates use. version
+    is the state version at which the lane last changed.
+    """
+
+    __slots__ = ("id", "lane", "open", "driver", "version")
+
+    def __init__(self, lane_id, lane, is_open, driver, version):
+        self.id = lane_id
+        self.lane = lane
+        self.open = is_open
+        self.driver = driver
+        self.version = version
+
+    def as_state(self):
+        """Compact JSON state, enough for a display to render the lane."""
+        state = {
+            "lane": self.lane,
+            "open": self.open,
+            "version": self.version,
+            "driver": None,
+        }
+        driver = self.driver
+        if driver is not None:
+            try:
+                mugshot = driver.member.mugshot.url
+            except ValueError:
+                mugshot = None
+            state["driver"] = {
+                "id": driver.pk,
+                "nickname": driver.member.nickname,
+                "team_number": driver.team.team.number,
+                "team_name": driver.team.team.team.name,
+                "mugshot": mugshot,
+                "weight_penalty": driver.weight_penalty,
+            }
+        return state
+
+
+class RaceSnapshot:
+    """
+    Immutable view of a RaceStateStore at a given version. Views and
+    templates may keep it for the duration of a request.
+    """
+
+    def __init__(self, round_id, version, pending, lanes, ontrack, completed):
+        self.round_id = round_id
+        self.version = version
+        self.pending = pending
+        self.lanes = lanes
+        self.ontrack = ontrack
+        self.completed = completed
+
+    @property
+    def open_lanes(self):
+        return tuple(alane for alane in self.lanes if alane.open)
+
+    def lane(self, number):
+        for alane in self.lanes:
+            if alane.lane == number:
+                return alane
+        return None
+
+    def completed_count(self, team_id):
+        return self.completed.get(team_id, 0)
+
+    def as_dict(self):
+        return {
+            "round": self.round_id,
+            "version": self.version,
+            "pending": [
+                {
+                    "session": entry.id,
+                    "driver": entry.driver.pk,
+                    "team": entry.driver.team_id,
+                    "completed": entry.team_completed_count,
+                }
+                for entry in self.pending
+            ],
+            "lanes": [
+                {
+                    "id": alane.id,
+                    "lane": alane.lane,
+                    "open": alane.open,
+                    "driver": alane.driver.pk if alane.driver else None,
+                    "version": alane.version,
+                }
+                for alane in self.lanes
+            ],
+            "ontrack": {str(k): v.isoformat() for k, v in self.ontrack.items()},
+            "completed": {str(k): v for k, v in self.completed.items()},
+        }
+
+
+class RaceStateStore:
+    """
+    Live state of one round.
+
+    sessions holds the sessions that have not ended (pending or on track),
+    completed the ids of the ended sessions per round_team, lanes the change
+    lanes and drivers the team members of the round, loaded once with the
+    relations the templates need. The snapshot is rebuilt on the first read
+    after a change. The version is the generation of the round in the
+    shared cache, bumped by every change whichever process makes it, so
+    the versions the displays get only ever increase.
+    """
+
+    def __init__(self, round_id, drivers=(), generation=(0, 0)):
+        self.round_id = round_id
+        # Shared generations of the round and of the drivers it was loaded at
+        self.generation = generation
+        self.drivers = {driver.pk: driver for driver in drivers}
+        self.sessions = {}
+        self.completed = {}
+        self.lanes = {}
+        self._snapshot = None
+        self._lock = threading.Lock()
+
+    @property
+    def version(self):
+        return self.generation[0]
+
+    @staticmethod
+    def load_drivers(round_id):
+        from .models import team_member
+
+        return team_member.objects.filter(team__round_id=round_id).select_related(
+            "member", "team__team__team", "team__round"
+        )
+
+    @classmethod
+    def load(cls, round_id, generation=(0, 0)):
+        from .models import Session, ChangeLane
+
+        store = cls(round_id, cls.load_drivers(round_id), generation)
+        for sid, driver_id, register, start, end in Session.objects.filter(
+            round_id=round_id
+        ).values_list("id", "driver_id", "register", "start", "end"):
+            store._set_session(sid, driver_id, register, start, end)
+        for lane_id, lane, is_open, driver_id in ChangeLane.objects.filter(
+            round_id=round_id
+        ).values_list("id", "lane", "open", "driver_id"):
+            store.lanes[lane_id] = (lane, is_open, driver_id, store.version)
+        return store
+
+    def _set_session(self, sid, driver_id, register, start, end):
+        driver = self.drivers.get(driver_id)
+        if driver is None:
+            return False
+        self.sessions.pop(sid, None)
+        for ended in self.completed.values():
+            ended.discard(sid)
+        if end is not None:
+            self.completed.setdefault(driver.team_id, set()).add(sid)
+        else:
+            self.sessions[sid] = (driver_id, register, start)
+        return True
+
+    def _changed(self):
+        self._snapshot = None
+
+    def session_saved(self, sid, driver_id, register, start, end):
+        """Apply a saved Session. False if the store cannot follow it."""
+        with self._lock:
+            if not self._set_session(sid, driver_id, register, start, end):
+                return False
+            self._changed()
+        return True
+
+    def session_deleted(self, sid):
+        with self._lock:
+            self.sessions.pop(sid, None)
+            for ended in self.completed.values():
+                ended.discard(sid)
+            self._changed()
+        return True
+
+    def lane_saved(self, lane_id, lane, is_open, driver_id):
+        if driver_id is not None and driver_id not in self.drivers:
+            return False
+        with self._lock:
+            current = self.lanes.get(lane_id)
+            if current is not None and current[:3] == (lane, is_open, driver_id):
+                # Saved again without change, nothing to re-render
+                return True
+            self._changed()
+            self.lanes[lane_id] = (lane, is_open, driver_id, self.version)
+        return True
+
+    def lane_deleted(self, lane_id):
+        with self._lock:
+            self.lanes.pop(lane_id, None)
+            self._changed()
+        return True
+
+    def snapshot(self):
+        snapshot = self._snapshot
+        if snapshot is not None:
+            return snapshot
+        with self._lock:
+            completed = {
+                team_id: len(ended) for team_id, ended in self.completed.items()
+            }
+            pending = []
+            ontrack = {}
+            for sid, (driver_id, register, start) in self.sessions.items():
+                if start is not None:
+                    ontrack[driver_id] = start
+                    continue
+                driver = self.drivers[driver_id]
+                pending.append(
+                    PendingEntry(
+                        sid, register, driver, completed.get(driver.team_id, 0)
+                    )
+                )
+            pending.sort(key=lambda entry: (entry.register, entry.id))
+            lanes = []
+            for lane_id, (lane, is_open, driver_id, version) in self.lanes.items():
+                driver = self.drivers.get(driver_id)
+                lanes.append(LaneEntry(lane_id, lane, is_open, driver, version))
+            lanes.sort(key=lambda alane: alane.lane)
+            snapshot = RaceSnapshot(
+                self.round_id,
+                self.version,
+                tuple(pending),
+                tuple(lanes),
+                ontrack,
+                completed,
+            )
+            self._snapshot = snapshot
+        return snapshot
+
+    def differences(self, other):
+        """List what differs between this store and another one."""
+        mine, theirs = self.snapshot(), other.snapshot()
+        diffs = []
+        if [e.id for e in mine.pending] != [e.id for e in theirs.pending]:
+            diffs.append(
+                f"pending queue {[e.id for e in mine.pending]} "
+                f"!= {[e.id for e in theirs.pending]}"
+            )
+        if mine.ontrack != theirs.ontrack:
+            diffs.append(f"on track {mine.ontrack} != {theirs.ontrack}")
+        mine_completed = {k: v for k, v in mine.completed.items() if v}
+        theirs_completed = {k: v for k, v in theirs.completed.items() if v}
+        if mine_completed != theirs_completed:
+            diffs.append(f"completed {mine_completed} != {theirs_completed}")
+        mine_lanes = {k: v[:3] for k, v in self.lanes.items()}
+        theirs_lanes = {k: v[:3] for k, v in other.lanes.items()}
+        if mine_lanes != theirs_lanes:
+            diffs.append(f"lanes {mine_lanes} != {theirs_lanes}")
+        return diffs
+
+    def check(self):
+        """Compare with a fresh load from the database."""
+        return self.differences(RaceStateStore.load(self.round_id))
+
+
+_stores = {}
+_lock = threading.Lock()
+
+# Bumped when the drivers of any round change, see race_state_drivers_changed
+DRIVERS_KEY = "race_state_drivers"
+
+
+def _generation_key(round_id):
+    return f"race_state_{round_id}"
+
+
+def get_race_state(round_id):
+    """Return the (cached) RaceStateStore of the given round."""
+    # Changes made by other processes are only seen through the shared
+    # generations, see race/generations.py
+    current = generations(_generation_key(round_id), DRIVERS_KEY)
+    store = _stores.get(round_id)
+    if store is not None and store.generation == current:
+        return store
+
+    # Tagged with the generations read before loading: a change committed
+    # while we were loading makes it stale at once
+    store = RaceStateStore.load(round_id, current)
+    with _lock:
+        _stores[round_id] = store
+    return store
+
+
+def race_snapshot(round_id):
+    return get_race_state(round_id).snapshot()
+
+
+def _invalidate(round_id):
+    with _lock:
+        if round_id is None:
+            _stores.clear()
+        else:
+            _stores.pop(round_id, None)
+    bump(DRIVERS_KEY if round_id is None else _generation_key(round_id))
+
+
+def invalidate_race_state(round_id=None):
+    """Drop the store of a round, or all of them when round_id is None."""
+    _invalidate(round_id)
+    # Other processes may load the old state before the change is committed
+    transaction.on_commit(lambda: _invalidate(round_id))
+
+
+def _apply(round_id, method, *args):
+    generation = bump(_generation_key(round_id))
+    with _lock:
+        store = _stores.get(round_id)
+        if store is None:
+            return
+        # Follow the change only if it is the one change since the store
+        # was loaded or last followed one, otherwise another process
+        # changed the round too: load it again
+        if store.generation[0] != generation - 1:
+            del _stores[round_id]
+            return
+        # The change gets the new generation as its version
+        store.generation = (generation, store.generation[1])
+        if not getattr(store, method)(*args):
+            del _stores[round_id]
+
+
+def session_changed(session, deleted=False):
+    """Follow a saved or deleted Session once the transaction commits."""
+    if deleted:
+        args = ("session_deleted", session.pk)
+    else:
+        args = (
+            "session_saved",
+            session.pk,
+            session.driver_id,
+            session.register,
+            session.start,
+            session.end,
+        )
+    round_id = session.round_id
+    transaction.on_commit(lambda: _apply(round_id, *args))
+
+
+def lane_changed(change_lane, deleted=False):
+    """Follow a saved or deleted ChangeLane once the transaction commits."""
+    if deleted:
+        args = ("lane_deleted", change_lane.pk)
+    else:
+        args = (
+            "lane_saved",
+            change_lane.pk,
+            change_lane.lane,
+            change_lane.open,
+            change_lane.driver_id,
+        )
+    round_id = change_lane.round_id
+    transaction.on_commit(lambda: _apply(round_id, *args))
+
+
+def verify_race_states():
+    """
+    Compare every loaded store with the database and drop the ones that
+    drifted. Run periodically by the scheduler.
+    """
+    from django.db import connection
+
+    try:
+        for round_id, store in list(_stores.items()):
+            version = store.version
+            diffs = store.check()
+            # A change applied during the check is not drift
+            if diffs and store.version == version:
+                _log.warning(
+                    "Race state of round %s drifted: %s", round_id, "; ".join(diffs)
+                )
+                invalidate_race_state(round_id)
+    finally:
+        connection.close()
@@ -0,0 +1,95 @@
+# race/replay.py
+"""
+Replay protection and deduplication of the stop and go station messages.
+
+The station numbers its signed messages: every message carries a unique
+message_id and a counter that increases with each new message. A retry
+(penalty_served is sent again until acknowledged) reuses both. The server
+remembers the handled message ids for a while in a ReplayCache, in the
+shared cache, so a retry costs a lookup and no database work, whichever
+connection and server process it comes in on. A CounterWindow rejects
+messages whose counter is too old to be in the cache anymore. It is kept
+per station in the shared cache too, so reconnecting, or coming in on
+another process, does not start it over: stations start their counter
+from the clock, above that of their previous runs.
+"""
+
+from django.core.cache import cache
+
+# Seconds a message id is remembered
+CACHE_TIMEOUT = 24 * 60 * 60
+# How far behind the highest counter seen a message may be
+WINDOW = 64
+# Seconds the highest counter of a station is remembered, longer than the
+# message ids: it is what rejects the messages they are forgotten for
+COUNTER_TIMEOUT = 30 * 24 * 60 * 60
+
+
+class ReplayCache:
+    def __init__(self, prefix="station_message", timeout=CACHE_TIMEOUT):
+        self.prefix = prefix
+        self.timeout = timeout
+
+    def key(self, message_id):
+        return f"{self.prefix}_{message_id}"
+
+    def check(self, message_id):
+        """
+        Record the message id. True the first time, False if the message
+        was already seen.
+        """
+        return cache.add(self.key(message_id), True, self.timeout)
+
+    def seen(self, message_id):
+        return cache.get(self.key(message_id)) is not None
+
+    def mark(self, message_id):
+        """Record the message id, once it was handled."""
+        cache.set(self.key(message_id), True, self.timeout)
+
+
+class CounterWindow:
+    """
+    Accepts a counter unless it is window or more behind the highest seen.
+    With a station, the highest counter is that of the station in the
+    shared cache, whichever connection saw it; without, of this window only.
+    """
+
+    def __init__(
+        self,
+        station=None,
+        window=WINDOW,
+        prefix="station_counter",
+        timeout=COUNTER_TIMEOUT,
+    ):
+        self.station = station
+        self.window = window
+        self.prefix = prefix
+        self.timeout = timeout
+        self._highest = None
+
+    @property
+    def highest(self):
+        if self.station is None:
+            return self._highest
+        return cache.get(f"{self.prefix}_{self.station}")
+
+    @highest.setter
+    def highest(self, counter):
+        if self.station is None:
+            self._highest = counter
+        else:
+            cache.set(f"{self.prefix}_{self.station}", counter, self.timeout)
+
+    def accept(self, counter):
+        # A station waits for each message to be handled before the next, a
+        # get and set that are not atomic do not lose a higher counter
+        highest = self.highest
+        if highest is not None and counter <= highest - self.window:
+            return False
+        if highest is None or counter > highest:
+            self.highest = counter
+        return True
+
+
+station_messages = ReplayCache()
@@ -0,0 +1,128 @@
+# race/roundevents.py
+"""
+Round websocket events with sequence numbers.
+
+Every message sent to a round group is stamped with a per-round sequence
+number taken from the cache, so a client can tell when it missed one. On
+connect, and whenever it asks for a resync, a client gets a snapshot of
+the whole round (clock, pause state, time spent and status of every
+driver, completed changes per team) stamped with the sequence number it
+is current as of. Events with a lower or equal number are already part
+of it. Numbers are only taken once the change an event carries is
+committed.
+"""
+
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from django.core.cache import cache
+from django.db import transaction
+from .generations import generation_scope
+
+SEQUENCE_TIMEOUT = 7 * 24 * 60 * 60
+
+
+def _sequence_key(round_id):
+    return f"round_seq_{round_id}"
+
+
+def next_sequence(round_id):
+    key = _sequence_key(round_id)
+    cache.add(key, 0, SEQUENCE_TIMEOUT)
+    try:
+        return cache.incr(key)
+    except ValueError:
+        # Expired between add and incr
+        cache.set(key, 1, SEQUENCE_TIMEOUT)
+        return 1
+
+
+def current_sequence(round_id):
+    return cache.get(_sequence_key(round_id), 0)
+
+
+def _send(round_id, message):
+    message["seq"] = next_sequence(round_id)
+    channel_layer = get_channel_layer()
+    async_to_sync(channel_layer.group_send)(f"round_{round_id}", message)
+
+
+def send_round_event(round_id, message):
+    """
+    Once the transaction commits, stamp a message with the next sequence
+    number and send it to the round. Not before: a snapshot read in between
+    would be stamped as including a change it cannot see yet, and a rolled
+    back change must not be sent at all.
+    """
+    transaction.on_commit(lambda: _send(round_id, message))
+
+
+# Driver times all read the pause index, whose generation is read once
+@generation_scope()
+def round_snapshot(round_id):
+    """
+    Full state of a round, with the same round fields as a round update so
+    clients can handle it like one.
+    """
+    from .models import Round, DriverLedger
+    from .racestate import get_race_state
+
+    # Read first: anything sent after this is newer than the snapshot
+    seq = current_sequence(round_id)
+    try:
+        cround = Round.objects.get(pk=round_id)
+    except Round.DoesNotExist:
+        return None
+
+    snapshot = {
+        "type": "round.snapshot",
+        "seq": seq,
+        "session_update": False,
+        "is_paused": cround.is_paused,
+        "remaining_seconds": round(
+            (cround.duration - cround.time_elapsed).total_seconds()
+            if cround.started
+            else cround.duration.total_seconds()
+        ),
+        "started": cround.started is not None,
+        "ready": cround.ready,
+        "ended": cround.ended is not None,
+        "drivers": [],
+        "teams": [],
+    }
+
+    store = get_race_state(round_id)
+    state = store.snapshot()
+    pending = {entry.driver.pk for entry in state.pending}
+    drivers = list(store.drivers.values())
+    ledgers = DriverLedger.for_drivers(drivers)
+    teams = {}
+    for driver in drivers:
+        if driver.pk in state.ontrack:
+            status = "start"
+        elif driver.pk in pending:
+            status = "register"
+        else:
+            status = None
+        ledger = ledgers[driver.pk]
+        snapshot["drivers"].append(
+            {
+                "driver_id": driver.pk,
+                "team_id": driver.team_id,
+                "time_spent": round(ledger.time_spent().total_seconds()),
+                "completed_sessions": ledger.completed_sessions,
+                "driver_status": status,
+            }
+        )
+        teams.setdefault(driver.team_id, driver.team.team.number)
+    for team_id, number in sorted(teams.items(), key=lambda item: item[1]):
+        snapshot["teams"].append(
+            {
+                "team_id": team_id,
+                "number": number,
+                # Same convention as the session updates
+                "completed_sessions": state.completed_count(team_id)
+                if cround.started
+                else -1,
+            }
+        )
+    return snapshot
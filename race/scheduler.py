@@ -1,34 +1,36 @@
 # race/scheduler.py
+import threading
+import time
 from apscheduler.schedulers.background import BackgroundScheduler
+from apscheduler.jobstores.base import JobLookupError
 from django_apscheduler.jobstores import DjangoJobStore
 from django.db import connection
 from django_apscheduler.models import DjangoJobExecution
 
+# Every server process competes for it, only the holder runs the race automation
+AUTOMATION_LEASE = "race-automation"
+
+_automation = None
+_election = None
+_started = False
+_started_lock = threading.Lock()
+
 
 def delete_old_job_executions():
     """Deletes job execution logs older than 24 hours"""
     DjangoJobExecution.objects.delete_old_job_executions(24 * 60 * 60)
 
 
-def racing_start():
+def automation_start():
+    """Start the jobs that must run in one process only, once elected."""
+    global _automation
+
     # Close any existing connections first
     connection.close()
 
     # Create scheduler
     scheduler = BackgroundScheduler()
 
-    # Import the standalone function
-    from race.tasks import run_race_events
-
-    # Add job using the function reference (must be at module level)
-    scheduler.add_job(
-        run_race_events,
-        "interval",
-        minutes=1,
-        id="race-event-task",
-        replace_existing=True,
-    )
-
     # Run cleanup every hour
     scheduler.add_job(
         delete_old_job_executions,
@@ -42,3 +44,108 @@ def racing_start():
 
     # Start the scheduler
     scheduler.start()
+
+    # Race events used to be polled every minute, they now have their own
+    # scheduler, and the race states are checked by each process. Drop the
+    # jobs a previous version stored.
+    for job_id in ("race-event-task", "verify_race_states"):
+        try:
+            scheduler.remove_job(job_id)
+        except JobLookupError:
+            pass
+    _automation = scheduler
+
+    from race.deadlines import deadline_scheduler
+
+    deadline_scheduler.start()
+
+
+def automation_stop():
+    """Leadership lost: another process runs the automation now."""
+    global _automation
+
+    from race.deadlines import deadline_scheduler
+
+    deadline_scheduler.stop()
+    if _automation is not None:
+        _automation.shutdown(wait=False)
+        _automation = None
+
+
+def automation_heartbeat():
+    # Rounds and pauses may be changed by other processes, whose signals
+    # the deadline scheduler of this one does not see
+    from race.deadlines import deadline_scheduler
+    from race.penaltydispatch import expire_stations
+
+    deadline_scheduler.rearm()
+    # Stations left online by a process that died, e.g. after a restart
+    expire_stations()
+
+
+def racing_start():
+    global _election
+
+    # Close any existing connections first
+    connection.close()
+
+    # Jobs about the caches of this process, they run in every process
+    scheduler = BackgroundScheduler()
+
+    # Import the standalone function
+    from race.racestate import verify_race_states
+    from race.penaltydispatch import refresh_stations, STATION_REFRESH
+
+    # Drop live race states that no longer match the database
+    scheduler.add_job(
+        verify_race_states,
+        trigger="interval",
+        minutes=5,
+        id="verify_race_states",
+        replace_existing=True,
+    )
+    # The stations connected to this process are still online
+    scheduler.add_job(
+        refresh_stations,
+        trigger="interval",
+        seconds=STATION_REFRESH,
+        id="refresh_stations",
+        replace_existing=True,
+    )
+    scheduler.start()
+
+    from race.leader import LeaderElection
+
+    _election = LeaderElection(
+        AUTOMATION_LEASE,
+        on_elected=automation_start,
+        on_lost=automation_stop,
+        on_heartbeat=automation_heartbeat,
+    )
+    _election.start()
+
+
+def racing_start_later(delay=5):
+    """
+    Start the jobs and the leader election of this server process, in a
+    thread, once Django has had delay seconds to fully initialise.
+
+    Called by the server entry points, core/asgi.py and core/wsgi.py, which
+    the server and runserver load, not by the app config: management
+    commands, shells and tests do not run the jobs nor compete for the
+    leadership. Only the first call starts them.
+    """
+    global _started
+
+    with _started_lock:
+        if _started:
+            return
+        _started = True
+
+    def delayed_start():
+        time.sleep(delay)
+        racing_start()
+
+    t = threading.Thread(target=delayed_start, name="racing-start")
+    t.daemon = True
+    t.start()
@@ -7,11 +7,22 @@ from .models import (
     round_pause,
     team_member,
     round_team,
+    championship_team,
+    Person,
+    Team,
     Round,
     Session,
+    DriverLedger,
     PenaltyQueue,
+    StopAndGoStation,
 )
-from django.template.loader import render_to_string
+from .pauseindex import invalidate_pause_index
+from .currentround import invalidate_current_round, current_round
+from .racestate import invalidate_race_state, session_changed, lane_changed
+from .broadcast import lane_broadcaster
+from .roundevents import send_round_event
+from .deadlines import deadline_scheduler
+from .penaltydispatch import station_states
 from django.db.models import Count
 
 # Custom signal for race end requests
@@ -67,44 +78,25 @@ def round_team_changed(sender, instance, **kwargs):
     update_empty_teams(instance.round_id)
 
 
+# Who drives for which team, and their names, are part of the race state
+@receiver([post_save, post_delete], sender=team_member)
+@receiver([post_save, post_delete], sender=round_team)
+@receiver([post_save, post_delete], sender=championship_team)
+@receiver([post_save, post_delete], sender=Person)
+@receiver([post_save, post_delete], sender=Team)
+def race_state_drivers_changed(sender, instance, **kwargs):
+    invalidate_race_state()
+
+
+@receiver([post_save, post_delete], sender=ChangeLane)
+def change_lane_race_state(sender, instance, signal, **kwargs):
+    lane_changed(instance, deleted=signal is post_delete)
+
+
 @receiver(post_save, sender=ChangeLane)
 def change_lane_updated(sender, instance, created, **kwargs):
     if not created:  # Only send updates if the instance was modified
-        channel_layer = get_channel_layer()
-        lane_html = render_to_string(
-            "layout/changelane_detail.html", {"change_lane": instance}
-        )
-        async_to_sync(channel_layer.group_send)(
-            f"lane_{instance.lane}",
-            {
-                "type": "lane.update",
-                "lane_html": lane_html,
-            },
-        )
-
-        lane_html = render_to_string(
-            "layout/changelane_small_detail.html", {"change_lane": instance}
-        )
-        async_to_sync(channel_layer.group_send)(
-            f"lane_{instance.lane}",
-            {
-                "type": "rclane.update",
-                "lane_html": lane_html,
-            },
-        )
-
-        change_lanes = ChangeLane.objects.filter(open=True).order_by("lane")
-        driverc_html = render_to_string(
-            "layout/changedriver_detail.html", {"change_lanes": change_lanes}
-        )
-
-        async_to_sync(channel_layer.group_send)(
-            "changedriver",
-            {
-                "type": "changedriver.update",
-                "driverc_html": driverc_html,
-            },
-        )
+        lane_broadcaster.lane_changed(instance)
 
 
 @receiver(post_delete, sender=ChangeLane)
@@ -113,6 +105,18 @@ def change_lane_deleted(sender, instance, **kwargs):
     pass
 
 
+# Must be connected before handle_pause_change so it sees the new pauses
+@receiver([post_save, post_delete], sender=round_pause)
+def round_pause_changed(sender, instance, signal, **kwargs):
+    invalidate_pause_index(instance.round_id)
+    # Stints that ended since this pause began may have a different length now
+    DriverLedger.rebuild_round(
+        instance.round_id, since=instance.start, create=signal is post_save
+    )
+    # Pauses move the race deadlines
+    deadline_scheduler.rearm_on_commit(instance.round_id)
+
+
 @receiver(post_save, sender=round_pause)
 def handle_pause_change(sender, instance, **kwargs):
     cround = instance.round
@@ -122,9 +126,8 @@ def handle_pause_change(sender, instance, **kwargs):
     ended = cround.ended != None
     remaining = round((cround.duration - cround.time_elapsed).total_seconds())
 
-    channel_layer = get_channel_layer()
-    async_to_sync(channel_layer.group_send)(
-        f"round_{cround.id}",
+    send_round_event(
+        cround.id,
         {
             "type": "pause_update",
             "is paused": is_paused,
@@ -136,6 +139,13 @@ def handle_pause_change(sender, instance, **kwargs):
     )
 
 
+@receiver([post_save, post_delete], sender=Round)
+def round_changed(sender, instance, **kwargs):
+    invalidate_current_round()
+    invalidate_race_state(instance.pk)
+    deadline_scheduler.rearm_on_commit(instance.pk)
+
+
 @receiver(post_save, sender=Round)
 def handle_round_change(sender, instance, **kwargs):
     """Handle round state changes (started, ended) for timer updates"""
@@ -149,9 +159,8 @@ def handle_round_change(sender, instance, **kwargs):
         else instance.duration.total_seconds()
     )
 
-    channel_layer = get_channel_layer()
-    async_to_sync(channel_layer.group_send)(
-        f"round_{instance.id}",
+    send_round_event(
+        instance.id,
         {
             "type": "round_update",
             "is paused": is_paused,
@@ -163,6 +172,40 @@ def handle_round_change(sender, instance, **kwargs):
     )
 
 
+# Must be connected before handle_session_change so it reads an up to date ledger
+@receiver(post_save, sender=Session)
+def session_ledger_update(sender, instance, **kwargs):
+    DriverLedger.session_saved(instance)
+
+
+@receiver(post_delete, sender=Session)
+def session_ledger_delete(sender, instance, **kwargs):
+    if instance.start:
+        DriverLedger.rebuild(instance.driver_id, create=False)
+
+
+@receiver([post_save, post_delete], sender=Session)
+def session_race_state(sender, instance, signal, **kwargs):
+    session_changed(instance, deleted=signal is post_delete)
+
+
+def driver_totals(driver, deleted=None):
+    """
+    Time spent, in seconds, and completed sessions of a driver for the
+    session updates, without the session being deleted if any.
+    """
+    ledger = DriverLedger.for_driver(driver)
+    time_spent = ledger.time_spent()
+    completed = ledger.completed_sessions
+    if deleted is not None and deleted.start:
+        if deleted.end:
+            time_spent -= deleted.duration
+            completed -= 1
+        else:
+            time_spent -= ledger.current_stint()
+    return round(time_spent.total_seconds()), completed
+
+
 @receiver(post_save, sender=Session)
 def handle_session_change(sender, instance, **kwargs):
     """Handle session changes for driver timer updates"""
@@ -186,18 +229,19 @@ def handle_session_change(sender, instance, **kwargs):
         ).count()
     else:
         completed_sessions_count = -1
+    time_spent, driver_sessions = driver_totals(driver)
 
-    channel_layer = get_channel_layer()
     # First update the round timer
-    async_to_sync(channel_layer.group_send)(
-        f"round_{round_instance.id}",
+    send_round_event(
+        round_instance.id,
         {
             "type": "session_update",
             "is paused": round_instance.is_paused,
-            "time spent": round(driver.time_spent.total_seconds()),
+            "time spent": time_spent,
             "driver id": driver.id,
             "driver status": dstatus,
             "completed sessions": completed_sessions_count,
+            "driver sessions": driver_sessions,
         },
     )
 
@@ -225,6 +269,7 @@ def send_penalty_queue_update(round_id):
             "serving_team": serving_team,
             "queue_count": queue_count,
             "round_id": round_id,
+            "stations": station_states(),
         },
     )
 
@@ -236,6 +281,14 @@ def penalty_queue_changed(sender, instance, **kwargs):
     send_penalty_queue_update(round_id)
 
 
+@receiver([post_save, post_delete], sender=StopAndGoStation)
+def station_changed(sender, instance, **kwargs):
+    """A station registered or went offline, race control shows them"""
+    cround = current_round()
+    if cround:
+        send_penalty_queue_update(cround.id)
+
+
 @receiver(pre_delete, sender=Session)
 def handle_session_delete(sender, instance, **kwargs):
     round_instance = instance.round
@@ -244,23 +297,26 @@ def handle_session_delete(sender, instance, **kwargs):
     # Count completed sessions for this team
     if round_instance.started:
         try:
-            completed_sessions_count = Session.objects.filter(
-                driver__team=driver.team, end__isnull=False
-            ).count()
+            completed_sessions_count = (
+                Session.objects.filter(driver__team=driver.team, end__isnull=False)
+                .exclude(pk=instance.pk)
+                .count()
+            )
         except:
             return
     else:
         completed_sessions_count = -1
-    channel_layer = get_channel_layer()
+    time_spent, driver_sessions = driver_totals(driver, deleted=instance)
     # First update the round timer
-    async_to_sync(channel_layer.group_send)(
-        f"round_{round_instance.id}",
+    send_round_event(
+        round_instance.id,
         {
             "type": "session_update",
             "is paused": round_instance.is_paused,
-            "time spent": round(driver.time_spent.total_seconds()),
+            "time spent": time_spent,
             "driver id": driver.id,
             "driver status": dstatus,
             "completed sessions": completed_sessions_count,
+            "driver sessions": driver_sessions,
         },
     )
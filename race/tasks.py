@@ -1,100 +1,39 @@
 # race/tasks.py
+"""
+What happens when a race deadline is reached. Run at the right time by
+the deadline scheduler (see race/deadlines.py).
+"""
 
 import asyncio as aio
-import datetime as dt
-from django.db.models import Q
-from asgiref.sync import sync_to_async
 from .signals import race_end_requested
 
 
-class RaceTasks:
+def open_pit_lanes(round_id):
+    from .models import ChangeLane
 
-    _lock = aio.Semaphore(1)
+    for alane in ChangeLane.objects.filter(round_id=round_id, open=False):
+        alane.open = True
+        alane.save()
 
-    @classmethod
-    async def race_events(cls):
-        # Try to acquire the semaphore
-        if not cls._lock.locked():
-            async with cls._lock:
-                from .models import Round, ChangeLane
 
-                end_date = dt.date.today()
-                start_date = end_date - dt.timedelta(days=1)
-                cround = await Round.objects.filter(
-                    Q(start__date__range=[start_date, end_date]) & Q(ended__isnull=True)
-                ).afirst()
-                if not cround:
-                    return
-                if not cround.ready:
-                    # nothing to do
-                    return
+def close_pit_lanes(round_id):
+    from .models import ChangeLane
 
-                if not cround.started:
-                    # Nothing to do
-                    return
+    # Lanes with a driver waiting stay open for the change
+    for alane in ChangeLane.objects.filter(
+        round_id=round_id, open=True, driver__isnull=True
+    ):
+        alane.open = False
+        alane.save()
 
-                if cround.ended:
-                    # Nothing to do
-                    return
 
-                elapsed = await cround.async_time_elapsed()
-                if elapsed < cround.pitlane_open_after:
-                    # Do we wait for it?
-                    if (cround.pitlane_open_after) - elapsed <= dt.timedelta(
-                        seconds=65
-                    ):
-                        dowait = (cround.pitlane_open_after - elapsed).total_seconds()
-                        while int(dowait) > 0:
-                            await aio.sleep(dowait)
-                            elapsed = await cround.async_time_elapsed()
-                            dowait = (
-                                cround.pitlane_open_after - elapsed
-                            ).total_seconds()
-                        change_lanes = await sync_to_async(list)(
-                            ChangeLane.objects.filter(round=cround, open=False)
-                        )
-                        for alane in change_lanes:
-                            alane.open = True
-                            await alane.asave()
-                elif cround.duration - elapsed < dt.timedelta(seconds=65):
-                    # Check for end before check for close pit lane. Would not be reached otherwise
-                    dowait = (cround.duration - elapsed).total_seconds()
-                    print(f"\n\n\nClosing in {dowait} seconds!\n\n\n")
-                    while int(dowait) > 0:
-                        await aio.sleep(dowait)
-                        elapsed = await cround.async_time_elapsed()
-                        dowait = (cround.duration - elapsed).total_seconds()
-                        if not cround.ended:
-                            await race_end_requested.asend(
-                                sender=cls, round_id=cround.id
-                            )
-                elif (
-                    cround.duration - elapsed - cround.pitlane_close_before
-                    < dt.timedelta(seconds=65)
-                ):
-                    dowait = (
-                        cround.duration - elapsed - cround.pitlane_close_before
-                    ).total_seconds()
-                    while int(dowait) > 0:
-                        await aio.sleep(dowait)
-                        elapsed = await cround.async_time_elapsed()
-                        dowait = (
-                            cround.duration - elapsed - cround.pitlane_close_before
-                        ).total_seconds()
-                    change_lanes = await sync_to_async(list)(
-                        ChangeLane.objects.filter(
-                            round=cround, open=True, driver__isnull=True
-                        )
-                    )
-                    for alane in change_lanes:
-                        alane.open = False
-                        await alane.asave()
-
-        else:
-            # bail out
-            return
-
-
-def run_race_events():
-    """Wrapper function to run the async race_events task."""
-    aio.run(RaceTasks.race_events())
+async def request_race_end(round_id, sender=None):
+    if hasattr(race_end_requested, "asend"):
+        await race_end_requested.asend(sender=sender, round_id=round_id)
+        return
+    # Before Django 5 send() hands back the coroutines of the async receivers
+    for _receiver, response in race_end_requested.send(
+        sender=sender, round_id=round_id
+    ):
+        if aio.iscoroutine(response):
+            await response
@@ -3,6 +3,905 @@
 Copyright (c) 2019 - present AppSeed.us
 """
 
-from django.test import TestCase
+import asyncio
+import copy
+import datetime as dt
+import hashlib
+import hmac
+import random
+import threading
+import time
+from collections import Counter
+from unittest import mock
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from django.core.cache import cache
+from django.core.exceptions import ValidationError
+from django.db import connection, OperationalError
+from django.db.models import Count
+from django.test import (
+    SimpleTestCase,
+    TestCase,
+    TransactionTestCase,
+    override_settings,
+)
+from race.benchdb import LOCAL_SETTINGS, bench_championship, bench_teams
+from race.deadlines import PIT_CLOSE, PIT_OPEN, RACE_END, DeadlineScheduler
+from race.frames import (
+    FRAME_VERSION,
+    HEADER,
+    MESSAGE_TYPES,
+    SIGNATURE_SIZE,
+    decode_frame,
+    encode_frame,
+)
+from race.models import (
+    ChampionshipPenalty,
+    ChangeLane,
+    DriverLedger,
+    Penalty,
+    PenaltyQueue,
+    Person,
+    RaceEventTiming,
+    Round,
+    RoundPenalty,
+    Session,
+    StopAndGoStation,
+    team_member,
+)
+from race.penaltydispatch import (
+    DELAY,
+    STATION_TIMEOUT,
+    PenaltyDispatcher,
+    expire_stations,
+    manual_penalty_target,
+    station_targets,
+    unregister_station,
+)
+from race.lateness import LatenessHistogram, lateness_metrics
+from race.generations import generation_scope
+from race.middleware import GenerationScopeMiddleware
+from race.pauseindex import get_pause_index, invalidate_pause_index
+from race.racestate import get_race_state, invalidate_race_state
+from race.replay import WINDOW, CounterWindow
 
-# Create your tests here.
+
+def started_round(name, ago=dt.timedelta(hours=1), duration=dt.timedelta(hours=2)):
+    """A ready round, started some time ago"""
+    now = dt.datetime.now()
+    cround = Round.objects.create(
+        name=name,
+        championship=bench_championship(name),
+        start=now - ago - dt.timedelta(minutes=5),
+        duration=duration,
+        ready=True,
+    )
+    # Not through save, whose signals re-arm the race deadlines
+    Round.objects.filter(pk=cround.pk).update(started=now - ago)
+    cround.refresh_from_db()
+    return cround
+
+
+def add_driver(team, n):
+    person = Person.objects.create(
+        surname=f"Driver {n}",
+        firstname="Test",
+        nickname=f"D{n}",
+        gender="M",
+        birthdate=dt.date(2000, 1, 1),
+        country="FR",
+        mugshot="driver.png",
+    )
+    return team_member.objects.create(team=team, member=person, weight=70)
+
+
+@override_settings(**LOCAL_SETTINGS)
+class ConcurrentChangesTest(TransactionTestCase):
+    """
+    Parallel driver registrations and driver changes, like several QR
+    scanners at once, must leave the round consistent.
+    """
+
+    TEAMS = 6
+    DRIVERS = 3
+    THREADS = 8
+    SCANS = 30
+    REGISTER_RATIO = 0.6
+
+    def setUp(self):
+        # Started an hour ago, the pit lane is open
+        self.cround = started_round("Stress")
+        self.drivers = []
+        for team in bench_teams(self.cround, self.TEAMS):
+            for n in range(self.DRIVERS):
+                driver = add_driver(team, len(self.drivers) + 1)
+                self.drivers.append(driver)
+                if n == 0:
+                    Session.objects.create(
+                        round=self.cround,
+                        driver=driver,
+                        register=self.cround.started,
+                        start=self.cround.started,
+                    )
+        for lane in range(self.cround.change_lanes):
+            ChangeLane.objects.create(round=self.cround, lane=lane + 1)
+        invalidate_race_state(self.cround.id)
+
+    def scanner(self, n, barrier, counts, errors, lock):
+        rng = random.Random(n)
+        myround = copy.copy(self.cround)
+        try:
+            barrier.wait()
+            for _ in range(self.SCANS):
+                driver = rng.choice(self.drivers)
+                register = rng.random() < self.REGISTER_RATIO
+                try:
+                    if register:
+                        result = myround.driver_register(driver)
+                    else:
+                        result = myround.driver_endsession(driver)
+                    outcome = result["status"]
+                except ValidationError:
+                    outcome = "refused"
+                except OperationalError:
+                    # SQLite gives up on busy writers instead of queueing them
+                    outcome = "busy"
+                except Exception as e:
+                    outcome = "failed"
+                    with lock:
+                        errors.append(f"{driver}: {e!r}")
+                with lock:
+                    counts[("register" if register else "change", outcome)] += 1
+        finally:
+            # Each scanner has its own connection, do not leak it
+            connection.close()
+
+    def violations(self):
+        cround = self.cround
+        violations = []
+        open_sessions = Session.objects.filter(round=cround, end__isnull=True)
+
+        for row in (
+            open_sessions.values("driver_id").annotate(n=Count("id")).filter(n__gt=1)
+        ):
+            violations.append(f"Driver {row['driver_id']} has {row['n']} open sessions")
+        for row in (
+            open_sessions.filter(start__isnull=False)
+            .values("driver__team_id")
+            .annotate(n=Count("id"))
+            .filter(n__gt=1)
+        ):
+            violations.append(
+                f"Team {row['driver__team_id']} has {row['n']} drivers on track"
+            )
+
+        waiting = set(
+            open_sessions.filter(start__isnull=True).values_list("driver_id", flat=True)
+        )
+        seen = set()
+        for alane in ChangeLane.objects.filter(round=cround, driver__isnull=False):
+            if alane.driver_id in seen:
+                violations.append(f"Driver {alane.driver_id} is in several lanes")
+            seen.add(alane.driver_id)
+            if alane.driver_id not in waiting:
+                violations.append(
+                    f"Lane {alane.lane} holds driver {alane.driver_id} who is not waiting"
+                )
+
+        for diff in get_race_state(cround.id).check():
+            violations.append(f"Race state: {diff}")
+        return violations
+
+    def test_parallel_scans(self):
+        # Load it now so that it follows the updates of the scanners
+        get_race_state(self.cround.id)
+        counts = Counter()
+        errors = []
+        lock = threading.Lock()
+        barrier = threading.Barrier(self.THREADS)
+        threads = [
+            threading.Thread(
+                target=self.scanner, args=(n, barrier, counts, errors, lock)
+            )
+            for n in range(self.THREADS)
+        ]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+        self.assertEqual(sum(counts.values()), self.THREADS * self.SCANS)
+        self.assertTrue(any(outcome == "ok" for _, outcome in counts), dict(counts))
+        self.assertEqual(errors, [])
+        self.assertEqual(self.violations(), [])
+
+
+@override_settings(**LOCAL_SETTINGS)
+class PenaltyDispatchTest(TransactionTestCase):
+    """Stop and go penalties shared between the registered stations."""
+
+    def setUp(self):
+        now = dt.datetime.now()
+        self.cround = Round.objects.create(
+            name="Dispatch",
+            championship=bench_championship("Dispatch"),
+            start=now,
+            duration=dt.timedelta(hours=1),
+            ready=True,
+        )
+        self.teams = bench_teams(self.cround, 4)
+        self.penalty = ChampionshipPenalty.objects.create(
+            championship=self.cround.championship,
+            penalty=Penalty.objects.create(name="Stop & Go", description="Stop"),
+            sanction="S",
+        )
+        self.layer = get_channel_layer()
+        self.dispatcher = PenaltyDispatcher()
+
+    def tearDown(self):
+        with self.dispatcher._lock:
+            for timer, _ in self.dispatcher._timers.values():
+                timer.cancel()
+
+    def station(self, name, freed=None, last_seen=None):
+        return StopAndGoStation.objects.create(
+            station=name,
+            channel_name=async_to_sync(self.layer.new_channel)(),
+            online=True,
+            last_seen=last_seen or dt.datetime.now(),
+            freed=freed,
+        )
+
+    def queue(self, team, age, station=None):
+        """Queue a penalty for the nth team, imposed age seconds ago"""
+        imposed = dt.datetime.now() - dt.timedelta(seconds=age)
+        round_penalty = RoundPenalty.objects.create(
+            round=self.cround,
+            offender=self.teams[team],
+            penalty=self.penalty,
+            value=20,
+            imposed=imposed,
+        )
+        return PenaltyQueue.objects.create(
+            round_penalty=round_penalty, timestamp=imposed, station=station
+        )
+
+    def received(self, record):
+        """The messages sent to a station so far"""
+        messages = []
+
+        async def drain():
+            while True:
+                try:
+                    message = await asyncio.wait_for(
+                        self.layer.receive(record.channel_name), 0.1
+                    )
+                except asyncio.TimeoutError:
+                    return
+                messages.append(message)
+
+        async_to_sync(drain)()
+        return messages
+
+    def assigned(self, entry):
+        return PenaltyQueue.objects.get(pk=entry.pk).station_id
+
+    def test_two_stations_take_the_oldest_penalties(self):
+        first, second = self.station("one"), self.station("two")
+        newest = self.queue(2, 10)
+        oldest = self.queue(0, 30)
+        older = self.queue(1, 20)
+
+        self.dispatcher._assign(self.cround.id, None)
+
+        self.assertEqual(
+            {self.assigned(oldest), self.assigned(older)}, {first.pk, second.pk}
+        )
+        self.assertIsNone(self.assigned(newest))
+        for record in (first, second):
+            (message,) = self.received(record)
+            self.assertEqual(message["type"], "penalty_required")
+            self.assertEqual(message["station"], record.station)
+            entry = PenaltyQueue.objects.get(station=record)
+            self.assertEqual(message["penalty_id"], entry.round_penalty_id)
+        self.assertFalse(self.dispatcher.pending(self.cround.id))
+
+    def test_clearing_station_is_skipped_and_the_round_rearmed(self):
+        freed = dt.datetime.now() - dt.timedelta(seconds=DELAY / 2)
+        clearing, free = self.station("one", freed=freed), self.station("two")
+        oldest = self.queue(0, 20)
+        waiting = self.queue(1, 10)
+
+        self.dispatcher._assign(self.cround.id, None)
+
+        self.assertEqual(self.assigned(oldest), free.pk)
+        self.assertIsNone(self.assigned(waiting))
+        self.assertEqual(self.received(clearing), [])
+        # Tried again once the station has cleared
+        self.assertTrue(self.dispatcher.pending(self.cround.id))
+        due = self.dispatcher._timers[self.cround.id][1]
+        expected = freed + dt.timedelta(seconds=DELAY)
+        self.assertLess(abs((due - expected).total_seconds()), 1)
+
+    @mock.patch("race.penaltydispatch.penalty_dispatcher")
+    def test_timed_out_station_penalty_goes_back_to_the_queue(self, dispatcher):
+        stale = dt.datetime.now() - dt.timedelta(seconds=STATION_TIMEOUT + 5)
+        gone = self.station("gone", last_seen=stale)
+        alive = self.station("alive")
+        entry = self.queue(0, 10, station=gone)
+        served = self.queue(1, 5, station=alive)
+
+        expire_stations()
+
+        gone.refresh_from_db()
+        self.assertFalse(gone.online)
+        self.assertIsNone(self.assigned(entry))
+        self.assertEqual(self.assigned(served), alive.pk)
+        dispatcher.schedule.assert_called_with(self.cround.id, 0)
+
+    @mock.patch("race.penaltydispatch.penalty_dispatcher")
+    def test_unregistered_station_releases_its_penalty(self, dispatcher):
+        record = self.station("one")
+        entry = self.queue(0, 10, station=record)
+
+        unregister_station(record.station, record.channel_name)
+
+        record.refresh_from_db()
+        self.assertFalse(record.online)
+        self.assertIsNone(record.channel_name)
+        self.assertIsNone(self.assigned(entry))
+        dispatcher.schedule.assert_called_with(self.cround.id, 0)
+
+    def test_race_control_commands_go_to_their_station(self):
+        self.assertIsNone(station_targets())
+        serving, free = self.station("one"), self.station("two")
+        self.queue(2, 10, station=serving)
+
+        team = self.teams[2].team.number
+        self.assertEqual(
+            station_targets(team=team, every=False),
+            [(serving.station, serving.channel_name)],
+        )
+        self.assertEqual(station_targets(every=False), [])
+        self.assertEqual(len(station_targets()), 2)
+        self.assertEqual(station_targets("two"), [(free.station, free.channel_name)])
+
+    def test_manual_penalty_takes_a_free_station(self):
+        self.assertIsNone(manual_penalty_target(20))
+        serving, free = self.station("one"), self.station("two")
+        self.queue(0, 20, station=serving)
+        waiting = self.queue(1, 10)
+
+        self.assertEqual(manual_penalty_target(20), [(free.station, free.channel_name)])
+        # No other free station
+        self.assertEqual(manual_penalty_target(20), [])
+        # Busy with it, the queue does not use it
+        self.dispatcher._assign(self.cround.id, None)
+        self.assertIsNone(self.assigned(waiting))
+
+
+@override_settings(**LOCAL_SETTINGS)
+class DriverLedgerTest(TestCase):
+    """The running totals of the drivers follow their sessions."""
+
+    def setUp(self):
+        self.cround = started_round("Ledger")
+        (team,) = bench_teams(self.cround, 1)
+        self.driver = add_driver(team, 1)
+        self.other = add_driver(team, 2)
+        self.started = self.cround.started
+
+    def at(self, minutes):
+        return self.started + dt.timedelta(minutes=minutes)
+
+    def assertLedger(self, driver):
+        """The stored ledger is what the sessions add up to"""
+        stored = DriverLedger.objects.get(driver=driver)
+        for name, value in DriverLedger.totals(driver.pk).items():
+            self.assertEqual(getattr(stored, name), value, name)
+
+    def test_session_changes(self):
+        session = Session.objects.create(
+            round=self.cround, driver=self.driver, register=self.at(0)
+        )
+        # Registered only, nothing driven yet
+        self.assertFalse(DriverLedger.objects.filter(driver=self.driver).exists())
+
+        session.start = self.at(1)
+        session.save()
+        self.assertLedger(self.driver)
+        self.assertEqual(
+            DriverLedger.objects.get(driver=self.driver).stint_start, self.at(1)
+        )
+
+        session.end = self.at(21)
+        session.save()
+        self.assertLedger(self.driver)
+        ledger = DriverLedger.objects.get(driver=self.driver)
+        self.assertEqual(ledger.driven, dt.timedelta(minutes=20))
+        self.assertEqual(ledger.completed_sessions, 1)
+        self.assertIsNone(ledger.stint_start)
+
+        second = Session.objects.create(
+            round=self.cround, driver=self.driver, register=self.at(30)
+        )
+        second.start = self.at(31)
+        second.save()
+        self.assertLedger(self.driver)
+        # Reset, as a false start does
+        second.start = None
+        second.save()
+        self.assertLedger(self.driver)
+        second.start = self.at(32)
+        second.save()
+        second.end = self.at(62)
+        second.save()
+        self.assertLedger(self.driver)
+        ledger = DriverLedger.objects.get(driver=self.driver)
+        self.assertEqual(ledger.driven, dt.timedelta(minutes=50))
+        self.assertEqual(ledger.completed_sessions, 2)
+        self.assertEqual(ledger.longest_stint, dt.timedelta(minutes=30))
+
+        # Changing the past is a rebuild
+        session.end = self.at(11)
+        session.save()
+        self.assertLedger(self.driver)
+
+        second.delete()
+        self.assertLedger(self.driver)
+        ledger = DriverLedger.objects.get(driver=self.driver)
+        self.assertEqual(ledger.driven, dt.timedelta(minutes=10))
+        self.assertEqual(ledger.longest_stint, dt.timedelta(minutes=10))
+
+    def test_missing_ledger_is_rebuilt(self):
+        session = Session.objects.create(
+            round=self.cround, driver=self.driver, register=self.at(0), start=self.at(0)
+        )
+        session.end = self.at(15)
+        session.save()
+        DriverLedger.objects.filter(driver=self.driver).delete()
+
+        second = Session.objects.create(
+            round=self.cround,
+            driver=self.driver,
+            register=self.at(20),
+            start=self.at(20),
+        )
+        self.assertLedger(self.driver)
+        second.end = self.at(30)
+        second.save()
+        self.assertLedger(self.driver)
+        self.assertEqual(
+            DriverLedger.objects.get(driver=self.driver).completed_sessions, 2
+        )
+
+    def test_reads_do_not_save(self):
+        # Without the signals, as sessions saved before the ledgers existed
+        Session.objects.bulk_create(
+            [
+                Session(
+                    round=self.cround,
+                    driver=self.driver,
+                    register=self.at(0),
+                    start=self.at(0),
+                    end=self.at(25),
+                ),
+                Session(
+                    round=self.cround,
+                    driver=self.other,
+                    register=self.at(25),
+                    start=self.at(25),
+                ),
+            ]
+        )
+
+        ledger = DriverLedger.for_driver(self.driver)
+        self.assertEqual(ledger.driven, dt.timedelta(minutes=25))
+        self.assertEqual(ledger.completed_sessions, 1)
+        ledgers = DriverLedger.for_drivers([self.driver, self.other])
+        self.assertEqual(
+            ledgers[self.driver.pk].longest_stint, dt.timedelta(minutes=25)
+        )
+        self.assertEqual(ledgers[self.other.pk].stint_start, self.at(25))
+        self.assertEqual(ledgers[self.other.pk].driven, dt.timedelta(0))
+        self.assertFalse(DriverLedger.objects.exists())
+
+    def test_session_updates(self):
+        """Session updates carry the counts round pages show, no resync needed"""
+        with mock.patch("race.signals.send_round_event") as send:
+            session = Session.objects.create(
+                round=self.cround,
+                driver=self.driver,
+                register=self.at(0),
+                start=self.at(0),
+            )
+            session.end = self.at(20)
+            session.save()
+            ended = send.call_args.args[1]
+            session.delete()
+            deleted = send.call_args.args[1]
+
+        self.assertEqual(ended["driver status"], "end")
+        self.assertEqual(ended["time spent"], 20 * 60)
+        self.assertEqual(ended["completed sessions"], 1)
+        self.assertEqual(ended["driver sessions"], 1)
+        self.assertEqual(deleted["driver status"], "reset")
+        self.assertEqual(deleted["time spent"], 0)
+        self.assertEqual(deleted["completed sessions"], 0)
+        self.assertEqual(deleted["driver sessions"], 0)
+
+
+@override_settings(**LOCAL_SETTINGS)
+class PostRaceCheckTest(TestCase):
+    """Penalties for the driving time limits and the required changes."""
+
+    def setUp(self):
+        self.cround = started_round("Post race")
+        self.started = self.cround.started
+        self.teams = bench_teams(self.cround, 3)
+        self.drivers = {}
+        for team in self.teams:
+            for letter in "ABC":
+                name = f"{letter}{team.team.number}"
+                person = Person.objects.create(
+                    surname=name,
+                    firstname="Test",
+                    nickname=name,
+                    gender="F",
+                    birthdate=dt.date(2000, 1, 1),
+                    country="FR",
+                    mugshot="driver.png",
+                )
+                self.drivers[name] = team_member.objects.create(
+                    team=team, member=person, weight=70
+                )
+        values = {
+            "required changes": (3, "fixed"),
+            "time limit": (2, "fixed"),
+            "time limit min": (1, "per_hour"),
+        }
+        for name, (value, option) in values.items():
+            ChampionshipPenalty.objects.create(
+                championship=self.cround.championship,
+                penalty=Penalty.objects.get_or_create(
+                    name=name, defaults={"description": name}
+                )[0],
+                sanction="P",
+                value=value,
+                option=option,
+            )
+
+    def drive(self, name, start, end=None):
+        """A stint of a driver, minutes into the race, open without end"""
+        at = self.started + dt.timedelta(minutes=start)
+        Session.objects.create(
+            round=self.cround,
+            driver=self.drivers[name],
+            register=at,
+            start=at,
+            end=None if end is None else self.started + dt.timedelta(minutes=end),
+        )
+
+    def limits(self, **limits):
+        Round.objects.filter(pk=self.cround.pk).update(**limits)
+        self.cround.refresh_from_db()
+
+    def penalties(self):
+        return sorted(
+            (p.offender.team.number, p.penalty.penalty.name, p.value)
+            for p in RoundPenalty.objects.filter(round=self.cround).select_related(
+                "offender__team", "penalty__penalty"
+            )
+        )
+
+    def test_race_limits(self):
+        self.limits(
+            limit_time="race",
+            limit_method="time",
+            limit_value=40,
+            required_changes=1,
+            limit_time_min=dt.timedelta(minutes=5),
+        )
+        # Within every limit
+        self.drive("A1", 0, 25)
+        self.drive("B1", 25, 50)
+        self.drive("A1", 50)
+        # One change, A2 under the minimum, B2 over the limit on its open stint
+        self.drive("A2", 0, 3)
+        self.drive("B2", 3)
+        # One change, A3 over the limit, C3 never drove
+        self.drive("A3", 0, 45)
+        self.drive("B3", 45)
+        team_member.objects.filter(
+            pk__in=[self.drivers["C1"].pk, self.drivers["C2"].pk]
+        ).update(driver=False)
+
+        report = self.cround.post_race_check()
+
+        # 2 hour race, the minimum time penalty is per hour
+        expected = [
+            (2, "required changes", 3),
+            (2, "time limit", 2),
+            (2, "time limit min", 2),
+            (3, "required changes", 3),
+            (3, "time limit", 2),
+            (3, "time limit min", 2),
+        ]
+        self.assertEqual(self.penalties(), expected)
+        self.assertEqual(report["round"], self.cround.pk)
+        self.assertFalse(report["skipped"])
+        self.assertEqual(report["penalties_created"], len(expected))
+        transgressions = sorted(
+            (t["team"], t["driver"] or "", t["penalty"], t["count"], t["value"])
+            for t in report["transgressions"]
+        )
+        self.assertEqual(
+            transgressions,
+            [
+                (2, "", "required changes", 1, 3),
+                (2, "A2", "time limit min", 1, 2),
+                (2, "B2", "time limit", 1, 2),
+                (3, "", "required changes", 1, 3),
+                (3, "A3", "time limit", 1, 2),
+                (3, "C3", "time limit min", 1, 2),
+            ],
+        )
+        self.cround.refresh_from_db()
+        self.assertTrue(self.cround.post_race_check_completed)
+
+        # Once only
+        report = self.cround.post_race_check()
+        self.assertTrue(report["skipped"])
+        self.assertEqual(report["penalties_created"], 0)
+        self.assertEqual(len(self.penalties()), len(expected))
+
+    def test_session_limit(self):
+        self.limits(
+            limit_time="session",
+            limit_method="time",
+            limit_value=20,
+            required_changes=0,
+            limit_time_min=dt.timedelta(0),
+        )
+        team_member.objects.filter(member__nickname__startswith="C").update(
+            driver=False
+        )
+        # Every stint under 20 minutes
+        self.drive("A1", 0, 15)
+        self.drive("B1", 15, 30)
+        self.drive("A1", 30, 45)
+        self.drive("B1", 45)
+        # B2 over it once, A2 on its open stint
+        self.drive("A2", 0, 10)
+        self.drive("B2", 10, 35)
+        self.drive("A2", 35)
+        # A3 twice
+        self.drive("A3", 0, 21)
+        self.drive("B3", 21, 30)
+        self.drive("A3", 30, 55)
+        self.drive("B3", 55)
+
+        report = self.cround.post_race_check()
+
+        self.assertEqual(
+            self.penalties(),
+            [(2, "time limit", 2), (2, "time limit", 2), (3, "time limit", 4)],
+        )
+        self.assertEqual(
+            sorted(
+                (t["team"], t["driver"], t["count"], t["value"])
+                for t in report["transgressions"]
+            ),
+            [(2, "A2", 1, 2), (2, "B2", 1, 2), (3, "A3", 2, 4)],
+        )
+
+
+class FramesTest(SimpleTestCase):
+    key = b"station secret"
+    message = {
+        "type": "response",
+        "station": "pit-1",
+        "response": "penalty_served",
+        "team": 7,
+        "counter": 42,
+        "timestamp": "2026-10-17T14:03:21.123456",
+    }
+
+    def sign(self, header, body):
+        """A frame with any content, correctly signed"""
+        frame = header + body
+        return frame + hmac.new(self.key, frame, hashlib.sha256).digest()
+
+    def test_round_trip(self):
+        for name in MESSAGE_TYPES:
+            message = {**self.message, "type": name}
+            with self.subTest(type=name):
+                frame = encode_frame(message, self.key)
+                self.assertEqual(decode_frame(frame, self.key), message)
+
+    def test_no_counter_nor_timestamp(self):
+        message = {"type": "command", "command": "reset"}
+        frame = encode_frame(message, self.key)
+        self.assertEqual(decode_frame(frame, self.key), message)
+
+    def test_unknown_type(self):
+        with self.assertRaises(ValueError):
+            encode_frame({**self.message, "type": "penalty_required"}, self.key)
+
+    def test_tampered(self):
+        frame = encode_frame(self.message, self.key)
+        # In the header, the payload and the signature
+        for at in (1, 5, HEADER.size + 3, len(frame) - 1):
+            tampered = bytearray(frame)
+            tampered[at] ^= 0x01
+            with self.subTest(at=at):
+                self.assertIsNone(decode_frame(bytes(tampered), self.key))
+        self.assertIsNone(decode_frame(frame[:-1], self.key))
+        self.assertIsNone(decode_frame(frame[: HEADER.size], self.key))
+        self.assertIsNone(decode_frame(b"", self.key))
+
+    def test_bad_signature(self):
+        frame = encode_frame(self.message, self.key)
+        self.assertIsNone(decode_frame(frame, b"another secret"))
+        forged = frame[:-SIGNATURE_SIZE] + bytes(SIGNATURE_SIZE)
+        self.assertIsNone(decode_frame(forged, self.key))
+
+    def test_signed_but_malformed(self):
+        body = b'{"command":"reset"}'
+        frames = {
+            "version": self.sign(
+                HEADER.pack(FRAME_VERSION + 1, 1, 0, 0, len(body)), body
+            ),
+            "type": self.sign(HEADER.pack(FRAME_VERSION, 99, 0, 0, len(body)), body),
+            "length": self.sign(
+                HEADER.pack(FRAME_VERSION, 1, 0, 0, len(body) + 1), body
+            ),
+            "json": self.sign(HEADER.pack(FRAME_VERSION, 1, 0, 0, 3), b"{no"),
+            "not a dict": self.sign(HEADER.pack(FRAME_VERSION, 1, 0, 0, 2), b"[]"),
+        }
+        for reason, frame in frames.items():
+            with self.subTest(reason=reason):
+                self.assertIsNone(decode_frame(frame, self.key))
+
+
+class LatenessHistogramTest(SimpleTestCase):
+    def test_empty(self):
+        histogram = LatenessHistogram()
+        self.assertIsNone(histogram.percentile(50))
+        self.assertIsNone(histogram.mean)
+        self.assertEqual(histogram.as_dict()["count"], 0)
+
+    def test_early_is_on_time(self):
+        histogram = LatenessHistogram()
+        histogram.add(-0.5)
+        self.assertEqual(histogram.counts[0], 1)
+        self.assertEqual(histogram.max, 0)
+        self.assertEqual(histogram.percentile(100), 1)
+
+    def test_percentiles(self):
+        histogram = LatenessHistogram()
+        for _ in range(90):
+            histogram.add(0.005)
+        for _ in range(9):
+            histogram.add(0.15)
+        histogram.add(70)
+        self.assertEqual(histogram.percentile(50), 5)
+        self.assertEqual(histogram.percentile(90), 5)
+        self.assertEqual(histogram.percentile(95), 200)
+        self.assertEqual(histogram.percentile(99), 200)
+        # Above the last bound, the maximum
+        self.assertEqual(histogram.percentile(100), 70000)
+        metrics = histogram.as_dict()
+        self.assertEqual(metrics["count"], 100)
+        self.assertEqual(metrics["max_ms"], 70000)
+        self.assertEqual(metrics["buckets"]["<=5ms"], 90)
+        self.assertEqual(metrics["buckets"]["<=200ms"], 9)
+        self.assertEqual(metrics["buckets"][">60000ms"], 1)
+        self.assertEqual(sum(metrics["buckets"].values()), 100)
+
+
+@override_settings(**LOCAL_SETTINGS)
+class DeadlineSchedulerTest(TransactionTestCase):
+    # Seconds an event may run after its deadline
+    THRESHOLD = 0.2
+
+    def test_events_on_time(self):
+        ago = dt.timedelta(minutes=10)
+        cround = started_round("Deadlines", ago=ago)
+        # Pit lanes open, close and the race ends 0.3s apart from now on
+        Round.objects.filter(pk=cround.pk).update(
+            pitlane_open_after=ago + dt.timedelta(seconds=0.3),
+            pitlane_close_before=dt.timedelta(seconds=0.3),
+            duration=ago + dt.timedelta(seconds=0.9),
+        )
+        scheduler = DeadlineScheduler()
+        scheduler.start()
+        try:
+            timeout = time.monotonic() + 5
+            while RaceEventTiming.objects.count() < 3:
+                self.assertLess(time.monotonic(), timeout, "Events did not run")
+                time.sleep(0.05)
+        finally:
+            scheduler.stop()
+
+        timings = RaceEventTiming.objects.filter(round=cround)
+        self.assertEqual(
+            sorted(timings.values_list("event", flat=True)),
+            sorted([PIT_OPEN, PIT_CLOSE, RACE_END]),
+        )
+        for event, lateness in timings.values_list("event", "lateness"):
+            with self.subTest(event=event):
+                self.assertLess(lateness, self.THRESHOLD)
+        metrics = lateness_metrics(cround.pk)
+        for event in (PIT_OPEN, PIT_CLOSE, RACE_END):
+            self.assertEqual(metrics[event]["count"], 1)
+            self.assertLess(metrics[event]["max_ms"], self.THRESHOLD * 1000)
+
+
+@override_settings(**LOCAL_SETTINGS)
+class CounterWindowTest(SimpleTestCase):
+    def setUp(self):
+        cache.clear()
+
+    def test_window(self):
+        window = CounterWindow()
+        self.assertTrue(window.accept(100))
+        self.assertTrue(window.accept(100 - WINDOW + 1))
+        self.assertFalse(window.accept(100 - WINDOW))
+        self.assertTrue(window.accept(500))
+        self.assertFalse(window.accept(100))
+
+    def test_shared_per_station(self):
+        # As the connections before and after a reconnection
+        self.assertTrue(CounterWindow("pit-1").accept(500))
+        self.assertFalse(CounterWindow("pit-1").accept(10))
+        self.assertTrue(CounterWindow("pit-1").accept(501))
+        # Other stations and stations without an id have their own
+        self.assertTrue(CounterWindow("pit-2").accept(10))
+        self.assertTrue(CounterWindow().accept(10))
+
+
+@override_settings(**LOCAL_SETTINGS)
+class GenerationScopeTest(TestCase):
+    """The pause index generation is read once per request."""
+
+    def setUp(self):
+        cache.clear()
+        self.cround = started_round("Generations")
+        self.key = f"pause_index_{self.cround.pk}"
+
+    def test_read_once(self):
+        with mock.patch("race.generations.cache", wraps=cache) as shared:
+            with generation_scope():
+                for _ in range(10):
+                    get_pause_index(self.cround.pk)
+            self.assertEqual(shared.get.call_count, 1)
+            get_pause_index(self.cround.pk)
+            get_pause_index(self.cround.pk)
+            self.assertEqual(shared.get.call_count, 3)
+
+    def test_changes(self):
+        with generation_scope():
+            index = get_pause_index(self.cround.pk)
+            # Another process changed the pauses: seen by the next scope
+            cache.set(self.key, cache.get(self.key, 0) + 1, None)
+            self.assertIs(get_pause_index(self.cround.pk), index)
+            # This one did: seen at once
+            invalidate_pause_index(self.cround.pk)
+            index = get_pause_index(self.cround.pk)
+            self.assertIs(get_pause_index(self.cround.pk), index)
+        cache.set(self.key, cache.get(self.key, 0) + 1, None)
+        self.assertIsNot(get_pause_index(self.cround.pk), index)
+
+    def test_middleware(self):
+        def view(request):
+            for _ in range(10):
+                get_pause_index(self.cround.pk)
+            return "response"
+
+        middleware = GenerationScopeMiddleware(view)
+        with mock.patch("race.generations.cache", wraps=cache) as shared:
+            self.assertEqual(middleware(None), "response")
+            self.assertEqual(middleware(None), "response")
+        # Once per request
+        self.assertEqual(shared.get.call_count, 2)
@@ -68,6 +68,10 @@ urlpatterns = [
     path("team/add/", views.create_team, name="add_team"),
     path("get_round_status/", views.get_round_status, name="get_round_status"),
     path("get_race_lanes/", views.get_race_lanes, name="get_race_lane"),
+    path("get_race_state/", views.get_race_state, name="get_race_state"),
+    path("broadcast_stats/", views.broadcast_stats, name="broadcast_stats"),
+    path("deadline_status/", views.deadline_status, name="deadline_status"),
+    path("deadline_metrics/", views.deadline_metrics, name="deadline_metrics"),
     path("singleteam/", views.singleteam_view, name="single_team"),
     path("join_championship/", views.join_championship_view, name="join_championship"),
     path("api/get_teams/", views.get_available_teams, name="get_available_teams"),
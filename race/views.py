@@ -8,7 +8,7 @@ import re
 import socket
 import ipaddress
 import netifaces
-from django.http import HttpResponse, JsonResponse
+from django.http import HttpResponse, JsonResponse, Http404
 from django.shortcuts import render, redirect, get_object_or_404
 from django.contrib.auth import authenticate
 from django.contrib.auth.decorators import login_required, user_passes_test
@@ -48,8 +48,16 @@ from .models import (
     RoundPenalty,
     PenaltyQueue,
     Logo,
+    SchedulerLease,
 )
 from .signals import race_end_requested
+from .currentround import current_round
+from .racestate import race_snapshot
+from .broadcast import lane_broadcaster
+from .deadlines import deadline_scheduler
+from .penaltydispatch import penalty_dispatcher, online_stations, station_states
+from .scheduler import AUTOMATION_LEASE
+from .lateness import lateness_metrics
 from .serializers import ChangeLaneSerializer
 from .utils import datadecode, is_admin_user
 from .forms import DriverForm, TeamForm, JoinChampionshipForm
@@ -58,14 +66,6 @@ from django.db import models
 from django_countries import countries
 
 
-def current_round():
-    end_date = dt.date.today()
-    start_date = end_date - dt.timedelta(days=1)
-    return Round.objects.filter(
-        Q(start__date__range=[start_date, end_date]) & Q(ended__isnull=True)
-    ).first()
-
-
 def active_round():
     start_date = dt.date.today() - dt.timedelta(days=1)
     return Round.objects.filter(
@@ -179,7 +179,7 @@ def get_team_card(request):
     team_id = request.GET.get("team_id")
     round_team_instance = get_object_or_404(round_team, pk=team_id)
     assert cround == round_team_instance.round
-    is_paused = cround.round_pause_set.filter(end__isnull=True).exists()
+    is_paused = cround.is_paused
     if cround.started:
         elapsed = round(cround.time_elapsed.total_seconds())
         remaining = int(max(0, round(cround.duration.total_seconds() - elapsed)))
@@ -205,10 +205,7 @@ def changelane_info(request, lane_number):
 
     change_lane = None
     if cround:
-        try:
-            change_lane = ChangeLane.objects.get(round=cround, lane=lane_number)
-        except ChangeLane.DoesNotExist:
-            pass
+        change_lane = race_snapshot(cround.id).lane(lane_number)
 
     return render(
         request,
@@ -217,9 +214,15 @@ def changelane_info(request, lane_number):
     )
 
 
+def lane_or_404(cround, lane_number):
+    change_lane = race_snapshot(cround.id).lane(lane_number) if cround else None
+    if change_lane is None:
+        raise Http404("No such change lane.")
+    return change_lane
+
+
 def changelane_detail(request, lane_number):
-    cround = current_round()
-    change_lane = get_object_or_404(ChangeLane, round=cround, lane=lane_number)
+    change_lane = lane_or_404(current_round(), lane_number)
     return render(
         request, "layout/changelane_small_detail.html", {"change_lane": change_lane}
     )
@@ -227,8 +230,7 @@ def changelane_detail(request, lane_number):
 
 def changelane_vdetail(request, lane_number):
     """Large detail view for all_pitlanes"""
-    cround = current_round()
-    change_lane = get_object_or_404(ChangeLane, round=cround, lane=lane_number)
+    change_lane = lane_or_404(current_round(), lane_number)
     return render(
         request, "layout/changelane_vdetail.html", {"change_lane": change_lane}
     )
@@ -246,9 +248,7 @@ def update_change_lane(request, lane_number):
 def changedriver_info(request):
     try:
         cround = current_round()
-        change_lanes = ChangeLane.objects.filter(round=cround, open=True).order_by(
-            "lane"
-        )
+        change_lanes = race_snapshot(cround.id).open_lanes
         return render(
             request, "layout/changedriver_info.html", {"change_lanes": change_lanes}
         )
@@ -270,7 +270,7 @@ def all_pitlanes(request):
         cround = None
 
     if cround:
-        change_lanes = ChangeLane.objects.filter(round=cround).order_by("lane")
+        change_lanes = race_snapshot(cround.id).lanes
     else:
         change_lanes = []
 
@@ -292,35 +292,16 @@ def racecontrol(request):
     try:
         lanes = cround.change_lanes
 
-        # Get all sessions that are registered but not started or ended
-        pending_sessions = (
-            Session.objects.filter(
-                round=cround,
-                register__isnull=False,
-                start__isnull=True,
-                end__isnull=True,
-            )
-            .select_related(
-                "driver", "driver__team", "driver__member", "driver__team__team"
-            )
-            .order_by("register")
-        )  # Order by registration time
-
-        # For each session, get the team's completed sessions count
-        for session in pending_sessions:
-            completed_count = Session.objects.filter(
-                driver__team=session.driver.team, end__isnull=False
-            ).count()
-
-            # Add as property to the session object
-            session.team_completed_count = completed_count
+        # Registered sessions, by registration time, with the team's completed count
+        snapshot = race_snapshot(cround.id)
         return render(
             request,
             "pages/racecontrol.html",
             {
                 "round": cround,
                 "lanes": lanes,
-                "pending_sessions": pending_sessions,
+                "pending_sessions": snapshot.pending,
+                "state_version": snapshot.version,
                 "settings": {"STOPANDGO_HMAC_SECRET": settings.STOPANDGO_HMAC_SECRET},
             },
         )
@@ -529,7 +510,9 @@ def add_driver_to_queue(request):
         payload = json.loads(request.body)  # or request.data if using DRF parsers
 
         tmpk = datadecode(cround, payload["data"])
-        tmember = team_member.objects.get(pk=tmpk)
+        tmember = team_member.objects.select_related("member", "team__team").get(
+            pk=tmpk
+        )
         # Process the data and perform the desired actions
         try:
             result = cround.driver_register(tmember)
@@ -564,7 +547,9 @@ def change_kart_driver(request):
         payload = json.loads(request.body)  # or request.data if using DRF parsers
 
         tmpk = datadecode(cround, payload["data"])
-        tmember = team_member.objects.get(pk=tmpk)
+        tmember = team_member.objects.select_related("member", "team__team").get(
+            pk=tmpk
+        )
         # Process the data and perform the desired actions
         try:
             result = cround.driver_endsession(tmember)
@@ -733,13 +718,14 @@ def create_driver(request):
             return redirect("add_driver")  # Redirect to a page listing persons
     else:
         form = DriverForm()
+    cround = current_round()
     return render(
         request,
         "pages/add_driver.html",
         {
             "form": form,
-            "organiser_logo": get_organiser_logo(current_round()),
-            "sponsors_logos": get_sponsor_logos(current_round()),
+            "organiser_logo": get_organiser_logo(cround),
+            "sponsors_logos": get_sponsor_logos(cround),
         },
     )
 
@@ -747,6 +733,7 @@ def create_driver(request):
 @login_required
 @user_passes_test(is_admin_user)
 def create_team(request):
+    cround = current_round()
     if request.method == "POST":
         form = TeamForm(request.POST, request.FILES)
         if form.is_valid():
@@ -772,8 +759,8 @@ def create_team(request):
                         "pages/add_team.html",
                         {
                             "form": form,
-                            "organiser_logo": get_organiser_logo(current_round()),
-                            "sponsors_logos": get_sponsor_logos(current_round()),
+                            "organiser_logo": get_organiser_logo(cround),
+                            "sponsors_logos": get_sponsor_logos(cround),
                         },
                     )
             messages.success(request, "Team added successfully!")
@@ -783,7 +770,7 @@ def create_team(request):
     return render(
         request,
         "pages/add_team.html",
-        {"form": form, "organiser_logo": get_organiser_logo(current_round())},
+        {"form": form, "organiser_logo": get_organiser_logo(cround)},
     )
 
 
@@ -813,9 +800,55 @@ def get_race_lanes(request):
         return JsonResponse({"lanes": []})
 
     # Get lanes for this round
-    lanes = ChangeLane.objects.filter(round=cround).values("id", "lane")
+    lanes = [
+        {"id": alane.id, "lane": alane.lane} for alane in race_snapshot(cround.id).lanes
+    ]
+
+    return JsonResponse({"lanes": lanes})
+
+
+def get_race_state(request):
+    """Return the live state of the current round as JSON"""
+    cround = current_round()
+
+    if not cround:
+        return JsonResponse({"round": None})
+
+    return JsonResponse(race_snapshot(cround.id).as_dict())
+
+
+@login_required
+@user_passes_test(is_admin_user)
+def broadcast_stats(request):
+    """Return the counters of the change lane broadcaster as JSON"""
+    return JsonResponse(lane_broadcaster.get_stats())
+
+
+@login_required
+@user_passes_test(is_admin_user)
+def deadline_status(request):
+    """Return the race event timers of every running round as JSON"""
+    status = deadline_scheduler.get_status()
+    # Only the process holding the lease runs the timers, say which one it is
+    lease = (
+        SchedulerLease.objects.filter(name=AUTOMATION_LEASE)
+        .values("holder", "since", "expires")
+        .first()
+    )
+    status["lease"] = lease
+    return JsonResponse(status)
 
-    return JsonResponse({"lanes": list(lanes)})
+
+@login_required
+@user_passes_test(is_admin_user)
+def deadline_metrics(request):
+    """Return the lateness histograms of the timed race events as JSON"""
+    round_id = request.GET.get("round")
+    try:
+        round_id = int(round_id) if round_id else None
+    except ValueError:
+        return JsonResponse({"error": "Invalid round"}, status=400)
+    return JsonResponse({"round": round_id, "events": lateness_metrics(round_id)})
 
 
 def driver_session_timer(request, driver_id):
@@ -907,32 +940,14 @@ def pending_drivers(request):
             },
         )
 
-    # Get all sessions that are registered but not started or ended
-    pending_sessions = (
-        Session.objects.filter(
-            round=cround,
-            register__isnull=False,
-            start__isnull=True,
-            end__isnull=True,
-        )
-        .select_related(
-            "driver", "driver__team", "driver__member", "driver__team__team"
-        )
-        .order_by("register")
-    )  # Order by registration time
-
-    # For each session, get the team's completed sessions count
-    for session in pending_sessions:
-        completed_count = Session.objects.filter(
-            driver__team=session.driver.team, end__isnull=False
-        ).count()
-
-        # Add as property to the session object
-        session.team_completed_count = completed_count
+    # Registered sessions, by registration time, with the team's completed count
+    snapshot = race_snapshot(cround.id)
+    pending_sessions = snapshot.pending
 
     context = {
         "round": cround,
         "pending_sessions": pending_sessions,
+        "state_version": snapshot.version,
         "organiser_logo": get_organiser_logo(cround),
     }
 
@@ -958,32 +973,14 @@ def pending_drivers_with_nav(request):
             },
         )
 
-    # Get all sessions that are registered but not started or ended
-    pending_sessions = (
-        Session.objects.filter(
-            round=cround,
-            register__isnull=False,
-            start__isnull=True,
-            end__isnull=True,
-        )
-        .select_related(
-            "driver", "driver__team", "driver__member", "driver__team__team"
-        )
-        .order_by("register")
-    )  # Order by registration time
-
-    # For each session, get the team's completed sessions count
-    for session in pending_sessions:
-        completed_count = Session.objects.filter(
-            driver__team=session.driver.team, end__isnull=False
-        ).count()
-
-        # Add as property to the session object
-        session.team_completed_count = completed_count
+    # Registered sessions, by registration time, with the team's completed count
+    snapshot = race_snapshot(cround.id)
+    pending_sessions = snapshot.pending
 
     context = {
         "round": cround,
         "pending_sessions": pending_sessions,
+        "state_version": snapshot.version,
         "organiser_logo": get_organiser_logo(cround),
         "sponsors_logos": get_sponsor_logos(cround),
     }
@@ -1038,14 +1035,15 @@ def join_championship_view(request):
         # Get and clear success message from session
         success_message = request.session.pop("success_message", None)
 
+    cround = current_round()
     return render(
         request,
         "pages/join_championship.html",
         {
             "form": form,
             "success_message": success_message,
-            "organiser_logo": get_organiser_logo(current_round()),
-            "sponsors_logos": get_sponsor_logos(current_round()),
+            "organiser_logo": get_organiser_logo(cround),
+            "sponsors_logos": get_sponsor_logos(cround),
         },
     )
 
@@ -1361,11 +1359,12 @@ def edit_driver_view(request):
     drivers = Person.objects.all().order_by("nickname")
     countries_list = list(countries)
 
+    cround = current_round()
     context = {
         "drivers": drivers,
         "countries": countries_list,
-        "organiser_logo": get_organiser_logo(current_round()),
-        "sponsors_logos": get_sponsor_logos(current_round()),
+        "organiser_logo": get_organiser_logo(cround),
+        "sponsors_logos": get_sponsor_logos(cround),
     }
     return render(request, "pages/edit_driver.html", context)
 
@@ -1393,10 +1392,11 @@ def edit_team_view(request):
     # GET request - show the form
     teams = Team.objects.all().order_by("name")
 
+    cround = current_round()
     context = {
         "teams": teams,
-        "organiser_logo": get_organiser_logo(current_round()),
-        "sponsors_logos": get_sponsor_logos(current_round()),
+        "organiser_logo": get_organiser_logo(cround),
+        "sponsors_logos": get_sponsor_logos(cround),
     }
     return render(request, "pages/edit_team.html", context)
 
@@ -1440,10 +1440,11 @@ def create_championship_view(request):
 
     # GET request - show the form
     current_year = dt.date.today().year
+    cround = current_round()
     context = {
         "current_year": current_year,
-        "organiser_logo": get_organiser_logo(current_round()),
-        "sponsors_logos": get_sponsor_logos(current_round()),
+        "organiser_logo": get_organiser_logo(cround),
+        "sponsors_logos": get_sponsor_logos(cround),
     }
     return render(request, "pages/create_championship.html", context)
 
@@ -1699,12 +1700,13 @@ def edit_championship_view(request):
     # GET request - show the form
     championships = Championship.objects.all().order_by("-start")
 
+    cround = current_round()
     context = {
         "championships": championships,
         "sanction_choices": ChampionshipPenalty.PTYPE,
         "option_choices": ChampionshipPenalty.OPTION_CHOICES,
-        "organiser_logo": get_organiser_logo(current_round()),
-        "sponsors_logos": get_sponsor_logos(current_round()),
+        "organiser_logo": get_organiser_logo(cround),
+        "sponsors_logos": get_sponsor_logos(cround),
     }
     return render(request, "pages/edit_championship.html", context)
 
@@ -1767,10 +1769,11 @@ def edit_round_view(request):
     # GET request - show the form
     championships = Championship.objects.all().order_by("-start")
 
+    cround = current_round()
     context = {
         "championships": championships,
-        "organiser_logo": get_organiser_logo(current_round()),
-        "sponsors_logos": get_sponsor_logos(current_round()),
+        "organiser_logo": get_organiser_logo(cround),
+        "sponsors_logos": get_sponsor_logos(cround),
     }
     return render(request, "pages/edit_round.html", context)
 
@@ -1885,10 +1888,11 @@ def penalty_management_view(request):
 
     # GET request - show the penalties
     penalties = Penalty.objects.all().order_by("name")
+    cround = current_round()
     context = {
         "penalties": penalties,
-        "organiser_logo": get_organiser_logo(current_round()),
-        "sponsors_logos": get_sponsor_logos(current_round()),
+        "organiser_logo": get_organiser_logo(cround),
+        "sponsors_logos": get_sponsor_logos(cround),
     }
     return render(request, "pages/penalty_management.html", context)
 
@@ -2007,11 +2011,12 @@ def sponsor_management_view(request):
     # GET request - show the logos
     logos = Logo.objects.all().order_by("name", "championship__name")
     championships = Championship.objects.all().order_by("name")
+    cround = current_round()
     context = {
         "logos": logos,
         "championships": championships,
-        "organiser_logo": get_organiser_logo(current_round()),
-        "sponsors_logos": get_sponsor_logos(current_round()),
+        "organiser_logo": get_organiser_logo(cround),
+        "sponsors_logos": get_sponsor_logos(cround),
     }
     return render(request, "pages/sponsor_management.html", context)
 
@@ -2380,22 +2385,12 @@ def queue_penalty(request):
             )
 
             # Signal penalty queue system
-            # Only triggers immediately if queue was empty (0→1)
-            if was_queue_empty:
-                # Trigger first penalty immediately using channels
-                from channels.layers import get_channel_layer
-                from asgiref.sync import async_to_sync
-
-                channel_layer = get_channel_layer()
-                async_to_sync(channel_layer.group_send)(
-                    "stopandgo",
-                    {
-                        "type": "penalty_required",
-                        "team": offender.team.number,
-                        "duration": value,
-                        "penalty_id": round_penalty.id,
-                    },
-                )
+            # Only triggers immediately if queue was empty (0→1), or if a
+            # registered station may be free
+            if was_queue_empty or online_stations().exists():
+                # Trigger first penalty immediately, through the dispatcher so
+                # that a pending trigger does not send it again
+                penalty_dispatcher.dispatch(round_obj.id)
 
             return JsonResponse(
                 {
@@ -2432,6 +2427,7 @@ def get_penalty_queue_status(request, round_id):
         response_data = {
             "queue_count": queue_count,
             "serving_team": serving_team,
+            "stations": station_states(),
         }
 
         if active_penalty:
@@ -2465,43 +2461,29 @@ def serve_penalty(request):
                     {"success": False, "error": "round_id is required"}, status=400
                 )
 
-            # Get the current active penalty (first in queue order)
-            queue_entry = PenaltyQueue.get_next_penalty(round_id)
-            if not queue_entry:
+            # Mark the given penalty, or the one of the given station, else
+            # the current active penalty (first in queue order) as served
+            # and remove it from the queue, unless the station just did.
+            # With several stations the head is not the only one served.
+            entries = PenaltyQueue.objects.filter(round_penalty__round_id=round_id)
+            if data.get("penalty_id"):
+                entries = entries.filter(round_penalty_id=data["penalty_id"])
+            elif data.get("station"):
+                entries = entries.filter(station__station=data["station"])
+            queue_entry = entries.select_related("station").first()
+            if not queue_entry or not PenaltyQueue.serve(
+                round_id, penalty_id=queue_entry.round_penalty_id
+            ):
                 return JsonResponse(
                     {"success": False, "error": "No active penalty found"}, status=404
                 )
+            station = queue_entry.station
 
-            # Mark penalty as served
-            queue_entry.round_penalty.served = dt.datetime.now()
-            queue_entry.round_penalty.save()
+            # Reset the station that was serving it, to clear its display
+            penalty_dispatcher.reset(station)
 
-            # Remove from queue
-            round_id = queue_entry.round_penalty.round.id
-            queue_entry.delete()
-
-            # Reset the station and handle queue progression
-            from channels.layers import get_channel_layer
-            from asgiref.sync import async_to_sync
-
-            channel_layer = get_channel_layer()
-
-            # Send reset to station to clear display
-            async_to_sync(channel_layer.group_send)(
-                "stopandgo",
-                {
-                    "type": "reset_station",
-                },
-            )
-
-            # Then signal queue progression
-            async_to_sync(channel_layer.group_send)(
-                "stopandgo",
-                {
-                    "type": "penalty_cancelled",  # Use same handler as cancel for queue progression
-                    "round_id": round_id,
-                },
-            )
+            # Then send the next penalty once the station had time to clear
+            penalty_dispatcher.schedule(round_id)
 
             return JsonResponse({"success": True})
 
@@ -2526,31 +2508,15 @@ def cancel_penalty(request):
 
             # Delete both penalty and queue entry
             round_penalty = queue_entry.round_penalty
+            station = queue_entry.release_station()
             queue_entry.delete()
             round_penalty.delete()
 
-            # Reset the station and handle queue progression
-            from channels.layers import get_channel_layer
-            from asgiref.sync import async_to_sync
+            # Reset the station that was serving it, to clear its display
+            penalty_dispatcher.reset(station)
 
-            channel_layer = get_channel_layer()
-
-            # Send reset to station first
-            async_to_sync(channel_layer.group_send)(
-                "stopandgo",
-                {
-                    "type": "reset_station",
-                },
-            )
-
-            # Then signal queue progression
-            async_to_sync(channel_layer.group_send)(
-                "stopandgo",
-                {
-                    "type": "penalty_cancelled",
-                    "round_id": round_id,
-                },
-            )
+            # Then send the next penalty once the station had time to clear
+            penalty_dispatcher.schedule(round_id)
 
             return JsonResponse({"success": True})
 
@@ -2573,7 +2539,8 @@ def delay_penalty(request):
             queue_entry = get_object_or_404(PenaltyQueue, id=queue_id)
             round_id = queue_entry.round_penalty.round.id
 
-            # Move to end of queue
+            # Move to end of queue, for any station
+            station = queue_entry.station
             queue_entry.delay_penalty()
 
             # Check if this was a delayed penalty and apply "ignoring s&g" penalty
@@ -2597,28 +2564,11 @@ def delay_penalty(request):
                 # No "ignoring s&g" penalty configured
                 pass
 
-            # Reset the station and handle queue progression
-            from channels.layers import get_channel_layer
-            from asgiref.sync import async_to_sync
-
-            channel_layer = get_channel_layer()
+            # Reset the station that was serving it, to clear its display
+            penalty_dispatcher.reset(station)
 
-            # Send reset to station first
-            async_to_sync(channel_layer.group_send)(
-                "stopandgo",
-                {
-                    "type": "reset_station",
-                },
-            )
-
-            # Then signal queue progression
-            async_to_sync(channel_layer.group_send)(
-                "stopandgo",
-                {
-                    "type": "penalty_delayed",
-                    "round_id": round_id,
-                },
-            )
+            # Then send the next penalty once the station had time to clear
+            penalty_dispatcher.schedule(round_id)
 
             return JsonResponse({"success": True})
 
@@ -2630,8 +2580,8 @@ def delay_penalty(request):
     return JsonResponse({"success": False, "error": "Method not allowed"}, status=405)
 
 
-# Note: Penalty queue timing and next penalty triggering will be handled
-# by the StopAndGoConsumer when it receives penalty state updates
+# Note: Penalty queue timing and next penalty triggering are handled by
+# the penalty dispatcher
 
 
 def get_organiser_logo(round_obj):
@@ -0,0 +1,107 @@
+/**
+ * Pit lane displays rendered from the lane state.
+ *
+ * Lane sockets opened with ?format=state send lane.state messages that
+ * carry the lane state (see ChangeLane.as_state in race/racestate.py)
+ * instead of rendered HTML. The renderers below turn it into the same
+ * markup and classes as the server templates, so a lane looks the same
+ * whether it was rendered here or fetched from the server:
+ *
+ *   renderSmallLane(state, id)     layout/changelane_small_detail.html
+ *   renderVerticalLane(state, id)  layout/changelane_vdetail.html
+ *
+ * Keep them in step with the templates.
+ */
+
+function escapeHtml(value) {
+  const div = document.createElement("div");
+  div.textContent = value === null || value === undefined ? "" : String(value);
+  return div.innerHTML;
+}
+
+function lanePenalty(driver) {
+  return driver.weight_penalty === null ? "None" : driver.weight_penalty;
+}
+
+/**
+ * Whether a state is newer than the one shown for key, remembered in
+ * versions when it is. Messages may cross, never go back to an older state.
+ */
+function isNewerLaneState(versions, key, state) {
+  if (versions[key] !== undefined && state.version <= versions[key]) {
+    return false;
+  }
+  versions[key] = state.version;
+  return true;
+}
+
+function renderSmallLane(state, id) {
+  if (!state.open) {
+    return `<div id="${id}" class="row w-100 m-0" style="flex-grow: 1;">
+        <div class="col-12 d-flex align-items-center justify-content-center h-100" style="background-color: red;">
+            <h1 class="text-warning" style="font-size: 3rem; font-weight: bold;">Closed</h1>
+        </div>
+    </div>`;
+  }
+  if (!state.driver) {
+    return `<div id="${id}" class="row w-100 m-0" style="flex-grow: 1;">
+        <div class="d-flex align-items-center justify-content-center h-100" style="background-color: green;">
+            <h1 class="text-dark" style="font-size: 3rem; font-weight: bold;">Open</h1>
+        </div>
+    </div>`;
+  }
+  const driver = state.driver;
+  return `<div id="${id}" class="row w-100 m-0">
+        <div class="col-3 d-flex align-items-center justify-content-center"
+            style="font-size: 6rem; font-weight: bold; height: 100%; background-color: #f0fff0;">
+                ${escapeHtml(driver.team_number)}
+        </div>
+        <div class="col-9 p-5 d-flex align-items-center justify-content-center flex-column" style="font-size: 2rem; height: 100%; background-color: #f0fff0; position: relative;">
+                <h1 class="text-primary" style="font-size: 2rem;">${escapeHtml(driver.team_name)}</h1>
+                <div class="d-flex align-items-center">
+                    <div class="d-flex flex-column justify-content-center" style="margin-left: 20px;">
+                        <p class="text-dark" style="font-size: 2rem;">${escapeHtml(driver.nickname)}</p>
+                        <p class="text-dark" style="font-size: 2rem;">Penalty: ${escapeHtml(lanePenalty(driver))} Kg</p>
+                    </div>
+                </div>
+        </div>
+    </div>`;
+}
+
+function renderVerticalLane(state, id) {
+  let inner;
+  if (!state.open) {
+    inner = `<div class="d-flex align-items-center justify-content-center h-100 lane-closed-state" style="background-color: red; min-height: 100vh; transition: all 0.3s ease-in-out;">
+            <h1 class="text-warning fw-bold closed-text">Closed</h1>
+        </div>`;
+  } else if (!state.driver) {
+    inner = `<div class="d-flex align-items-center justify-content-center h-100 lane-open-state" style="background-color: #f0fff0; min-height: 100vh; transition: all 0.3s ease-in-out;">
+                <h1 class="text-dark fw-bold open-text">Open</h1>
+            </div>`;
+  } else {
+    const driver = state.driver;
+    const nickname = driver.nickname || "";
+    const photo = driver.mugshot
+      ? `<img src="${escapeHtml(driver.mugshot)}" alt="Driver Snapshot"
+                        class="rounded-circle driver-photo" style="object-fit: cover;">`
+      : "";
+    // Characters, as the length filter of the template counts them
+    const nameLength = [...nickname].length;
+    inner = `<div class="d-flex flex-column h-100 lane-info-state" style="background-color: #f0fff0; min-height: 100vh;">
+                <div class="text-center py-2 team-name-section" style="flex: 0 0 auto; min-height: 12vh;">
+                    <h1 class="text-primary team-name-text">${escapeHtml(driver.team_name)}</h1>
+                </div>
+                <div class="d-flex justify-content-center align-items-center px-2 team-number-section" style="flex: 1 1 auto; min-height: 40vh;">
+                    <span class="team-number-text fw-bold me-3">${escapeHtml(driver.team_number)}</span>
+                    ${photo}
+                </div>
+                <div class="d-flex flex-column align-items-center justify-content-start pt-2 driver-info-section" style="flex: 0 0 auto; min-height: 40vh;">
+                    <h1 class="text-dark driver-name-text mb-2" data-name-length="${nameLength}">${escapeHtml(nickname)}</h1>
+                    <h2 class="penalty-text" style="color: #DC0000;">Penalty: ${escapeHtml(lanePenalty(driver))} Kg</h2>
+                </div>
+            </div>`;
+  }
+  return `<div id="${id}" class="d-flex flex-column h-100 lane-content" style="min-height: 100vh; transition: all 0.3s ease-in-out;">
+    ${inner}
+</div>`;
+}
@@ -191,8 +191,56 @@ function addSystemMessage(message, tag) {
   }, 7000);
 }
 
+// Last lane state version shown, per lane number
+const laneVersions = {};
+
+function setLaneHtml(laneNumber, html) {
+  const el = document.getElementById(`lane-${laneNumber}`);
+  if (!el) return;
+  const cardBody = el.querySelector(".card-body");
+  (cardBody || el).innerHTML = html;
+}
+
+function applyLaneState(laneNumber, state) {
+  if (!state) {
+    fetchLaneDetail(laneNumber);
+    return;
+  }
+  if (!isNewerLaneState(laneVersions, laneNumber, state)) return;
+  try {
+    // Rendered as layout/changelane_small_detail.html, see lane-state.js
+    setLaneHtml(
+      laneNumber,
+      renderSmallLane(state, `lane-state-${state.lane}`),
+    );
+  } catch (error) {
+    console.error(`Could not render lane ${laneNumber} state:`, error);
+    fetchLaneDetail(laneNumber);
+  }
+}
+
 /**
- * Function to connect to lane sockets (Keep as is)
+ * Fallback: fetch the rendered lane from the server
+ */
+function fetchLaneDetail(laneNumber) {
+  fetch(`/pitlanedetail/${laneNumber}/`)
+    .then((response) => {
+      if (!response.ok)
+        throw new Error(`HTTP error! status: ${response.status}`);
+      return response.text();
+    })
+    .then((htmlData) => setLaneHtml(laneNumber, htmlData))
+    .catch((error) => {
+      console.error(`Failed to update lane ${laneNumber}:`, error);
+      setLaneHtml(
+        laneNumber,
+        `<div class="p-2 text-danger">Error loading Lane ${laneNumber}</div>`,
+      );
+    });
+}
+
+/**
+ * Function to connect to lane sockets
  */
 function connectToLaneSockets() {
   // ... (implementation from previous version, including window.lanesConnected check) ...
@@ -232,25 +280,18 @@ function connectToLaneSockets() {
           console.warn(`Lane element lane-${laneNumber} not found`);
           return;
         }
-        const laneSocketUrl = `${wsScheme}://${window.location.host}/ws/pitlanes/${laneNumber}/`;
+        // The lane state comes in the messages, the current one on connect
+        const laneSocketUrl = `${wsScheme}://${window.location.host}/ws/pitlanes/${laneNumber}/?format=state`;
         const laneSocket = createWebSocketWithReconnect(
           laneSocketUrl,
           (event) => {
             try {
               const data = JSON.parse(event.data);
-              if (data.type === "lane.update") {
-                  fetch(`/pitlanedetail/${laneNumber}/`)
-                  .then(response => {
-                      if (!response.ok) throw new Error(`HTTP error! status: ${response.status}`);
-                      return response.text();
-                  })
-                  .then(htmlData => {
-                      const el = document.getElementById(`lane-${laneNumber}`);
-                      if (el) el.innerHTML = htmlData;
-                  })
-                  .catch(error => {
-                      console.error(`Failed to update lane ${laneNumber}:`, error);
-                  })
+              if (data.type === "lane.state") {
+                if (data.current) delete laneVersions[laneNumber];
+                applyLaneState(laneNumber, data.lane);
+              } else if (data.type === "lane.update") {
+                fetchLaneDetail(laneNumber);
               }
             } catch (error) {
               console.error(
@@ -264,21 +305,6 @@ function connectToLaneSockets() {
           (event) => console.log(`WS closed lane ${laneNumber}`),
         );
         window.laneSocketsArray.push(laneSocket);
-        fetch(`/pitlanedetail/${laneNumber}/`)
-          .then((response) => {
-            if (!response.ok)
-              throw new Error(`HTTP error! status: ${response.status}`);
-            return response.text();
-          })
-          .then((htmlData) => {
-            const el = document.getElementById(`lane-${laneNumber}`);
-            if (el) el.innerHTML = htmlData;
-          })
-          .catch((error) => {
-            console.error(`Failed initial load lane ${laneNumber}:`, error);
-            if (laneElement)
-              laneElement.innerHTML = `<div class="p-2 text-danger">Error loading Lane ${laneNumber}</div>`;
-          });
       });
     })
     .catch((error) => {
@@ -1037,7 +1063,8 @@ function loadQueueState() {
       // Update penalty queue UI (status and buttons)
       updatePenaltyQueueUI({
         serving_team: data.serving_team,
-        queue_count: data.queue_count
+        queue_count: data.queue_count,
+        stations: data.stations
       });
     })
     .catch(error => {
@@ -1086,6 +1113,39 @@ function updatePenaltyQueueUI(data = null) {
       delayButton.disabled = true;
     }
   }
+
+  if (data && data.stations) {
+    updateStationStates(data.stations);
+  }
+}
+
+/**
+ * Show each registered Stop & Go station: offline, free or the team it serves
+ */
+function updateStationStates(stations) {
+  const stationStates = document.getElementById('stationStates');
+  if (!stationStates) return;
+
+  stationStates.innerHTML = '';
+  stations.forEach(station => {
+    const badge = document.createElement('span');
+    badge.className = 'badge me-1';
+    if (!station.online) {
+      badge.classList.add('bg-secondary');
+      badge.textContent = `${station.station}: offline`;
+    } else if (station.serving_team) {
+      badge.classList.add('bg-warning', 'text-dark');
+      badge.textContent = `${station.station}: ${station.serving_team}`;
+      badge.title = 'Mark served';
+      badge.style.cursor = 'pointer';
+      badge.addEventListener('click', () =>
+        handleStationServedClick(station.station, station.serving_team));
+    } else {
+      badge.classList.add('bg-success');
+      badge.textContent = `${station.station}: free`;
+    }
+    stationStates.appendChild(badge);
+  });
 }
 
 /**
@@ -1154,14 +1214,28 @@ function handleStopGoButtonClick() {
  */
 function handleServedButtonClick() {
   if (!currentQueueId || !currentRoundId) return;
-  
+  servePenalty({ penalty_id: currentRoundPenaltyId });
+}
+
+/**
+ * Mark served the penalty a station is serving, when several share the queue
+ */
+function handleStationServedClick(station, team) {
+  if (!currentRoundId) return;
+  if (!confirm(`Mark the penalty of team ${team} at station ${station} as served?`)) {
+    return;
+  }
+  servePenalty({ station: station });
+}
+
+function servePenalty(target) {
   fetch('/api/serve-penalty/', {
     method: 'POST',
     headers: {
       'Content-Type': 'application/json',
       'X-CSRFToken': getCookie('csrftoken')
     },
-    body: JSON.stringify({ round_id: currentRoundId })
+    body: JSON.stringify({ round_id: currentRoundId, ...target })
   })
   .then(response => response.json())
   .then(data => {
@@ -1334,6 +1408,15 @@ function handleStopAndGoMessage(data) {
       updateFenceButton();
       break;
       
+    case 'fence_breach':
+      // Fence breached during a penalty, maybe a while ago if the station was offline
+      addSystemMessage(
+        `Fence breached by team ${data.team}` +
+          (data.timestamp ? ` at ${new Date(data.timestamp).toLocaleTimeString()}` : ''),
+        'warning'
+      );
+      break;
+      
     case 'penalty_completed':
       // Penalty force completed
       resetStopAndGoForm();
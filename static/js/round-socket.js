@@ -0,0 +1,75 @@
+/**
+ * Round websocket with snapshot and sequence numbers.
+ *
+ * The server sends a full round snapshot on connect, then every event
+ * carries a sequence number. Events already covered by the snapshot are
+ * dropped; when a number is skipped the client asks for a new snapshot
+ * instead of reloading the page. The socket reconnects by itself and gets
+ * a fresh snapshot each time.
+ *
+ * handlers.onSnapshot(snapshot) and handlers.onEvent(data) are called
+ * with the parsed messages.
+ */
+function connectRoundSocket(roundId, handlers) {
+  const wsScheme = window.location.protocol === "https:" ? "wss" : "ws";
+  const url = `${wsScheme}://${window.location.host}/ws/round/${roundId}/`;
+  let socket;
+  let lastSeq = null;
+  let resyncing = false;
+  let reconnectDelay = 1000;
+
+  function resync() {
+    if (resyncing || !socket || socket.readyState !== WebSocket.OPEN) return;
+    resyncing = true;
+    socket.send(JSON.stringify({ type: "resync" }));
+  }
+
+  function handleMessage(e) {
+    const data = JSON.parse(e.data);
+    if (data.type === "round.snapshot") {
+      lastSeq = data.seq;
+      resyncing = false;
+      if (handlers.onSnapshot) handlers.onSnapshot(data);
+      return;
+    }
+    // Wait for the first snapshot, it includes this event
+    if (lastSeq === null || resyncing) return;
+    if (data.seq !== undefined && data.seq !== null) {
+      if (data.seq <= lastSeq) return;
+      if (data.seq > lastSeq + 1) {
+        console.warn(`Round events ${lastSeq + 1} to ${data.seq - 1} missed, resync`);
+        resync();
+        return;
+      }
+      lastSeq = data.seq;
+    }
+    if (handlers.onEvent) handlers.onEvent(data);
+  }
+
+  function connect() {
+    lastSeq = null;
+    resyncing = false;
+    socket = new WebSocket(url);
+    socket.onmessage = handleMessage;
+    socket.onopen = function () {
+      reconnectDelay = 1000;
+    };
+    socket.onclose = function (event) {
+      if (event.code === 1000) return;
+      console.warn(`Round socket closed, reconnecting in ${reconnectDelay / 1000}s`);
+      setTimeout(connect, reconnectDelay);
+      reconnectDelay = Math.min(reconnectDelay * 2, 30000);
+    };
+    socket.onerror = function (error) {
+      console.error("Round socket error:", error);
+    };
+  }
+
+  connect();
+  return {
+    resync: resync,
+    close: function () {
+      if (socket) socket.close(1000);
+    },
+  };
+}
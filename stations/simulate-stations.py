@@ -0,0 +1,166 @@
+#!/usr/bin/env python3
+"""
+Simulated stop and go stations sharing the penalty queue.
+
+Runs the StopAndGoStation of stopandgo-station.py with fake GPIO, relay and
+framebuffer, against a running race control server. A simulated driver
+presses the station button some seconds after the team number is shown.
+For each number of stations, a batch of penalties is queued at once through
+the race control API and the time each one waited, from being queued to
+being shown on a station, is reported.
+
+The round must be the current round, and have a Stop & Go penalty.
+"""
+import argparse
+import asyncio
+import logging
+import statistics
+import time
+import aiohttp
+from simulation import load_station_module, simulated_station_class
+
+
+async def queue_penalties(session, base_url, args, count):
+    """Queue count penalties, returns penalty id -> when it was queued"""
+    queued = {}
+    for n in range(count):
+        offender = args.teams[n % len(args.teams)]
+        async with session.post(
+            f"{base_url}/api/queue-penalty/",
+            json={
+                "round_id": args.round,
+                "offender_id": offender,
+                "championship_penalty_id": args.penalty,
+                "value": args.duration,
+            },
+        ) as response:
+            data = await response.json()
+        if not data.get("success"):
+            raise RuntimeError(f"Could not queue a penalty: {data.get('error')}")
+        queued[data["penalty_id"]] = time.monotonic()
+    return queued
+
+
+async def run_stations(module, base_url, ws_url, args, count):
+    station_class = simulated_station_class(module)
+    shown = {}
+    stations = [
+        station_class(
+            ws_url,
+            100 + 2 * n,
+            101 + 2 * n,
+            args.hmac_secret,
+            f"sim-{n + 1}",
+            script=f"button@{args.arrive}+0.3",
+            shown=shown,
+        )
+        for n in range(count)
+    ]
+    tasks = [asyncio.create_task(station.run()) for station in stations]
+    try:
+        # Let them connect and register
+        await asyncio.sleep(2)
+        async with aiohttp.ClientSession() as session:
+            queued = await queue_penalties(session, base_url, args, args.penalties)
+            deadline = time.monotonic() + args.timeout
+            while time.monotonic() < deadline:
+                async with session.get(
+                    f"{base_url}/api/round/{args.round}/penalty-queue-status/"
+                ) as response:
+                    status = await response.json()
+                if not status["queue_count"]:
+                    break
+                await asyncio.sleep(1)
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    waits = [shown[pid] - at for pid, at in queued.items() if pid in shown]
+    return waits, len(queued)
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(
+        description="Measure the stop and go queue wait with simulated stations"
+    )
+    parser.add_argument("-s", "--server", default="localhost", help="Server hostname")
+    parser.add_argument("-p", "--port", type=int, default=8000, help="Server port")
+    parser.add_argument(
+        "-r", "--round", type=int, required=True, help="Id of the current round"
+    )
+    parser.add_argument(
+        "-t",
+        "--teams",
+        required=True,
+        help="Comma separated ids of the round teams to penalise",
+    )
+    parser.add_argument(
+        "-P",
+        "--penalty",
+        type=int,
+        required=True,
+        help="Id of the championship Stop & Go penalty to queue",
+    )
+    parser.add_argument(
+        "-n",
+        "--stations",
+        default="1,2,3",
+        help="Numbers of stations to try (default: 1,2,3)",
+    )
+    parser.add_argument(
+        "--penalties", type=int, default=6, help="Penalties queued in each run"
+    )
+    parser.add_argument(
+        "--duration", type=int, default=3, help="Penalty duration, in seconds"
+    )
+    parser.add_argument(
+        "--arrive",
+        type=float,
+        default=2,
+        help="Seconds before the kart is at the station",
+    )
+    parser.add_argument(
+        "--timeout", type=float, default=300, help="Maximum length of a run"
+    )
+    parser.add_argument(
+        "-H",
+        "--hmac-secret",
+        default="race_control_hmac_key_2024",
+        help="HMAC secret key for message authentication",
+    )
+    parser.add_argument(
+        "-d", "--debug", action="store_true", help="Show the station logs"
+    )
+    args = parser.parse_args()
+    args.teams = [int(team) for team in args.teams.split(",")]
+    args.stations = [int(count) for count in args.stations.split(",")]
+    return args
+
+
+async def main():
+    args = parse_arguments()
+    logging.basicConfig(
+        level=logging.INFO if args.debug else logging.ERROR,
+        format="%(asctime)s - %(levelname)s - %(message)s",
+    )
+    base_url = f"http://{args.server}:{args.port}"
+    ws_url = f"ws://{args.server}:{args.port}/ws/stopandgo/"
+
+    module = load_station_module()
+    for count in args.stations:
+        waits, queued = await run_stations(module, base_url, ws_url, args, count)
+        if not waits:
+            print(f"{count} station(s): no penalty was shown")
+            continue
+        print(
+            f"{count} station(s): {len(waits)}/{queued} penalties shown, "
+            f"wait mean {statistics.mean(waits):.1f}s, "
+            f"max {max(waits):.1f}s"
+        )
+        # Let the stations drop off before the next run
+        await asyncio.sleep(2)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,249 @@
+"""
+Simulated hardware for stopandgo-station.py, to run the station code off
+the Raspberry Pi.
+
+FakeGPIO drives the button and fence inputs and calls the edge callbacks
+from a thread of its own, as RPi.GPIO does. FakeSMBus records what is
+written to the relay. FakeDisplay only remembers what would be shown, the
+station FileFramebufferDisplay draws into a regular file. VirtualClock runs
+the station time faster than real time: the countdowns, the retries and
+the scripted button and fence events.
+
+A script is a comma separated list of input@at+length: the input (button
+or fence) is active for length seconds, at seconds after the team number
+is shown. For instance "fence@1+0.5,button@3+0.3", the kart runs over the
+fence line then the marshal presses the button. Script times are station
+time.
+"""
+import asyncio
+import importlib.util
+import queue
+import sys
+import threading
+import time
+import types
+from collections import namedtuple
+from pathlib import Path
+
+
+class FakeGPIO(types.ModuleType):
+    """
+    RPi.GPIO stand-in: inputs are pulled up until the simulation drives them.
+    As with RPi.GPIO, edge callbacks are called from one thread of their own.
+    """
+
+    BOARD = "BOARD"
+    IN = "IN"
+    PUD_UP = "PUD_UP"
+    BOTH = "BOTH"
+
+    def __init__(self):
+        super().__init__("RPi.GPIO")
+        self.levels = {}
+        self.callbacks = {}
+        self.edges = queue.Queue()
+        self.thread = None
+
+    def setmode(self, mode):
+        pass
+
+    def setup(self, pin, direction, pull_up_down=None):
+        self.levels[pin] = 1
+
+    def input(self, pin):
+        return self.levels.get(pin, 1)
+
+    def add_event_detect(self, pin, edge, callback=None, bouncetime=None):
+        if pin in self.callbacks:
+            raise RuntimeError("Conflicting edge detection already enabled")
+        self.callbacks[pin] = callback
+        if self.thread is None:
+            self.thread = threading.Thread(target=self._callbacks, daemon=True)
+            self.thread.start()
+
+    def remove_event_detect(self, pin):
+        self.callbacks.pop(pin, None)
+
+    def drive(self, pin, level):
+        """Set the input level, as the button or the fence sensor would."""
+        if self.levels.get(pin, 1) != level:
+            self.levels[pin] = level
+            self.edges.put(pin)
+
+    def _callbacks(self):
+        while True:
+            pin = self.edges.get()
+            callback = self.callbacks.get(pin)
+            if callback is not None:
+                callback(pin)
+
+    def cleanup(self):
+        self.callbacks.clear()
+
+
+class FakeSMBus:
+    """smbus2_asyncio stand-in, it records the relay writes."""
+
+    def __init__(self, bus):
+        self.bus = bus
+        # (time, address, register, value)
+        self.writes = []
+
+    async def open(self):
+        pass
+
+    async def write_byte_data(self, address, register, value):
+        self.writes.append((time.monotonic(), address, register, value))
+
+
+class FakeDisplay:
+    """Framebuffer stand-in, it only remembers what would be shown."""
+
+    def __init__(self):
+        self.countdown_font = self.team_font = self.status_font = None
+        self.shown = None
+
+    def fill_screen(self, color):
+        self.shown = color
+
+    def render_text(self, text, bg_color, text_color, font=None):
+        pass
+
+    def display_text(self, text, bg_color, text_color, font=None):
+        self.shown = text
+
+    def display_status_text(self, text, bg_color=(0, 255, 0), text_color=(0, 0, 0)):
+        self.shown = text
+
+    def close(self):
+        pass
+
+
+class VirtualClock:
+    """
+    Station time, speed times faster than real time. Stands in for the
+    time module of the station, asleep for asyncio.sleep.
+    """
+
+    def __init__(self, speed=1.0):
+        self.speed = speed
+        self.origin = time.monotonic()
+        self.perf_origin = time.perf_counter()
+
+    def monotonic(self):
+        return self.origin + (time.monotonic() - self.origin) * self.speed
+
+    def perf_counter(self):
+        return self.perf_origin + (time.perf_counter() - self.perf_origin) * self.speed
+
+    async def asleep(self, delay, result=None):
+        return await asyncio.sleep(delay / self.speed, result)
+
+
+# One scripted input change: the input is active from at for length seconds
+Step = namedtuple("Step", "input at length")
+
+
+def parse_script(text):
+    steps = []
+    for item in text.split(","):
+        try:
+            name, timing = item.strip().split("@")
+            at, length = timing.split("+")
+            step = Step(name, float(at), float(length))
+        except ValueError:
+            raise ValueError(f"Invalid script step {item!r}, expected input@at+length")
+        if step.input not in ("button", "fence"):
+            raise ValueError(f"Unknown input {step.input!r}, button or fence")
+        steps.append(step)
+    return sorted(steps, key=lambda step: step.at)
+
+
+GPIO = FakeGPIO()
+
+
+def load_station_module(clock=None):
+    """
+    Import stopandgo-station.py with the hardware faked, and its time
+    driven by the clock if given.
+    """
+    rpi = types.ModuleType("RPi")
+    rpi.GPIO = GPIO
+    smbus = types.ModuleType("smbus2_asyncio")
+    smbus.SMBus2Asyncio = FakeSMBus
+    sys.modules.update({"RPi": rpi, "RPi.GPIO": GPIO, "smbus2_asyncio": smbus})
+
+    path = Path(__file__).with_name("stopandgo-station.py")
+    spec = importlib.util.spec_from_file_location("stopandgo_station", path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    module.FramebufferDisplay = FakeDisplay
+    if clock is not None:
+        module.time = types.SimpleNamespace(
+            monotonic=clock.monotonic,
+            perf_counter=clock.perf_counter,
+        )
+        clocked = types.ModuleType("asyncio")
+        clocked.__dict__.update(asyncio.__dict__)
+        clocked.sleep = clock.asleep
+        module.asyncio = clocked
+    return module
+
+
+def simulated_station_class(module):
+    class SimulatedStation(module.StopAndGoStation):
+        """
+        A station whose inputs follow the script for every penalty shown.
+        Records, in real time.monotonic, when each penalty was shown, when
+        penalty_served was first sent and acknowledged, and when the
+        station registered.
+        """
+
+        def __init__(self, *args, script="button@2+0.3", shown=None, **kwargs):
+            super().__init__(*args, **kwargs)
+            self.script = parse_script(script)
+            # penalty id -> when it was shown, shared by the stations
+            self.shown = shown if shown is not None else {}
+            # message id -> when penalty_served was first sent, acknowledged
+            self.served_sent = {}
+            self.served_acked = {}
+            self.registered = []
+
+        async def handle_penalty_command(self, data):
+            await super().handle_penalty_command(data)
+            self.shown.setdefault(data.get("penalty_id"), time.monotonic())
+            asyncio.create_task(self.driver())
+
+        async def handle_message(self, data):
+            if data.get("type") == "penalty_acknowledged":
+                self.served_acked.setdefault(data.get("message_id"), time.monotonic())
+            await super().handle_message(data)
+
+        async def send_message(self, message):
+            if message["response"] == "penalty_served":
+                self.served_sent.setdefault(message["message_id"], time.monotonic())
+            elif message["response"] == "register":
+                self.registered.append(time.monotonic())
+            await super().send_message(message)
+
+        def ack_latencies(self):
+            return [
+                self.served_acked[message_id] - sent
+                for message_id, sent in self.served_sent.items()
+                if message_id in self.served_acked
+            ]
+
+        async def driver(self):
+            """The kart comes in and the marshal presses the button."""
+            pins = {"button": self.button_pin, "fence": self.sensor_pin}
+            await asyncio.gather(
+                *(self.drive(pins[step.input], step) for step in self.script)
+            )
+
+        async def drive(self, pin, step):
+            await module.asyncio.sleep(step.at)
+            GPIO.drive(pin, 0)
+            await module.asyncio.sleep(step.length)
+            GPIO.drive(pin, 1)
+
+    return SimulatedStation
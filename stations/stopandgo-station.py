@@ -8,19 +8,54 @@ import logging
 import argparse
 import hmac
 import hashlib
+import random
+import socket
+import stat
 import time
+import threading
 import tomllib
+import types
+import uuid
+from collections import OrderedDict, namedtuple
 from datetime import datetime
 from pathlib import Path
+from array import array
 from PIL import Image, ImageDraw, ImageFont
 import aiohttp
 import RPi.GPIO as GPIO
 from smbus2_asyncio import SMBus2Asyncio
 
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
 # Default GPIO Pin definitions (will be overridden by command line args)
 DEFAULT_BUTTON_PIN = 18  # Physical pin 18 (GPIO24)
 DEFAULT_SENSOR_PIN = 24  # Physical pin 24 (GPIO8)
 
+# Input changes closer than this, in seconds, are contact bounce
+DEBOUNCE = 0.02
+# Input polling interval, in seconds, where edge detection is not available
+POLL_INTERVAL = 0.1
+
+# Outbound messages kept until delivered, the oldest are dropped beyond
+JOURNAL_SIZE = 256
+# Reconnection delay bounds, in seconds, doubling after each failure
+RECONNECT_MIN = 1
+RECONNECT_MAX = 60
+
+# Binary frames, the same format as race/frames.py on the server: header
+# (version, message type, sequence, timestamp in microseconds, payload
+# length), compact JSON payload, HMAC-SHA256 of both. Signed over the bytes
+# sent, rather than over a json.dumps the receiver has to reproduce.
+FRAME_PROTOCOL = "stopandgo.frame.1"
+FRAME_VERSION = 1
+FRAME_HEADER = struct.Struct("!BBIqI")
+FRAME_SIGNATURE_SIZE = hashlib.sha256().digest_size
+FRAME_TYPES = {"command": 1, "response": 2, "penalty_acknowledged": 3}
+FRAME_NAMES = {code: name for name, code in FRAME_TYPES.items()}
+
 # I2C settings
 I2C_BUS = 1
 RELAY_ADDRESS = 0x10  # Adjust based on your relay board
@@ -30,6 +65,60 @@ COUNTDOWN_FONT_SIZE = 400
 TEAM_FONT_SIZE = 400
 STATUS_FONT_SIZE = 200  # Smaller font for status messages
 
+# Memory for rendered frames, about 8 frames at 1920x1080
+FRAME_CACHE_BYTES = 64 * 1024 * 1024
+
+# A rendered frame: its pixels, its plain background color and the box
+# (left, top, right, bottom) drawn over it, None for a plain fill
+Frame = namedtuple("Frame", "data background box")
+
+# An input change: active is True for a pressed button or a breached fence,
+# at is the time.monotonic() of the edge
+Edge = namedtuple("Edge", "pin active at")
+
+
+def encode_frame(message, key):
+    """A message dict as a signed frame"""
+    payload = dict(message)
+    code = FRAME_TYPES[payload.pop("type")]
+    sequence = payload.pop("counter", 0)
+    timestamp = payload.pop("timestamp", None)
+    micros = 0
+    if timestamp:
+        micros = round(datetime.fromisoformat(timestamp).timestamp() * 1_000_000)
+    body = json.dumps(payload, separators=(",", ":")).encode("utf-8")
+    frame = FRAME_HEADER.pack(FRAME_VERSION, code, sequence, micros, len(body)) + body
+    return frame + hmac.new(key, frame, hashlib.sha256).digest()
+
+
+def decode_frame(frame, key):
+    """The message dict of a frame, None if malformed or wrongly signed"""
+    if len(frame) < FRAME_HEADER.size + FRAME_SIGNATURE_SIZE:
+        return None
+    signed, signature = frame[:-FRAME_SIGNATURE_SIZE], frame[-FRAME_SIGNATURE_SIZE:]
+    expected = hmac.new(key, signed, hashlib.sha256).digest()
+    if not hmac.compare_digest(expected, signature):
+        return None
+    version, code, sequence, micros, length = FRAME_HEADER.unpack_from(signed)
+    if version != FRAME_VERSION or code not in FRAME_NAMES:
+        return None
+    if len(signed) != FRAME_HEADER.size + length:
+        return None
+    try:
+        payload = json.loads(signed[FRAME_HEADER.size :])
+    except ValueError:
+        return None
+    if not isinstance(payload, dict):
+        return None
+    message = {**payload, "type": FRAME_NAMES[code]}
+    if sequence:
+        message["counter"] = sequence
+    if micros:
+        seconds, micros = divmod(micros, 1_000_000)
+        timestamp = datetime.fromtimestamp(seconds).replace(microsecond=micros)
+        message["timestamp"] = timestamp.isoformat()
+    return message
+
 
 class I2CRelay:
     def __init__(self, bus=I2C_BUS, address=RELAY_ADDRESS):
@@ -61,12 +150,206 @@ class I2CRelay:
         pass
 
 
+class EventJournal:
+    """
+    Outbound messages not delivered yet, in an append-only file of JSON
+    lines so that they survive a restart: a line with the message when it
+    is added, a {"done": message_id} line once it is delivered. When loaded,
+    and when everything was delivered, the file is rewritten with only the
+    pending messages. Without a path the journal is kept in memory only.
+    """
+
+    def __init__(self, path=None, size=JOURNAL_SIZE):
+        self.path = Path(path) if path else None
+        self.size = size
+        # message id -> message, oldest first
+        self.pending = OrderedDict()
+        if self.path is not None:
+            self.load()
+
+    def __len__(self):
+        return len(self.pending)
+
+    def load(self):
+        try:
+            lines = self.path.read_text().splitlines()
+        except FileNotFoundError:
+            lines = []
+        for line in lines:
+            try:
+                entry = json.loads(line)
+            except json.JSONDecodeError:
+                # Cut short by a power loss
+                logging.warning(f"Skipping damaged journal line: {line!r}")
+                continue
+            if "done" in entry:
+                self.pending.pop(entry["done"], None)
+            else:
+                self.pending[entry["message_id"]] = entry
+        self.trim()
+        self.rewrite()
+        if self.pending:
+            logging.info(f"{len(self.pending)} journaled messages to send")
+
+    def trim(self):
+        while len(self.pending) > self.size:
+            _, dropped = self.pending.popitem(last=False)
+            logging.warning(f"Journal full, dropping {dropped['response']} message")
+
+    def last_counter(self):
+        return max((m.get("counter", 0) for m in self.pending.values()), default=0)
+
+    def messages(self):
+        return list(self.pending.values())
+
+    def add(self, message):
+        self.pending[message["message_id"]] = message
+        self.trim()
+        self.append(message)
+
+    def done(self, message_id):
+        if self.pending.pop(message_id, None) is None:
+            return
+        if self.pending:
+            self.append({"done": message_id})
+        else:
+            self.rewrite()
+
+    def append(self, entry):
+        if self.path is None:
+            return
+        with open(self.path, "a") as f:
+            f.write(json.dumps(entry) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+
+    def rewrite(self):
+        if self.path is None:
+            return
+        new_path = self.path.with_name(self.path.name + ".new")
+        with open(new_path, "w") as f:
+            for message in self.pending.values():
+                f.write(json.dumps(message) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(new_path, self.path)
+
+
+class GPIOInputs:
+    """
+    Pulled up inputs, active low, reported as Edge in the events queue.
+
+    GPIO edge detection calls back from its own thread: the edge is
+    timestamped there and handed to the asyncio loop. An edge is reported
+    at once, unless it follows the previous change by less than DEBOUNCE;
+    DEBOUNCE after a change the input is read again and reported if it
+    settled the other way. An edge with the input already back to its
+    reported level was a change shorter than the callback, it is reported
+    too, and undone when the input is read again. Where edge detection
+    cannot be added, the input is polled.
+    """
+
+    def __init__(self, gpio, edges=True, debounce=DEBOUNCE):
+        self.gpio = gpio
+        self.edges = edges
+        self.debounce = debounce
+        self.loop = asyncio.get_running_loop()
+        self.events = asyncio.Queue()
+        # pin -> reported level, time of the change, pending settle check
+        self.levels = {}
+        self.changed = {}
+        self.settles = {}
+        self.polls = []
+
+    def watch(self, pin):
+        self.gpio.setup(pin, self.gpio.IN, pull_up_down=self.gpio.PUD_UP)
+        self.levels[pin] = self.gpio.input(pin)
+        self.changed[pin] = float("-inf")  # No change yet
+        if self.edges:
+            try:
+                self.gpio.add_event_detect(pin, self.gpio.BOTH, callback=self._edge)
+                return
+            except RuntimeError as e:
+                logging.warning(f"No edge detection on pin {pin} ({e}), polling it")
+        self.polls.append(self.loop.create_task(self._poll(pin)))
+
+    def active(self, pin):
+        return not self.levels[pin]
+
+    def _edge(self, pin):
+        # In the GPIO thread
+        at = time.monotonic()
+        level = self.gpio.input(pin)
+        self.loop.call_soon_threadsafe(self._deliver, pin, level, at)
+
+    async def _poll(self, pin):
+        while True:
+            level = self.gpio.input(pin)
+            if level != self.levels[pin]:
+                self._deliver(pin, level, time.monotonic())
+            await asyncio.sleep(POLL_INTERVAL)
+
+    def _deliver(self, pin, level, at):
+        if at - self.changed[pin] < self.debounce:
+            # Bounce, the settle check has the last word
+            if pin not in self.settles:
+                self.settles[pin] = self.loop.call_later(
+                    self.debounce, self._settle, pin
+                )
+            return
+        if level == self.levels[pin]:
+            level = int(not level)
+        self._report(pin, level, at)
+
+    def _settle(self, pin):
+        del self.settles[pin]
+        level = self.gpio.input(pin)
+        if level != self.levels[pin]:
+            self._report(pin, level, time.monotonic())
+
+    def _report(self, pin, level, at):
+        self.levels[pin] = level
+        self.changed[pin] = at
+        if pin in self.settles:
+            self.settles[pin].cancel()
+        self.settles[pin] = self.loop.call_later(self.debounce, self._settle, pin)
+        self.events.put_nowait(Edge(pin, not level, at))
+
+    def close(self):
+        for task in self.polls:
+            task.cancel()
+        for handle in self.settles.values():
+            handle.cancel()
+        self.settles.clear()
+        for pin in self.levels:
+            if self.edges:
+                try:
+                    self.gpio.remove_event_detect(pin)
+                except RuntimeError:
+                    pass
+
+
 class FramebufferDisplay:
-    def __init__(self):
-        self.fb_device = "/dev/fb0"
+    def __init__(self, fb_device="/dev/fb0"):
+        self.fb_device = fb_device
         self.get_screen_info()
         self.fb_fd = os.open(self.fb_device, os.O_RDWR)
         self.fb_map = mmap.mmap(self.fb_fd, self.screen_size)
+        # The screen pixels as a numpy array over the mmap, written in place
+        self.fb_array = None
+        if np is not None:
+            self.fb_array = np.frombuffer(self.fb_map, dtype=self.pixel_dtype)
+            self.fb_array = self.fb_array.reshape(self.frame_shape)
+        else:
+            logging.warning("NumPy not available, using slower conversion...")
+        # Rendered frames, least recently shown first
+        self.frames = OrderedDict()
+        self.frames_size = 0
+        # Frames are rendered ahead in a worker thread too, the lock guards
+        # the cache, not the rendering
+        self.frames_lock = threading.Lock()
+        # The frame on the screen, None when unknown
+        self.shown = None
 
         # Load fonts
         try:
@@ -85,18 +368,13 @@ class FramebufferDisplay:
             self.team_font = ImageFont.load_default()
             self.status_font = ImageFont.load_default()
 
-        # Measure display performance for timing compensation
-        self.display_time = self._measure_display_time()
-
     def get_screen_info(self):
+        sysfs = Path("/sys/class/graphics") / Path(self.fb_device).name
         # Try to detect from /sys/class/graphics/fb0/virtual_size first
         try:
-            with open("/sys/class/graphics/fb0/virtual_size", "r") as f:
-                size_str = f.read().strip()
-                width, height = map(int, size_str.split(","))
-                self.width = width
-                self.height = height
-                logging.info(f"Detected framebuffer size: {self.width}x{self.height}")
+            size_str = (sysfs / "virtual_size").read_text().strip()
+            self.width, self.height = map(int, size_str.split(","))
+            logging.info(f"Detected framebuffer size: {self.width}x{self.height}")
         except Exception as e:
             logging.warning(
                 f"Framebuffer size detection failed ({e}), using fallback resolution"
@@ -104,159 +382,346 @@ class FramebufferDisplay:
             self.width = 1920
             self.height = 1080
 
-        self.bpp = 32
+        try:
+            self.bpp = int((sysfs / "bits_per_pixel").read_text())
+        except Exception as e:
+            logging.warning(f"Framebuffer depth detection failed ({e}), using 32bpp")
+            self.bpp = 32
+        self.set_depth()
+
+    def set_depth(self):
+        if self.bpp == 16:
+            # RGB565, one 16 bits word per pixel
+            self.pixel_dtype = "<u2"
+            self.frame_shape = (self.height, self.width)
+        elif self.bpp == 32:
+            # BGRA bytes
+            self.pixel_dtype = "u1"
+            self.frame_shape = (self.height, self.width, 4)
+        else:
+            raise ValueError(f"Unsupported framebuffer depth: {self.bpp}bpp")
         self.screen_size = self.width * self.height * (self.bpp // 8)
 
-    def _measure_display_time(self):
-        """Measure how long it takes to generate and display a countdown number"""
-        logging.info("Measuring display performance...")
-
-        # Test with number "20" as a representative sample
-        start_time = time.perf_counter()
-        self.display_text("20", (255, 165, 0), (0, 0, 0))
-        end_time = time.perf_counter()
+    def cached_frame(self, key, render):
+        """The frame for key, rendered by render() unless it is cached"""
+        with self.frames_lock:
+            frame = self.frames.get(key)
+            if frame is not None:
+                self.frames.move_to_end(key)
+                return frame
+
+        # Not under the lock: the loop must not wait for a frame the worker
+        # thread is rendering ahead, it renders its own if need be
+        frame = render()
+        with self.frames_lock:
+            if key in self.frames:
+                return self.frames[key]
+            self.frames[key] = frame
+            self.frames_size += memoryview(frame.data).nbytes
+            while self.frames_size > FRAME_CACHE_BYTES and len(self.frames) > 1:
+                _, dropped = self.frames.popitem(last=False)
+                self.frames_size -= memoryview(dropped.data).nbytes
+        return frame
+
+    def blit(self, frame):
+        """
+        Show a frame. On the same background as the frame on the screen,
+        only the box covering what both drew over it is written.
+        """
+        shown, self.shown = self.shown, frame
+        if shown is None or shown.background != frame.background:
+            # Color scheme change, repaint everything
+            box = (0, 0, self.width, self.height)
+        else:
+            boxes = [b for b in (shown.box, frame.box) if b is not None]
+            if not boxes:
+                return
+            box = (
+                min(b[0] for b in boxes),
+                min(b[1] for b in boxes),
+                max(b[2] for b in boxes),
+                max(b[3] for b in boxes),
+            )
+        self.write_box(frame.data, box)
 
-        display_time = end_time - start_time
-        logging.info(f"Display time measured: {display_time:.4f} seconds")
-        return display_time
+    def write_box(self, data, box):
+        left, top, right, bottom = box
+        if self.fb_array is not None:
+            self.fb_array[top:bottom, left:right] = data[top:bottom, left:right]
+        else:
+            # Row by row, from the same offsets in the frame bytes
+            data = memoryview(data)
+            stride = self.width * self.bpp // 8
+            start = left * self.bpp // 8
+            end = right * self.bpp // 8
+            for row in range(top * stride, bottom * stride, stride):
+                self.fb_map[row + start : row + end] = data[row + start : row + end]
+        # Flush the pages written only
+        stride = self.width * self.bpp // 8
+        offset = top * stride // mmap.PAGESIZE * mmap.PAGESIZE
+        self.fb_map.flush(offset, bottom * stride - offset)
+
+    def pixel(self, color):
+        """The framebuffer value of an RGB color"""
+        r, g, b = color
+        if self.bpp == 16:
+            return ((r >> 3) << 11) | ((g >> 2) << 5) | (b >> 3)
+        return (b, g, r, 255)
 
     def fill_screen(self, color):
-        pixel = struct.pack("BBBB", color[2], color[1], color[0], 255)
-        data = pixel * (self.width * self.height)
-        self.fb_map.seek(0)
-        self.fb_map.write(data)
-        self.fb_map.flush()
+        def render():
+            pixel = self.pixel(color)
+            if self.fb_array is not None:
+                data = np.empty_like(self.fb_array)
+                data[...] = pixel
+            elif self.bpp == 16:
+                data = struct.pack("<H", pixel) * (self.width * self.height)
+            else:
+                data = struct.pack("BBBB", *pixel) * (self.width * self.height)
+            return Frame(data, color, None)
 
-    def display_text(self, text, bg_color, text_color, font=None):
+        self.blit(self.cached_frame(("fill", color), render))
+
+    def render_text(self, text, bg_color, text_color, font=None):
+        """
+        The frame showing text, from the cache when it was shown recently.
+        Call it ahead of time to have the next frame ready to blit.
+        """
         if font is None:
             font = self.countdown_font
 
-        img = Image.new("RGB", (self.width, self.height), bg_color)
-        draw = ImageDraw.Draw(img)
+        def render():
+            img = Image.new("RGB", (self.width, self.height), bg_color)
+            draw = ImageDraw.Draw(img)
+
+            bbox = draw.textbbox((0, 0), text, font=font)
+            text_width = bbox[2] - bbox[0]
+            text_height = bbox[3] - bbox[1]
+            x = (self.width - text_width) // 2
+            y = (self.height - text_height) // 2
+
+            draw.text((x, y), text, fill=text_color, font=font)
+            # What the text covers, with a margin for antialiasing
+            box = draw.textbbox((x, y), text, font=font)
+            box = (
+                max(0, box[0] - 2),
+                max(0, box[1] - 2),
+                min(self.width, box[2] + 2),
+                min(self.height, box[3] + 2),
+            )
+            return Frame(self.image_frame(img), bg_color, box)
 
-        bbox = draw.textbbox((0, 0), text, font=font)
-        text_width = bbox[2] - bbox[0]
-        text_height = bbox[3] - bbox[1]
-        x = (self.width - text_width) // 2
-        y = (self.height - text_height) // 2
+        return self.cached_frame((text, bg_color, text_color, id(font)), render)
 
-        draw.text((x, y), text, fill=text_color, font=font)
-        self.display_image(img)
+    def display_text(self, text, bg_color, text_color, font=None):
+        self.blit(self.render_text(text, bg_color, text_color, font))
 
     def display_image(self, img):
+        # Not a frame the next one can be compared with
+        self.shown = None
+        if self.fb_array is not None:
+            # Converted straight into the screen, no intermediate frame
+            self.image_frame(img, self.fb_array)
+            self.fb_map.flush()
+        else:
+            self.write_box(self.image_frame(img), (0, 0, self.width, self.height))
+
+    def image_frame(self, img, out=None):
+        """
+        Convert an image to a frame in the framebuffer format. With NumPy
+        the frame is an array, written into out when given.
+        """
         if img.size != (self.width, self.height):
             img = img.resize((self.width, self.height))
+        if img.mode != "RGB":
+            img = img.convert("RGB")
 
-        # Convert RGB to BGRA efficiently using numpy
-        try:
-            import numpy as np
-
-            # Convert PIL image to numpy array
-            rgb_array = np.array(img)
-
-            # Create BGRA array
-            bgra_array = np.zeros((self.height, self.width, 4), dtype=np.uint8)
-            bgra_array[:, :, 0] = rgb_array[:, :, 2]  # B
-            bgra_array[:, :, 1] = rgb_array[:, :, 1]  # G
-            bgra_array[:, :, 2] = rgb_array[:, :, 0]  # R
-            bgra_array[:, :, 3] = 255  # A
-
-            data = bgra_array.tobytes()
-
-        except ImportError:
+        if self.fb_array is None:
             # Fallback: use PIL's built-in conversion (slower but works)
-            logging.warning("NumPy not available, using slower conversion...")
-
-            # Convert to RGBA first, then swap channels
-            if img.mode != "RGBA":
-                img = img.convert("RGBA")
-
-            # Get raw pixel data
-            pixels = img.tobytes()
-
-            # Convert RGBA to BGRA
-            data = b""
-            for i in range(0, len(pixels), 4):
-                r, g, b, a = pixels[i : i + 4]
-                data += struct.pack("BBBB", b, g, r, 255)
-
-        self.fb_map.seek(0)
-        self.fb_map.write(data)
-        self.fb_map.flush()
+            if self.bpp == 16:
+                return array(
+                    "H",
+                    (
+                        ((r >> 3) << 11) | ((g >> 2) << 5) | (b >> 3)
+                        for r, g, b in img.getdata()
+                    ),
+                ).tobytes()
+            return img.convert("RGBA").tobytes("raw", "BGRA")
+
+        rgb = np.asarray(img)
+        if out is None:
+            out = np.empty_like(self.fb_array)
+        if self.bpp == 16:
+            np.left_shift(rgb[:, :, 0] >> 3, 11, out=out, dtype=out.dtype)
+            out |= (rgb[:, :, 1] >> 2).astype(out.dtype) << 5
+            out |= rgb[:, :, 2] >> 3
+        else:
+            out[:, :, 0] = rgb[:, :, 2]  # B
+            out[:, :, 1] = rgb[:, :, 1]  # G
+            out[:, :, 2] = rgb[:, :, 0]  # R
+            out[:, :, 3] = 255  # A
+        return out
 
     def display_status_text(self, text, bg_color=(0, 255, 0), text_color=(0, 0, 0)):
         """Display status message with smaller font"""
         self.display_text(text, bg_color, text_color, self.status_font)
 
     def close(self):
+        # The mmap cannot be closed while the array still points into it
+        self.fb_array = None
+        self.frames.clear()
         self.fb_map.close()
         os.close(self.fb_fd)
 
 
+class FileFramebufferDisplay(FramebufferDisplay):
+    """
+    A framebuffer in a regular file, to run and test the display off the Pi.
+    The file is created with the size of the screen.
+    """
+
+    def __init__(self, path, width=1920, height=1080, bpp=32):
+        self.width = width
+        self.height = height
+        self.bpp = bpp
+        super().__init__(path)
+
+    def get_screen_info(self):
+        self.set_depth()
+        with open(self.fb_device, "ab") as f:
+            f.truncate(self.screen_size)
+
+
+def open_display(path, bpp=32):
+    """The framebuffer device, or a file framebuffer of the given depth"""
+    if os.path.exists(path) and stat.S_ISCHR(os.stat(path).st_mode):
+        return FramebufferDisplay(path)
+    logging.info(f"{path} is not a framebuffer device, using it as a file")
+    return FileFramebufferDisplay(path, bpp=bpp)
+
+
 class StopAndGoStation:
-    def __init__(self, websocket_url, button_pin, sensor_pin, hmac_secret):
+    def __init__(
+        self,
+        websocket_url,
+        button_pin,
+        sensor_pin,
+        hmac_secret,
+        station_id=None,
+        display=None,
+        journal=None,
+        frames=True,
+    ):
         self.websocket_url = websocket_url
+        self.station_id = station_id  # Stations sharing the queue register with it
         self.button_pin = button_pin
         self.sensor_pin = sensor_pin
         self.hmac_secret = hmac_secret.encode("utf-8")  # Convert to bytes
-        self.display = FramebufferDisplay()
+        self.display = display or FramebufferDisplay()
         self.relay = I2CRelay()
         self.current_team = None
         self.current_duration = None
+        self.current_penalty_id = None
         self.last_team = None  # Track team for acknowledgment handling
         self.state = "idle"  # idle, wait_countdown, countdown, breached, green, button_pressed, fence_breach
         self.countdown_task = None
         self.websocket = None
+        self.frames = frames  # Ask the server for binary frames
+        self.framed = False  # The server accepted them
         self.penalty_ack_received = False
         self.connected = False
         self.fence_enabled = True  # Default: fence function enabled
         self.green_screen_task = None
         self.breach_state = False  # Current fence breach status
         self.penalty_ok_task = None  # Track penalty_served sending task
+        self.countdown_drift = None  # How late the last countdown showed 0, in seconds
+        # Messages to send again after a disconnection or a restart
+        self.journal = EventJournal(journal)
+        # Numbers the messages sent, for replay detection. The server keeps
+        # the highest counter of the station across connections: start from
+        # the clock, above the previous runs, unless journaled messages are
+        # still to be sent with theirs
+        self.message_counter = self.journal.last_counter() or int(time.time())
+        self.inputs = None  # Button and fence edges, set up when running
 
         # Setup GPIO
         GPIO.setmode(GPIO.BOARD)  # Use physical pin numbers
-        GPIO.setup(self.button_pin, GPIO.IN, pull_up_down=GPIO.PUD_UP)
-        GPIO.setup(self.sensor_pin, GPIO.IN, pull_up_down=GPIO.PUD_UP)
 
         # Initial state - show connecting
-        self.display.display_status_text("Connecting", (255, 255, 0), (0, 0, 0))
+        self.show_status()
+
+    def show_status(self):
+        """The idle screen, with the number of messages waiting to be sent"""
+        pending = f" ({len(self.journal)})" if len(self.journal) else ""
+        if self.connected:
+            self.display.display_status_text(f"Race Mode{pending}")
+        else:
+            self.display.display_status_text(
+                f"Connecting{pending}", (255, 255, 0), (0, 0, 0)
+            )
 
     async def websocket_handler(self):
+        failures = 0
         while True:
             try:
                 async with aiohttp.ClientSession() as session:
-                    async with session.ws_connect(self.websocket_url) as ws:
+                    async with session.ws_connect(
+                        self.websocket_url,
+                        protocols=(FRAME_PROTOCOL,) if self.frames else (),
+                    ) as ws:
                         self.websocket = ws
                         self.connected = True
-                        logging.info("WebSocket connected")
+                        # Servers without frames keep to JSON
+                        self.framed = ws.protocol == FRAME_PROTOCOL
+                        failures = 0
+                        logging.info(
+                            f"WebSocket connected, {'frames' if self.framed else 'JSON'}"
+                        )
+
+                        # What could not be sent, in order, as first sent
+                        for message in self.journal.messages():
+                            await self.send_message(message)
+
+                        # Register, to be sent the penalties of this station
+                        if self.station_id:
+                            await self.send_response(
+                                "register", {"station": self.station_id}
+                            )
 
                         # Show race mode screen when connected
                         if self.state == "idle":
-                            self.display.display_status_text("Race Mode")
+                            self.show_status()
 
                         async for msg in ws:
                             if msg.type == aiohttp.WSMsgType.TEXT:
                                 try:
                                     data = json.loads(msg.data)
-                                    await self.handle_message(data)
+                                    await self.handle_json(data)
                                 except json.JSONDecodeError:
                                     logging.error("Invalid JSON received")
+                            elif msg.type == aiohttp.WSMsgType.BINARY:
+                                data = decode_frame(msg.data, self.hmac_secret)
+                                if data is None:
+                                    logging.warning("Invalid frame - rejecting message")
+                                else:
+                                    await self.handle_message(data)
                             elif msg.type == aiohttp.WSMsgType.ERROR:
                                 logging.error(f"WebSocket error: {ws.exception()}")
                                 break
             except Exception as e:
                 logging.error(f"WebSocket connection failed: {e}")
-                self.websocket = None
-                self.connected = False
+            self.websocket = None
+            self.connected = False
 
-                # Show connecting screen when disconnected
-                if self.state == "idle":
-                    self.display.display_status_text(
-                        "Connecting", (255, 255, 0), (0, 0, 0)
-                    )
+            # Show connecting screen when disconnected
+            if self.state == "idle":
+                self.show_status()
 
-                await asyncio.sleep(5)  # Wait before reconnecting
+            # Wait before reconnecting, longer after each failure, at random
+            # so that the stations do not all come back at once
+            delay = min(RECONNECT_MAX, RECONNECT_MIN * 2**failures)
+            failures += 1
+            await asyncio.sleep(random.uniform(delay / 2, delay))
 
     def verify_hmac(self, message_data, provided_signature):
         """Verify HMAC signature for incoming message"""
@@ -280,7 +745,7 @@ class StopAndGoStation:
         message_data["hmac_signature"] = signature
         return message_data
 
-    async def handle_message(self, data):
+    async def handle_json(self, data):
         # Verify HMAC signature for all incoming messages
         provided_signature = data.pop("hmac_signature", None)
         if not provided_signature:
@@ -294,9 +759,17 @@ class StopAndGoStation:
         logging.debug(
             f"HMAC verification successful for {data}"
         )  # Use debug to reduce log spam
+        await self.handle_message(data)
 
+    async def handle_message(self, data):
+        """A message with a valid signature, framed or JSON"""
         # Handle penalty acknowledgment messages (not command type)
         if data.get("type") == "penalty_acknowledged" and "team" in data:
+            # penalty_served was delivered, maybe sent before a restart
+            if data.get("message_id"):
+                self.journal.done(data["message_id"])
+                if self.state == "idle":
+                    self.show_status()
             if data["team"] == self.last_team:
                 self.penalty_ack_received = True
                 logging.info(
@@ -328,6 +801,9 @@ class StopAndGoStation:
             logging.info(
                 f"Fence function {'enabled' if self.fence_enabled else 'disabled'}"
             )
+            # No edge comes for a fence already breached
+            if self.inputs:
+                await self.fence_changed(self.inputs.active(self.sensor_pin))
             # Send response
             await self.send_response("fence_status", {"enabled": self.fence_enabled})
 
@@ -351,35 +827,66 @@ class StopAndGoStation:
             )
             await self.reset_to_idle()
 
-    async def send_response(self, response_type, data):
-        """Send a response message via websocket with HMAC signature"""
+    def new_response(self, response_type, data):
+        """Build a response message with a unique id and the next counter"""
+        self.message_counter += 1
+        return {
+            "type": "response",
+            "response": response_type,
+            "message_id": uuid.uuid4().hex,
+            "counter": self.message_counter,
+            "timestamp": datetime.now().isoformat(),
+            **data,
+        }
+
+    async def send_message(self, message):
+        """Send a message via websocket with HMAC signature"""
         if self.websocket:
             try:
-                message = {
-                    "type": "response",
-                    "response": response_type,
-                    "timestamp": datetime.now().isoformat(),
-                    **data,
-                }
-                # Sign the message
-                signed_message = self.sign_message(message)
-                await self.websocket.send_str(json.dumps(signed_message))
-                logging.info(f"Sent signed response: {response_type}")
+                if self.framed:
+                    await self.websocket.send_bytes(
+                        encode_frame(message, self.hmac_secret)
+                    )
+                else:
+                    # Sign a copy, the message may be sent again
+                    signed_message = self.sign_message(dict(message))
+                    await self.websocket.send_str(json.dumps(signed_message))
+                logging.info(f"Sent signed response: {message['response']}")
+                # penalty_served is delivered once acknowledged
+                if message["response"] != "penalty_served":
+                    self.journal.done(message["message_id"])
             except Exception as e:
                 logging.error(f"Failed to send response: {e}")
 
+    async def send_response(self, response_type, data):
+        """Send a response message via websocket with HMAC signature"""
+        message = self.new_response(response_type, data)
+        # A registration is only for the current connection
+        if response_type != "register":
+            self.journal.add(message)
+        await self.send_message(message)
+
     async def send_penalty_ok(self):
         """Send penalty ok message every 5 seconds until acknowledged"""
         # Set last_team when sending penalty served
         self.last_team = self.current_team
+        data = {"team": self.last_team}
+        if self.current_penalty_id is not None:
+            data["penalty_id"] = self.current_penalty_id
+        if self.countdown_drift is not None:
+            data["drift"] = round(self.countdown_drift, 4)
+        # Retries are the same message, the server handles it once
+        message = self.new_response("penalty_served", data)
+        self.journal.add(message)
         while not self.penalty_ack_received:
-            await self.send_response("penalty_served", {"team": self.last_team})
+            await self.send_message(message)
             await asyncio.sleep(5)
 
     async def handle_penalty_command(self, data):
         if "team" in data and "duration" in data:
             self.current_team = data["team"]
             self.current_duration = data["duration"]
+            self.current_penalty_id = data.get("penalty_id")
             self.state = "wait_countdown"
             self.penalty_ack_received = False  # Reset for new race
 
@@ -388,90 +895,98 @@ class StopAndGoStation:
             self.display.display_text(
                 str(self.current_team), (255, 165, 0), (0, 0, 0), self.display.team_font
             )
+            # Have the first countdown frame ready for the button press
+            await self.render_ahead(
+                str(self.current_duration), (255, 165, 0), (0, 0, 0)
+            )
             logging.info(
                 f"Penalty required for team {self.current_team}, duration {self.current_duration}s"
             )
 
-    async def button_monitor(self):
-        last_button_state = False
+    async def input_monitor(self):
         while True:
-            current_button_state = not GPIO.input(
-                self.button_pin
-            )  # Inverted because pull-up
-
-            # Detect button press (transition from not pressed to pressed)
-            if current_button_state and not last_button_state:
-                if self.state == "wait_countdown" or (
-                    self.state == "breached" and not self.breach_state
-                ):
-                    # Button pressed in wait_countdown or breached with fence clear -> start countdown
-                    if self.countdown_task and not self.countdown_task.done():
-                        self.countdown_task.cancel()
-                    self.state = "countdown"
-                    await self.start_countdown()
-                    if self.state == "breached":
-                        logging.info(
-                            "Button pressed with fence clear - restarting countdown"
-                        )
-                elif self.state == "countdown":
-                    # Button pressed during countdown -> do nothing
-                    pass
-                elif self.state == "breached":
-                    # Button pressed during breached state but fence still breached
-                    logging.info("Button pressed but fence still breached - ignoring")
-                elif self.state == "idle" and self.connected:
-                    # Button pressed when no stop and go is active
-                    await self.show_button_pressed()
-                elif self.state == "green":
-                    # Button pressed during green screen - reset to race mode immediately
-                    await self.reset_to_idle()
-
-            last_button_state = current_button_state
-            await asyncio.sleep(0.1)
-
-    async def sensor_monitor(self):
-        while True:
-            # Only monitor sensor if fence function is enabled
-            if self.fence_enabled:
-                current_breach = not GPIO.input(
-                    self.sensor_pin
-                )  # Inverted because pull-up
-
-                # Update breach state when it changes
-                if current_breach != self.breach_state:
-                    self.breach_state = current_breach
-
-                    if current_breach:  # Fence just got breached
-                        if self.state == "wait_countdown":
-                            # Go to breached state and redraw with breach colors
-                            self.state = "breached"
-                            self.display.display_text(
-                                str(self.current_team),
-                                (255, 0, 0),
-                                (255, 255, 0),
-                                self.display.team_font,
-                            )
-                            logging.info(
-                                "Fence breached during wait_countdown - going to breached state"
-                            )
-                        elif self.state == "countdown":
-                            # Go to breached state, continue countdown with different colors
-                            self.state = "breached"
-                            logging.info(
-                                "Fence breached during countdown - going to breached state, continuing countdown"
-                            )
-                        elif self.state == "idle" and self.connected:
-                            # Fence breached when no stop and go is active
-                            await self.show_fence_breach()
-                    else:  # Fence just cleared
-                        if self.state == "green" and self.penalty_ack_received:
-                            # Green screen and penalty acknowledged - can reset
-                            await self.reset_to_idle()
-            else:
-                # If fence is disabled, clear breach state
-                self.breach_state = False
+            edge = await self.inputs.events.get()
+            logging.debug(
+                f"Pin {edge.pin} {'active' if edge.active else 'inactive'}, "
+                f"handled {(time.monotonic() - edge.at) * 1000:.1f}ms after the edge"
+            )
+            if edge.pin == self.button_pin:
+                if edge.active:
+                    await self.button_pressed()
+            elif edge.pin == self.sensor_pin:
+                await self.fence_changed(edge.active)
+
+    async def button_pressed(self):
+        if self.state == "wait_countdown" or (
+            self.state == "breached" and not self.breach_state
+        ):
+            # Button pressed in wait_countdown or breached with fence clear -> start countdown
+            if self.countdown_task and not self.countdown_task.done():
+                self.countdown_task.cancel()
+            self.state = "countdown"
+            await self.start_countdown()
+            if self.state == "breached":
+                logging.info("Button pressed with fence clear - restarting countdown")
+        elif self.state == "countdown":
+            # Button pressed during countdown -> do nothing
+            pass
+        elif self.state == "breached":
+            # Button pressed during breached state but fence still breached
+            logging.info("Button pressed but fence still breached - ignoring")
+        elif self.state == "idle" and self.connected:
+            # Button pressed when no stop and go is active
+            await self.show_button_pressed()
+        elif self.state == "green":
+            # Button pressed during green screen - reset to race mode immediately
+            await self.reset_to_idle()
 
-            await asyncio.sleep(0.1)
+    async def fence_changed(self, current_breach):
+        # Only monitor sensor if fence function is enabled
+        if not self.fence_enabled:
+            # If fence is disabled, clear breach state
+            self.breach_state = False
+            return
+
+        # Update breach state when it changes
+        if current_breach == self.breach_state:
+            return
+        self.breach_state = current_breach
+
+        if current_breach:  # Fence just got breached
+            if self.state == "wait_countdown":
+                # Go to breached state and redraw with breach colors
+                self.state = "breached"
+                self.display.display_text(
+                    str(self.current_team),
+                    (255, 0, 0),
+                    (255, 255, 0),
+                    self.display.team_font,
+                )
+                logging.info(
+                    "Fence breached during wait_countdown - going to breached state"
+                )
+                await self.send_breach()
+            elif self.state == "countdown":
+                # Go to breached state, continue countdown with different colors
+                self.state = "breached"
+                logging.info(
+                    "Fence breached during countdown - going to breached state, continuing countdown"
+                )
+                await self.send_breach()
+            elif self.state == "idle" and self.connected:
+                # Fence breached when no stop and go is active
+                await self.show_fence_breach()
+        else:  # Fence just cleared
+            if self.state == "green" and self.penalty_ack_received:
+                # Green screen and penalty acknowledged - can reset
+                await self.reset_to_idle()
+
+    async def send_breach(self):
+        """Report a fence breach during a penalty to race control"""
+        data = {"team": self.current_team}
+        if self.current_penalty_id is not None:
+            data["penalty_id"] = self.current_penalty_id
+        await self.send_response("fence_breach", data)
 
     async def handle_sensor_triggered(self):
         if self.countdown_task:
@@ -497,16 +1012,32 @@ class StopAndGoStation:
         # Start countdown task but don't await it
         self.countdown_task = asyncio.create_task(self.countdown())
 
+    async def render_ahead(self, text, bg_color, text_color):
+        """
+        Render a frame before it is shown, in a worker thread: it takes tens
+        of milliseconds, the GPIO edges and the server messages must not wait.
+        """
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(
+            None, self.display.render_text, text, bg_color, text_color
+        )
+
     async def countdown(self):
+        # Each number is due a whole number of seconds after the start,
+        # however long the previous ones took to show
+        self.countdown_drift = None
+        start = time.monotonic()
         for i in range(
             self.current_duration, -1, -1
         ):  # Go down to 0 instead of stopping at 1
+            deadline = start + self.current_duration - i
+            delay = deadline - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+
             if self.state not in ["countdown", "breached"]:
                 return
 
-            # Display the number and measure actual time taken
-            start_time = time.perf_counter()
-
             # Choose colors based on FSM state
             if self.state == "breached":
                 # Yellow text on red background when in breached state
@@ -518,12 +1049,16 @@ class StopAndGoStation:
                 text_color = (0, 0, 0)
 
             self.display.display_text(str(i), bg_color, text_color)
-            display_time = time.perf_counter() - start_time
-
-            # Don't sleep after displaying 0
+            late = time.monotonic() - deadline
+            if late > 0.1:
+                logging.warning(f"Countdown {i} shown {late * 1000:.0f}ms late")
+            # Render the next number now, it is then only copied to the screen
             if i > 0:
-                sleep_time = max(0, 1.0 - display_time)
-                await asyncio.sleep(sleep_time)
+                await self.render_ahead(str(i - 1), bg_color, text_color)
+
+        # How much longer than its duration the stop lasted
+        self.countdown_drift = late
+        logging.info(f"Countdown drift: {late * 1000:.1f}ms")
 
         # Countdown finished - check FSM state
         if self.state == "breached":
@@ -549,6 +1084,8 @@ class StopAndGoStation:
         self.state = "idle"
         self.current_team = None
         self.current_duration = None
+        self.current_penalty_id = None
+        self.countdown_drift = None
         self.last_team = None  # Reset last_team
         self.penalty_ack_received = False  # Reset for next penalty
         await self.relay.turn_off()
@@ -568,10 +1105,7 @@ class StopAndGoStation:
             self.countdown_task.cancel()
 
         # Show appropriate idle screen based on connection status
-        if self.connected:
-            self.display.display_status_text("Race Mode")
-        else:
-            self.display.display_status_text("Connecting", (255, 255, 0), (0, 0, 0))
+        self.show_status()
 
         logging.info("Reset to idle state")
 
@@ -613,11 +1147,13 @@ class StopAndGoStation:
         except asyncio.CancelledError:
             pass
 
-    async def run(self):
+    async def run(self, edges=True):
+        self.inputs = GPIOInputs(GPIO, edges)
+        self.inputs.watch(self.button_pin)
+        self.inputs.watch(self.sensor_pin)
         tasks = [
             asyncio.create_task(self.websocket_handler()),
-            asyncio.create_task(self.button_monitor()),
-            asyncio.create_task(self.sensor_monitor()),
+            asyncio.create_task(self.input_monitor()),
         ]
 
         try:
@@ -652,10 +1188,110 @@ class StopAndGoStation:
                 pass
             self.display.close()
             self.relay.close()
+            self.inputs.close()
             GPIO.cleanup()
             logging.info("Shutdown complete")
 
 
+def benchmark_display(display, frames=20):
+    """Print the time taken to show countdown frames, rendered and cached"""
+
+    def report(label, times):
+        times = sorted(t * 1000 for t in times)
+        print(
+            f"{label}: mean {sum(times) / len(times):.1f}ms, "
+            f"p95 {times[int(len(times) * 0.95)]:.1f}ms, max {times[-1]:.1f}ms"
+        )
+
+    colors = ((255, 165, 0), (0, 0, 0))
+    rendered = []
+    for i in range(frames, 0, -1):
+        display.frames.clear()
+        display.frames_size = 0
+        start_time = time.perf_counter()
+        display.display_text(str(i), *colors)
+        rendered.append(time.perf_counter() - start_time)
+
+    repainted = []
+    for i in range(frames, 0, -1):
+        # Rendered ahead, as the countdown does while it waits
+        display.render_text(str(i), *colors)
+        display.shown = None
+        start_time = time.perf_counter()
+        display.display_text(str(i), *colors)
+        repainted.append(time.perf_counter() - start_time)
+
+    changed = []
+    for i in range(frames, 0, -1):
+        display.render_text(str(i), *colors)
+        start_time = time.perf_counter()
+        display.display_text(str(i), *colors)
+        changed.append(time.perf_counter() - start_time)
+
+    print(f"{display.width}x{display.height}, {frames} frames")
+    report("Rendered on display", rendered)
+    report("Rendered ahead, full repaint", repainted)
+    report("Rendered ahead, changed box only", changed)
+
+
+def benchmark_messages(key, count=5000):
+    """Print the time taken to sign and check messages, in JSON and in frames"""
+    served = {
+        "type": "response",
+        "response": "penalty_served",
+        "message_id": uuid.uuid4().hex,
+        "counter": 42,
+        "timestamp": datetime.now().isoformat(),
+        "team": 17,
+        "penalty_id": 1234,
+        "drift": 0.0123,
+    }
+    required = {
+        "type": "command",
+        "command": "penalty_required",
+        "team": 17,
+        "duration": 20,
+        "penalty_id": 1234,
+        "timestamp": datetime.now().isoformat(),
+    }
+    # The station methods, without a station
+    station = types.SimpleNamespace(hmac_secret=key)
+
+    def json_sign(message):
+        signed = StopAndGoStation.sign_message(station, dict(message))
+        return json.dumps(signed)
+
+    def json_check(text):
+        data = json.loads(text)
+        signature = data.pop("hmac_signature")
+        assert StopAndGoStation.verify_hmac(station, data, signature)
+        return data
+
+    def frame_check(frame):
+        data = decode_frame(frame, key)
+        assert data is not None
+        return data
+
+    def report(label, function, argument):
+        start_time = time.perf_counter()
+        for _ in range(count):
+            function(argument)
+        elapsed = time.perf_counter() - start_time
+        print(
+            f"{label}: {elapsed / count * 1_000_000:.1f}us, "
+            f"{count / elapsed:.0f} messages/s"
+        )
+
+    for label, message in (("penalty_served", served), ("penalty_required", required)):
+        text = json_sign(message)
+        frame = encode_frame(message, key)
+        print(f"{label}: JSON {len(text)} bytes, frame {len(frame)} bytes")
+        report("  JSON sign", json_sign, message)
+        report("  JSON check", json_check, text)
+        report("  Frame encode", lambda m: encode_frame(m, key), message)
+        report("  Frame decode", frame_check, frame)
+
+
 def load_config(config_path):
     """Load configuration from TOML file"""
     try:
@@ -705,6 +1341,50 @@ def parse_arguments():
         type=int,
         help=f"Physical fence sensor pin number (default: {DEFAULT_SENSOR_PIN})",
     )
+    parser.add_argument(
+        "-I",
+        "--station-id",
+        help="Station identifier, each station sharing the penalty queue needs its own (default: host name)",
+    )
+    parser.add_argument(
+        "-F",
+        "--framebuffer",
+        help="Framebuffer device, or a file to use as one (default: /dev/fb0)",
+    )
+    parser.add_argument(
+        "--bpp",
+        type=int,
+        choices=(16, 32),
+        help="Depth of a file framebuffer (default: 32)",
+    )
+    parser.add_argument(
+        "-J",
+        "--journal",
+        help="File keeping the messages to send again after a disconnection "
+        "or a restart (default: ~/.stopandgo-journal)",
+    )
+    parser.add_argument(
+        "--poll",
+        action="store_true",
+        help="Poll the button and fence inputs instead of using edge detection",
+    )
+    parser.add_argument(
+        "--no-frames",
+        dest="frames",
+        action="store_const",
+        const=False,
+        help="Send and receive signed JSON messages, not binary frames",
+    )
+    parser.add_argument(
+        "--benchmark",
+        action="store_true",
+        help="Measure the time taken to show countdown frames, then exit",
+    )
+    parser.add_argument(
+        "--benchmark-messages",
+        action="store_true",
+        help="Measure the time taken to sign and check messages, then exit",
+    )
     parser.add_argument(
         "-d", "--debug", action="store_true", help="Set log level to DEBUG"
     )
@@ -734,6 +1414,12 @@ def parse_arguments():
         "debug": False,
         "info": False,
         "hmac_secret": "race_control_hmac_key_2024",
+        "station_id": socket.gethostname(),
+        "framebuffer": "/dev/fb0",
+        "bpp": 32,
+        "poll": False,
+        "frames": True,
+        "journal": str(Path.home() / ".stopandgo-journal"),
     }
 
     # Apply config file values, then command line overrides
@@ -764,15 +1450,38 @@ async def main():
         level=log_level, format="%(asctime)s - %(levelname)s - %(message)s"
     )
 
+    if args.benchmark:
+        display = open_display(args.framebuffer, args.bpp)
+        try:
+            benchmark_display(display)
+        finally:
+            display.close()
+        return
+
+    if args.benchmark_messages:
+        benchmark_messages(args.hmac_secret.encode("utf-8"))
+        return
+
     # Build WebSocket URL from arguments
     # Use secure WebSocket if --secure flag is provided or port is 443
     schema = "wss" if args.secure or args.port == 443 else "ws"
     websocket_url = f"{schema}://{args.server}:{args.port}/ws/stopandgo/"
     logging.info(f"Connecting to: {websocket_url}")
     logging.info(f"Button pin: {args.button}, Fence sensor pin: {args.fence}")
-
-    station = StopAndGoStation(websocket_url, args.button, args.fence, args.hmac_secret)
-    await station.run()
+    logging.info(f"Station id: {args.station_id}")
+    logging.info(f"Journal: {args.journal}")
+
+    station = StopAndGoStation(
+        websocket_url,
+        args.button,
+        args.fence,
+        args.hmac_secret,
+        args.station_id,
+        open_display(args.framebuffer, args.bpp),
+        args.journal,
+        args.frames,
+    )
+    await station.run(edges=not args.poll)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,241 @@
+"""
+Tests of the station code, off the Raspberry Pi, with the simulated
+hardware of simulation.py. From this directory:
+
+    python -m unittest
+"""
+import asyncio
+import importlib.util
+import struct
+import tempfile
+import time
+import unittest
+from pathlib import Path
+from unittest import mock
+from PIL import Image
+from simulation import FakeGPIO, load_station_module
+
+station = load_station_module()
+
+SERVER_FRAMES = Path(__file__).resolve().parent.parent / "race" / "frames.py"
+
+WIDTH, HEIGHT = 8, 4
+PIN = 100
+
+
+def rgb565(color):
+    r, g, b = color
+    return struct.pack("<H", ((r >> 3) << 11) | ((g >> 2) << 5) | (b >> 3))
+
+
+def bgra(color):
+    r, g, b = color
+    return bytes((b, g, r, 255))
+
+
+class FramebufferTest(unittest.TestCase):
+    """What the display writes into a file framebuffer, pixel by pixel."""
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = Path(directory.name) / "fb"
+
+    def display(self, bpp):
+        display = station.FileFramebufferDisplay(self.path, WIDTH, HEIGHT, bpp)
+        self.addCleanup(display.close)
+        return display
+
+    def pixels(self, bpp):
+        """The framebuffer file as rows of pixel bytes"""
+        data = self.path.read_bytes()
+        size = bpp // 8
+        self.assertEqual(len(data), WIDTH * HEIGHT * size)
+        return [
+            [data[(y * WIDTH + x) * size :][:size] for x in range(WIDTH)]
+            for y in range(HEIGHT)
+        ]
+
+    def check_depths(self, test):
+        """Run test for each depth, with and without NumPy"""
+        for bpp, pixel in ((16, rgb565), (32, bgra)):
+            for numpy in (True, False):
+                with self.subTest(bpp=bpp, numpy=numpy):
+                    patch = mock.patch.object(station, "np", None)
+                    if not numpy:
+                        patch.start()
+                    try:
+                        test(self.display(bpp), bpp, pixel)
+                    finally:
+                        if not numpy:
+                            patch.stop()
+
+    def test_fill(self):
+        def test(display, bpp, pixel):
+            display.fill_screen((200, 100, 50))
+            expected = [[pixel((200, 100, 50))] * WIDTH] * HEIGHT
+            self.assertEqual(self.pixels(bpp), expected)
+
+        self.check_depths(test)
+
+    def test_image(self):
+        colors = [(255, 0, 0), (0, 255, 0), (0, 0, 255), (12, 34, 56)]
+
+        def test(display, bpp, pixel):
+            img = Image.new("RGB", (WIDTH, HEIGHT))
+            img.putdata(
+                [colors[(x + y) % 4] for y in range(HEIGHT) for x in range(WIDTH)]
+            )
+            display.display_image(img)
+            expected = [
+                [pixel(colors[(x + y) % 4]) for x in range(WIDTH)]
+                for y in range(HEIGHT)
+            ]
+            self.assertEqual(self.pixels(bpp), expected)
+
+        self.check_depths(test)
+
+    def test_dirty_box(self):
+        background, drawn = (0, 0, 80), (250, 250, 0)
+        box = (2, 1, 5, 3)
+
+        def test(display, bpp, pixel):
+            display.fill_screen(background)
+            # A whole frame of the other color, only its box is written
+            data = display.image_frame(Image.new("RGB", (WIDTH, HEIGHT), drawn))
+            display.blit(station.Frame(data, background, box))
+            left, top, right, bottom = box
+            expected = [
+                [
+                    pixel(
+                        drawn if left <= x < right and top <= y < bottom else background
+                    )
+                    for x in range(WIDTH)
+                ]
+                for y in range(HEIGHT)
+            ]
+            self.assertEqual(self.pixels(bpp), expected)
+
+            # Another background is a full repaint
+            display.blit(station.Frame(data, drawn, box))
+            self.assertEqual(self.pixels(bpp), [[pixel(drawn)] * WIDTH] * HEIGHT)
+
+        self.check_depths(test)
+
+
+class NoEdgeGPIO(FakeGPIO):
+    """A GPIO without edge detection, as on some kernels"""
+
+    def add_event_detect(self, pin, edge, callback=None, bouncetime=None):
+        raise RuntimeError("Failed to add edge detection")
+
+
+class InputsTest(unittest.IsolatedAsyncioTestCase):
+    """The button and fence edges seen from pulses on a fake GPIO."""
+
+    async def pulses(self, gpio, length, count, gap, bounces=0):
+        """
+        Drive count pulses, each starting with bounces contact bounces, and
+        return the edges reported, once the inputs settled.
+        """
+        inputs = station.GPIOInputs(gpio)
+        inputs.watch(PIN)
+        edges = []
+
+        async def collect():
+            while True:
+                edges.append(await inputs.events.get())
+
+        def drive():
+            # In a thread of its own, as the hardware
+            for _ in range(count):
+                for _ in range(bounces):
+                    gpio.drive(PIN, 0)
+                    gpio.drive(PIN, 1)
+                gpio.drive(PIN, 0)
+                time.sleep(length)
+                gpio.drive(PIN, 1)
+                time.sleep(gap)
+
+        collector = asyncio.create_task(collect())
+        try:
+            await asyncio.to_thread(drive)
+            await asyncio.sleep(2 * station.DEBOUNCE)
+        finally:
+            collector.cancel()
+            inputs.close()
+            gpio.cleanup()
+        return inputs, [edge.active for edge in edges]
+
+    async def test_debounce_length_pulses(self):
+        _, edges = await self.pulses(FakeGPIO(), station.DEBOUNCE, 10, 0.05)
+        self.assertEqual(edges, [True, False] * 10)
+
+    async def test_bounce_ignored(self):
+        _, edges = await self.pulses(FakeGPIO(), 0.05, 10, 0.05, bounces=3)
+        self.assertEqual(edges, [True, False] * 10)
+
+    async def test_polling_fallback(self):
+        length = gap = 2 * station.POLL_INTERVAL
+        inputs, edges = await self.pulses(NoEdgeGPIO(), length, 3, gap)
+        self.assertEqual(len(inputs.polls), 1)
+        self.assertEqual(edges, [True, False] * 3)
+
+
+@unittest.skipUnless(SERVER_FRAMES.exists(), "race/frames.py is not alongside")
+class FramesTest(unittest.TestCase):
+    """The station copy of the frame format against the server one."""
+
+    key = b"station secret"
+
+    @classmethod
+    def setUpClass(cls):
+        spec = importlib.util.spec_from_file_location("frames", SERVER_FRAMES)
+        cls.server = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(cls.server)
+
+    def messages(self):
+        for name in self.server.MESSAGE_TYPES:
+            yield {"type": name, "station": "pit-1", "team": 7}
+            yield {
+                "type": name,
+                "station": "pit-1",
+                "response": "penalty_served",
+                "counter": 42,
+                "timestamp": "2026-10-17T14:03:21.123456",
+            }
+
+    def test_constants(self):
+        self.assertEqual(station.FRAME_PROTOCOL, self.server.FRAME_PROTOCOL)
+        self.assertEqual(station.FRAME_VERSION, self.server.FRAME_VERSION)
+        self.assertEqual(station.FRAME_HEADER.format, self.server.HEADER.format)
+        self.assertEqual(station.FRAME_SIGNATURE_SIZE, self.server.SIGNATURE_SIZE)
+        self.assertEqual(station.FRAME_TYPES, self.server.MESSAGE_TYPES)
+
+    def test_same_bytes(self):
+        for message in self.messages():
+            with self.subTest(message=message):
+                self.assertEqual(
+                    station.encode_frame(message, self.key),
+                    self.server.encode_frame(message, self.key),
+                )
+
+    def test_both_ways(self):
+        for message in self.messages():
+            with self.subTest(message=message):
+                frame = station.encode_frame(message, self.key)
+                self.assertEqual(self.server.decode_frame(frame, self.key), message)
+                frame = self.server.encode_frame(message, self.key)
+                self.assertEqual(station.decode_frame(frame, self.key), message)
+
+    def test_tampered(self):
+        message = next(self.messages())
+        frame = bytearray(self.server.encode_frame(message, self.key))
+        frame[-1] ^= 0x01
+        self.assertIsNone(station.decode_frame(bytes(frame), self.key))
+        frame = station.encode_frame(message, b"another secret")
+        self.assertIsNone(self.server.decode_frame(frame, self.key))
+
+
+if __name__ == "__main__":
+    unittest.main()